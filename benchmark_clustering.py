@@ -0,0 +1,65 @@
+import time
+import argparse
+
+import numpy as np
+from river import compose
+from river import preprocessing
+from river.cluster import STREAMKMeans
+
+from streaming_kmeans import StreamingKMeans
+
+
+def synthetic_observations(n, seed=0):
+    """
+    Generate `n` (temperature, precipitation) observations shaped like NOAA forecasts.
+    """
+    rng = np.random.default_rng(seed)
+    temperature = rng.normal(60, 15, n).round()
+    precipitation = np.where(rng.random(n) < 0.6, 0, rng.integers(0, 101, n))
+    return np.column_stack([temperature, precipitation]).astype(float)
+
+
+def time_per_event(name, n, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<40} {elapsed / n * 1e6:8.2f} us/event {n / elapsed:12,.0f} events/s")
+    return elapsed
+
+
+def benchmark(args):
+    X = synthetic_observations(args.events, seed=args.seed)
+    rows = [{"temperature": t, "precipitation": p} for t, p in X]
+    print(f"clustering {args.events} synthetic observations")
+
+    def river_pipeline():
+        model = compose.Pipeline(
+            preprocessing.StandardScaler(),
+            STREAMKMeans(chunk_size=3, n_clusters=5, halflife=0.5, sigma=1.5, seed=0)
+        )
+        for x in rows:
+            model = model.learn_one(x)
+            model.predict_one(x)
+
+    def numpy_one():
+        model = StreamingKMeans(n_clusters=5, n_features=2, halflife=0.5, sigma=1.5, seed=0)
+        for x in X:
+            model.learn_predict_one(x)
+
+    def numpy_many():
+        model = StreamingKMeans(n_clusters=5, n_features=2, halflife=0.5, sigma=1.5, seed=0)
+        for start in range(0, len(X), args.batch_size):
+            model.learn_predict_many(X[start:start + args.batch_size])
+
+    baseline = time_per_event("river StandardScaler + STREAMKMeans", len(X), river_pipeline)
+    one = time_per_event("StreamingKMeans, one event at a time", len(X), numpy_one)
+    many = time_per_event(f"StreamingKMeans, batches of {args.batch_size}", len(X), numpy_many)
+    print(f"speedup over river: {baseline / one:.1f}x per event, {baseline / many:.1f}x batched")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the river clustering pipeline with StreamingKMeans")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=0)
+    benchmark(parser.parse_args())
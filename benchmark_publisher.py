@@ -0,0 +1,106 @@
+import time
+import random
+import asyncio
+import argparse
+
+from noaa_standin import serve, standin_arguments, standin_from_arguments
+from weather_publisher import WeatherPublisher
+from city_catalog import CityCatalog, default_catalog
+
+
+class NullEnsign:
+    """
+    NullEnsign stands in for the Ensign client during the benchmark: it accepts every
+    event and acks it on the next turn of the event loop, so the benchmark measures
+    the publisher rather than the network to Ensign.
+    """
+
+    def __init__(self):
+        self.events = 0
+
+    async def ensure_topic_exists(self, topic):
+        return topic
+
+    async def publish(self, topic, *events, on_ack=None, on_nack=None):
+        self.events += len(events)
+        if on_ack is not None:
+            for _ in events:
+                asyncio.get_running_loop().call_soon(asyncio.ensure_future, on_ack(None))
+
+
+def load_locations(count, seed=0):
+    """
+    Load a catalog of `count` locations, repeating the cities in cities.json with
+    their coordinates shifted by up to half a degree once the file runs out.
+    """
+    cities = default_catalog()
+
+    rng = random.Random(seed)
+    catalog = CityCatalog()
+    for i in range(count):
+        city = cities[i % len(cities) + 1]
+        lat, lon = city.lat, city.lon
+        name = city.name
+        if i >= len(cities):
+            lat += rng.uniform(-0.5, 0.5)
+            lon += rng.uniform(-0.5, 0.5)
+            name = f"{name} #{i // len(cities)}"
+        catalog.add(name, city.state, round(lat, 4), round(lon, 4))
+    return catalog
+
+
+async def benchmark(args):
+    standin = standin_from_arguments(args)
+    runner, port = await serve(standin, port=0)
+
+    ensign = NullEnsign()
+    publisher = WeatherPublisher(
+        url=f"http://127.0.0.1:{port}/points/",
+        transport=ensign,
+        link_cache=None,
+        state=None,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        batch=args.batch,
+        timeout=args.timeout,
+        cities=load_locations(args.cities, seed=args.seed),
+    )
+
+    print(f"benchmarking {len(publisher.catalog)} locations against the NOAA stand-in on port {port}")
+    try:
+        async with publisher.open_session() as session:
+            for sweep in range(args.sweeps):
+                if args.reset:
+                    publisher.links.entries.clear()
+                    publisher.state.validators.clear()
+                    publisher.state.hashes.clear()
+
+                requests, events = standin.stats["requests"], ensign.events
+                started = time.perf_counter()
+                await publisher.sweep(session)
+                elapsed = time.perf_counter() - started
+
+                requests = standin.stats["requests"] - requests
+                events = ensign.events - events
+                print(
+                    f"sweep {sweep + 1}: {elapsed:.2f}s, {requests} requests "
+                    f"({requests / elapsed:.1f} req/s), {events} events "
+                    f"({events / elapsed:.1f} events/s)"
+                )
+    finally:
+        await runner.cleanup()
+
+    print("stand-in responses:", dict(standin.stats))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark WeatherPublisher sweeps against a local NOAA stand-in")
+    parser.add_argument("--cities", type=int, default=1000, help="number of locations per sweep")
+    parser.add_argument("--sweeps", type=int, default=3, help="number of sweeps to run")
+    parser.add_argument("--reset", action="store_true", help="clear the link cache and forecast state before each sweep")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=1000, help="publisher requests per second cap")
+    parser.add_argument("--batch", choices=["city", "sweep"], default=None)
+    parser.add_argument("--timeout", type=int, default=30)
+    standin_arguments(parser)
+    asyncio.run(benchmark(parser.parse_args()))
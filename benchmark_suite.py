@@ -0,0 +1,306 @@
+"""
+Throughput and latency benchmarks of every step forecasts go through, on synthetic
+forecast periods (see `synthetic_events`):
+
+    serialize   encoding forecast periods into events (make_event)
+    decode      the WeatherSubscriber decode stage
+    features    the WeatherSubscriber features stage
+    model       the WeatherSubscriber model stage (StreamingKMeans update and assign)
+    pipeline    WeatherSubscriber.subscribe over a local event log, from an event being
+                delivered to it being acked once its cluster results are committed
+    clusters    ClusterSubscriber.handle_event indexing and storing cluster results
+
+Each benchmark reports events per second and the p99 latency of one call (one event,
+or one micro-batch with --batch-size). Results are compared to a stored baseline and
+the script exits with status 1 if any benchmark is more than --tolerance slower:
+
+    python benchmark_suite.py --save-baseline    # after a change that is meant to be slower or faster
+    python benchmark_suite.py                    # check for regressions
+
+Baselines depend on the machine, so benchmark_baseline.json is not committed: save
+one on each machine before comparing, and a baseline saved on another machine (or
+with other settings) is not compared against.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+
+import numpy as np
+
+from city_cluster_results_subscriber import ClusterSubscriber
+from event_log import EventLog
+from synthetic_events import SyntheticForecasts, write_log
+from weather_subscriber_streamkmeans import ForecastBatch, WeatherSubscriber
+from wire_format import make_event
+
+
+BASELINE = "benchmark_baseline.json"
+
+
+class Timings:
+    """
+    The duration of every call of a benchmark and the number of events they handled.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.events = 0
+        self.elapsed = 0.0
+
+    def result(self):
+        return {
+            "events_per_s": round(self.events / self.elapsed, 1),
+            "p99_us": round(float(np.percentile(self.latencies, 99)) * 1e6, 1),
+        }
+
+
+def timed(name, items, fn, events_per_item=1):
+    """
+    Call `fn` with every item, timing each call.
+    """
+    timings = Timings(name)
+    started = time.perf_counter()
+    for item in items:
+        call = time.perf_counter()
+        fn(item)
+        timings.latencies.append(time.perf_counter() - call)
+    timings.elapsed = time.perf_counter() - started
+    timings.events = len(items) * events_per_item
+    return timings
+
+
+async def timed_async(name, items, fn, events_per_item=1):
+    timings = Timings(name)
+    started = time.perf_counter()
+    for item in items:
+        call = time.perf_counter()
+        await fn(item)
+        timings.latencies.append(time.perf_counter() - call)
+    timings.elapsed = time.perf_counter() - started
+    timings.events = len(items) * events_per_item
+    return timings
+
+
+class TimedEvent:
+    """
+    TimedEvent wraps a delivered event to record the time until it is acked.
+    """
+
+    def __init__(self, event, timings, done):
+        self.event = event
+        self.timings = timings
+        self.done = done
+        self.delivered = time.perf_counter()
+
+    def __getattr__(self, name):
+        return getattr(self.event, name)
+
+    async def ack(self):
+        self.timings.latencies.append(time.perf_counter() - self.delivered)
+        if len(self.timings.latencies) == self.timings.events:
+            self.done.set()
+        return await self.event.ack()
+
+    async def nack(self, code):
+        return await self.event.nack(code)
+
+
+class TimedLog:
+    """
+    TimedLog is an EventLog whose subscriptions yield TimedEvents.
+    """
+
+    def __init__(self, log, timings, done):
+        self.log = log
+        self.timings = timings
+        self.done = done
+
+    def __getattr__(self, name):
+        return getattr(self.log, name)
+
+    async def subscribe(self, *topics, **kwargs):
+        async for event in self.log.subscribe(*topics, **kwargs):
+            yield TimedEvent(event, self.timings, self.done)
+
+
+def chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def subscriber(transport=object(), batch_size=None):
+    return WeatherSubscriber(transport=transport, batch_size=batch_size, checkpoint=None, print_every=0)
+
+
+def stage_benchmarks(periods, events, batch_size):
+    """
+    Time the serialization and the decode, features and model stages on the events.
+    """
+    size = batch_size or 1
+    model = subscriber()
+    results = [timed("serialize", periods, lambda data: make_event([data]))]
+
+    batches = [ForecastBatch(group) for group in chunks(events, size)]
+    results.append(timed("decode", batches, model.decode, size))
+    results.append(timed("features", batches, model.extract, size))
+    results.append(asyncio.run(timed_async("model", batches, model.learn, size)))
+    return results
+
+
+async def pipeline_benchmark(events, batch_size):
+    """
+    Time WeatherSubscriber.subscribe on the events, published to a temporary event log.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        await write_log(path, "weather-forecasts", events)
+        log = EventLog(path)
+        await log.ensure_topic_exists("city-clusters")
+
+        timings = Timings("pipeline")
+        timings.events = len(events)
+        done = asyncio.Event()
+        model = subscriber(TimedLog(log, timings, done), batch_size=batch_size)
+
+        started = time.perf_counter()
+        task = asyncio.create_task(model.subscribe())
+        await done.wait()
+        timings.elapsed = time.perf_counter() - started
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        log.close()
+    return timings
+
+
+async def clusters_benchmark(periods):
+    """
+    Time ClusterSubscriber.handle_event on cluster results read from a temporary event
+    log, with the history stored in a temporary directory.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        results = [make_event([dict(data, cluster=i % 5)]) for i, data in enumerate(periods)]
+        await write_log(os.path.join(path, "log"), "city-clusters", results)
+        log = EventLog(os.path.join(path, "log"))
+        clusters = ClusterSubscriber(
+            transport=log, results=None, store=os.path.join(path, "store"), print_every=0
+        )
+
+        timings = Timings("clusters")
+        received = []
+        subscription = log.subscribe("city-clusters")
+        async for event in subscription:
+            received.append(event)
+            if len(received) == len(results):
+                break
+        await subscription.aclose()
+
+        started = time.perf_counter()
+        for event in received:
+            call = time.perf_counter()
+            await clusters.handle_event(event)
+            timings.latencies.append(time.perf_counter() - call)
+        timings.elapsed = time.perf_counter() - started
+        timings.events = len(received)
+        clusters.store.close()
+        log.close()
+    return timings
+
+
+def run(args):
+    """
+    Run every benchmark `args.repeat` times and keep the fastest run of each.
+    """
+    generator = SyntheticForecasts(seed=args.seed)
+    periods = list(generator.periods(args.events))
+    events = [make_event([data]) for data in periods]
+
+    best = dict()
+    for _ in range(args.repeat):
+        runs = stage_benchmarks(periods, events, args.batch_size)
+        runs.append(asyncio.run(pipeline_benchmark(events, args.batch_size)))
+        runs.append(asyncio.run(clusters_benchmark(periods)))
+        for timings in runs:
+            result = timings.result()
+            if timings.name not in best or result["events_per_s"] > best[timings.name]["events_per_s"]:
+                best[timings.name] = result
+    return best
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the results next to the baseline and return the names of the benchmarks
+    that regressed by more than `tolerance` in throughput or p99 latency.
+    """
+    regressions = []
+    print(f"{'benchmark':<12} {'events/s':>12} {'baseline':>12} {'p99 us':>10} {'baseline':>10}")
+    for name, result in results.items():
+        base = baseline.get(name, None)
+        if base is None:
+            print(f"{name:<12} {result['events_per_s']:>12,.0f} {'-':>12} {result['p99_us']:>10,.1f} {'-':>10}")
+            continue
+
+        slower = result["events_per_s"] < base["events_per_s"] * (1 - tolerance)
+        later = result["p99_us"] > base["p99_us"] * (1 + tolerance)
+        flag = "  REGRESSION" if slower or later else ""
+        print(
+            f"{name:<12} {result['events_per_s']:>12,.0f} {base['events_per_s']:>12,.0f} "
+            f"{result['p99_us']:>10,.1f} {base['p99_us']:>10,.1f}{flag}"
+        )
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the forecast pipeline and check for regressions")
+    parser.add_argument("--events", type=int, default=20000, help="number of synthetic forecast periods")
+    parser.add_argument("--batch-size", type=int, default=None, help="micro-batch size, one event at a time by default")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each benchmark, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE, help="the stored baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a regression, e.g. 0.25 = 25%%")
+    args = parser.parse_args()
+
+    config = {"events": args.events, "batch_size": args.batch_size, "seed": args.seed}
+    machine = f"{platform.node()}: {platform.machine()} {platform.processor() or platform.system()}, Python {platform.python_version()}"
+    results = run(args)
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        # Results of other settings or machines are not comparable, so nothing is flagged
+        if stored.get("config", None) != config:
+            print(
+                f"The baseline was run with {stored.get('config', None)}, not {config}: "
+                f"skipping the comparison"
+            )
+        elif stored.get("machine", None) != machine:
+            print(f"The baseline was run on {stored.get('machine', None)}, not {machine}: skipping the comparison")
+        else:
+            baseline = stored["results"]
+    elif not args.save_baseline:
+        print(f"No baseline at {args.baseline}, save one on this machine with --save-baseline")
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "config": config,
+                "machine": machine,
+                "results": results,
+            }, f, indent=2)
+        print(f"Saved the baseline to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} benchmarks regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
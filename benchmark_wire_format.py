@@ -0,0 +1,88 @@
+import json
+import time
+import argparse
+
+from benchmark_publisher import NullEnsign, load_locations
+from noaa_standin import generate_forecast, grid_cell
+from weather_publisher import WeatherPublisher
+from wire_format import columns, decode, decode_event, encode, make_event
+
+
+def forecast_periods(count, seed=0):
+    """
+    Unpack a generated forecast for `count` locations into the periods the publisher
+    sends, grouped by location.
+    """
+    publisher = WeatherPublisher(
+        transport=NullEnsign(), link_cache=None, state=None, cities=load_locations(count, seed=seed)
+    )
+    generated = int(time.time()) // 3600 * 3600
+
+    cities = []
+    for location in publisher.catalog:
+        office, x, y = grid_cell(location.lat, location.lon)
+        forecast = generate_forecast(office, f"{x},{y}", generated)
+        cities.append(list(publisher.unpack_periods(forecast, location.id, changed_only=False)))
+    return cities
+
+
+def time_per_event(name, n, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<44} {elapsed / n * 1e6:8.2f} us/event {n / elapsed:12,.0f} events/s")
+    return elapsed
+
+
+def benchmark(args):
+    cities = forecast_periods(args.cities, seed=args.seed)
+    periods = [data for city in cities for data in city]
+
+    # One event per period, as published without batching, and one event per city
+    for label, groups in [("one period per event", [[data] for data in periods]),
+                          ("one city per event", cities)]:
+        json_events = [make_event(group, wire="json") for group in groups]
+        binary_events = [make_event(group, wire="binary") for group in groups]
+        json_bytes = sum(len(event.data) for event in json_events)
+        binary_bytes = sum(len(event.data) for event in binary_events)
+
+        print(f"\n{len(groups)} events, {label}")
+        print(f"{'JSON payload':<44} {json_bytes / len(groups):8.1f} bytes/event")
+        print(f"{'binary payload':<44} {binary_bytes / len(groups):8.1f} bytes/event "
+              f"({binary_bytes / json_bytes:.0%} of JSON)")
+
+        def json_encode():
+            for group in groups:
+                json.dumps(group[0] if len(group) == 1 else {"periods": group}).encode("utf-8")
+
+        def binary_encode():
+            for group in groups:
+                encode(group)
+
+        def json_decode():
+            for event in json_events:
+                decode_event(event)
+
+        def binary_decode():
+            for event in binary_events:
+                decode(event.data)
+
+        def binary_columns():
+            for event in binary_events:
+                records = columns(event.data)
+                records["temperature"], records["precipitation"]
+
+        n = len(groups)
+        time_per_event("encode JSON", n, json_encode)
+        time_per_event("encode binary", n, binary_encode)
+        baseline = time_per_event("decode JSON", n, json_decode)
+        full = time_per_event("decode binary to dicts", n, binary_decode)
+        fields = time_per_event("read binary feature columns", n, binary_columns)
+        print(f"decode speedup over JSON: {baseline / full:.1f}x to dicts, {baseline / fields:.1f}x columns only")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the size and decode time of the JSON and binary wire formats")
+    parser.add_argument("--cities", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    benchmark(parser.parse_args())
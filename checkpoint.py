@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import struct
+
+import numpy as np
+
+
+MAGIC = b"WKMC"
+VERSION = 2
+
+# magic, version, clusters, features, scaler count, last offset (-1 if none), saved at,
+# length of the JSON description of the features that follows the header
+HEADER = struct.Struct("<4sHHHqqdH")
+
+
+def describe(features):
+    """
+    Return the description of a FeatureExtractor's features stored in checkpoints.
+    """
+    return {"features": list(features.features), "units": features.units}
+
+
+def save_checkpoint(path, model, offset=None, features=None):
+    """
+    Atomically write a snapshot of a clustering model's scaler statistics and centers,
+    together with the offset of the last event the subscriber is done with and the
+    names and units of the features it clusters on.
+
+    The snapshot is written to a temporary file, flushed to disk and then renamed over
+    `path`, so a crash while saving always leaves the previous snapshot intact.
+
+    Parameters
+    ----------
+    path : string
+        The checkpoint file
+
+    model : StreamingKMeans or ShardedClusterer
+        The model to snapshot; the centers of a sharded model are merged into the
+        snapshot without changing the model
+
+    offset : int, default: None
+        The offset of the last event a restarted subscriber should resume after
+
+    features : FeatureExtractor, default: None
+        The features of the observations, so that the snapshot is not restored into a
+        model of other features
+    """
+    centers, weights = model.merged() if hasattr(model, "merged") else (model.centers, model.weights)
+
+    description = json.dumps(None if features is None else describe(features)).encode("utf-8")
+    # Pad the description so that the arrays after it are 8-byte aligned
+    description += b" " * (-(HEADER.size + len(description)) % 8)
+    scaler = model.scaler
+    header = HEADER.pack(
+        MAGIC, VERSION, model.n_clusters, model.n_features, scaler.count,
+        -1 if offset is None else offset, time.time(), len(description),
+    )
+    arrays = [scaler.mean, scaler.m2, centers, weights]
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(description)
+        for array in arrays:
+            f.write(np.ascontiguousarray(array, dtype="<f8").tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, model, features=None):
+    """
+    Restore a snapshot written by `save_checkpoint` into `model`.
+
+    Parameters
+    ----------
+    path : string
+        The checkpoint file
+
+    model : StreamingKMeans or ShardedClusterer
+        The model to restore into
+
+    features : FeatureExtractor, default: None
+        The features of the model, which must be the ones (and in the units) the
+        snapshot was taken with
+
+    Returns
+    -------
+    offset : int or None
+        The offset of the last event to resume after, or None if the snapshot does
+        not record one
+
+    Raises
+    ------
+    ValueError
+        If the file is not a checkpoint or was taken from a model of a different shape
+        or of other features
+    """
+    with open(path, "rb") as f:
+        contents = f.read()
+
+    if len(contents) < HEADER.size or contents[:4] != MAGIC:
+        raise ValueError(f"{path} is not a model checkpoint")
+    if struct.unpack_from("<H", contents, 4)[0] != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} model checkpoint")
+    _, _, clusters, n_features, count, offset, _, length = HEADER.unpack_from(contents)
+    if clusters != model.n_clusters or n_features != model.n_features:
+        raise ValueError(
+            f"checkpoint has {clusters} clusters of {n_features} features, the model has "
+            f"{model.n_clusters} clusters of {model.n_features} features"
+        )
+
+    saved = json.loads(contents[HEADER.size:HEADER.size + length])
+    if features is not None and saved != describe(features):
+        found = "unknown features" if saved is None else f"{','.join(saved['features'])} in {saved['units']}"
+        raise ValueError(
+            f"checkpoint has {found}, the model has "
+            f"{','.join(features.features)} in {features.units}"
+        )
+
+    values = np.frombuffer(contents, dtype="<f8", offset=HEADER.size + length)
+    sizes = [n_features, n_features, clusters * n_features, clusters]
+    if len(values) != sum(sizes):
+        raise ValueError(f"{path} is truncated")
+    mean, m2, centers, weights = np.split(values, np.cumsum(sizes)[:-1])
+
+    model.scaler.count = count
+    model.scaler.mean = mean.copy()
+    model.scaler.m2 = m2.copy()
+    model.centers = centers.reshape(clusters, n_features).copy()
+    model.weights = weights.copy()
+    if hasattr(model, "broadcast"):
+        model.broadcast()
+
+    return None if offset < 0 else offset
@@ -0,0 +1,227 @@
+import re
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from array import array
+from functools import lru_cache
+
+
+class City:
+    """
+    A city of the catalog: its ID, name, state and coordinates in degrees.
+    """
+
+    __slots__ = ("id", "name", "state", "lat", "lon")
+
+    def __init__(self, id, name, state, lat, lon):
+        self.id = id
+        self.name = name
+        self.state = state
+        self.lat = lat
+        self.lon = lon
+
+    @property
+    def label(self):
+        return label(self.name, self.state)
+
+    def __repr__(self):
+        return f"City({self.id}, {self.label!r}, {self.lat}, {self.lon})"
+
+
+def label(name, state):
+    """
+    Return the unique, human readable key of a city, e.g. "Springfield, Illinois".
+    """
+    return name if state is None else f"{name}, {state}"
+
+
+def iter_json_array(f, chunk_size=1 << 16):
+    """
+    Yield the elements of a JSON array from a file one at a time, reading it in chunks
+    rather than parsing the whole document at once.
+    """
+    scan = json.JSONDecoder().scan_once
+    buffer = ""
+    position = 0
+    eof = False
+
+    # Skip the opening bracket
+    while not buffer.lstrip() and not eof:
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+    match = _OPEN.match(buffer)
+    if match is None:
+        raise ValueError("expected a JSON array")
+    position = match.end()
+
+    while True:
+        # Skip whitespace and the comma between elements
+        position = _SEPARATOR.match(buffer, position).end()
+        if position < len(buffer):
+            if buffer[position] == "]":
+                return
+            try:
+                element, end = scan(buffer, position)
+            except (StopIteration, json.JSONDecodeError):
+                end = None
+            # An element running up to the end of the buffer may continue in the next chunk
+            if end is not None and (end < len(buffer) or eof):
+                yield element
+                position = end
+                continue
+
+        if eof:
+            raise ValueError(f"invalid or truncated JSON array at character {position}")
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+_OPEN = re.compile(r"\s*\[")
+_SEPARATOR = re.compile(r"[\s,]*")
+
+
+class CityCatalog:
+    """
+    CityCatalog is the list of cities forecasts are published for. Every city has an
+    integer ID (its 1-based position in the catalog; 0 means no city) and a unique
+    (name, state) key, so that cities with the same name in different states are
+    distinct. Publishers and subscribers refer to cities by ID.
+
+    Cities are stored column-wise: names and states as interned strings, coordinates
+    in float arrays. City objects are only created when a city is looked up.
+    """
+
+    def __init__(self, names=(), states=(), lats=(), lons=()):
+        self.names = []
+        self.states = []
+        self.lats = array("d")
+        self.lons = array("d")
+        # (name, state) -> ID, and name -> ID or AMBIGUOUS for names shared by several states
+        self.by_key = dict()
+        self.by_name = dict()
+        for name, state, lat, lon in zip(names, states, lats, lons):
+            self.add(name, state, lat, lon)
+
+    AMBIGUOUS = -1
+
+    def add(self, name, state, lat, lon):
+        """
+        Add a city and return its ID. A (name, state) that is already in the catalog
+        keeps its first ID and coordinates.
+        """
+        name = sys.intern(name)
+        state = None if state is None else sys.intern(state)
+        id = self.by_key.get((name, state), None)
+        if id is not None:
+            return id
+
+        self.names.append(name)
+        self.states.append(state)
+        self.lats.append(float(lat))
+        self.lons.append(float(lon))
+        id = len(self.names)
+        self.by_key[(name, state)] = id
+        self.by_name[name] = id if name not in self.by_name else self.AMBIGUOUS
+        return id
+
+    @classmethod
+    def load(cls, path="cities.json"):
+        """
+        Load a catalog from a JSON array of objects with "city", "state", "latitude"
+        and "longitude" fields (like cities.json), parsing one city at a time.
+        """
+        catalog = cls()
+        with open(path, encoding="utf-8") as f:
+            for city in iter_json_array(f):
+                catalog.add(city["city"], city.get("state", None), city["latitude"], city["longitude"])
+        return catalog
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, id):
+        return isinstance(id, int) and 0 < id <= len(self.names)
+
+    def __getitem__(self, id):
+        if id not in self:
+            raise KeyError(id)
+        i = id - 1
+        return City(id, self.names[i], self.states[i], self.lats[i], self.lons[i])
+
+    def __iter__(self):
+        for id in self.ids():
+            yield self[id]
+
+    def ids(self):
+        return range(1, len(self.names) + 1)
+
+    def name(self, id):
+        return self.names[id - 1]
+
+    def state(self, id):
+        return self.states[id - 1]
+
+    def label(self, id):
+        return label(self.names[id - 1], self.states[id - 1])
+
+    def id_of(self, name, state=None):
+        """
+        Return the ID of a city from its name and state, or from its name alone if
+        only one state has a city of that name. Returns None if there is no such city
+        or the name alone is ambiguous.
+        """
+        if state is not None:
+            return self.by_key.get((name, state), None)
+        id = self.by_name.get(name, None)
+        return None if id == self.AMBIGUOUS else id
+
+    def resolve(self, text):
+        """
+        Return the ID of a city given as an ID, a "name, state" label or a name.
+        """
+        if isinstance(text, int) or text.isdigit():
+            id = int(text)
+            return id if id in self else None
+        id = self.id_of(text)
+        if id is None and ", " in text:
+            name, _, state = text.rpartition(", ")
+            id = self.id_of(name, state)
+        return id
+
+
+@lru_cache(maxsize=None)
+def default_catalog(path="cities.json"):
+    """
+    Return the catalog of cities.json, loaded once per process. Publishers and
+    subscribers share it, so its IDs mean the same city on both sides.
+    """
+    return CityCatalog.load(path)
+
+
+def city_key(record):
+    """
+    Return the key of the city of a forecast period record: its catalog ID, or its
+    name for records published without one.
+    """
+    return record.get("city_id", None) or record["city"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure loading a city catalog")
+    parser.add_argument("path", nargs="?", default="cities.json")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    catalog = CityCatalog.load(args.path)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    print(
+        f"loaded {len(catalog)} cities in {elapsed * 1000:.1f}ms, "
+        f"{current / len(catalog):.0f} bytes per city, peak {peak / 1e6:.1f}MB"
+    )
@@ -1,10 +1,20 @@
-import json
+import time
 import asyncio
+import argparse
 import os
+import json
 
-from pyensign.ensign import Ensign
 from pyensign.api.v1beta1.ensign_pb2 import Nack
 
+from transports import make_transport, transport_argument
+from wire_format import decode_event
+from cluster_index import ClusterIndex
+from cluster_windows import ClusterMembership, is_summary
+from cluster_store import ClusterStore
+from dashboard_server import DashboardServer
+from spatial_index import SpatialIndex
+from metrics import MetricsExporter, Sampler, counter, histogram, metrics_arguments, published_at
+
 
 class ClusterSubscriber:
     """
@@ -12,7 +22,9 @@ class ClusterSubscriber:
     and  Clustering Model is writing new model results to.
     """
 
-    def __init__(self, topic="city-clusters"):
+    def __init__(self, topic="city-clusters", transport="ensign", results="city_cluster_index",
+                 compact_every=10000, store="cluster_store", dashboard=None,
+                 print_every=100, metrics_port=None, stats=None):
         """
         Initialize the ClusterSubscriber, which will allow a data consumer to subscribe
         to the topic that the upstream subscriber/model/publisher is writing model results to
@@ -21,22 +33,57 @@ class ClusterSubscriber:
         ----------
         topic : string, default: "noaa-reports-json"
             The name of the topic you wish to subscribe to.
+
+        transport : string or client, default: "ensign"
+            The transport to subscribe with, either the name of a transport ("ensign",
+            "local" or "local:<path>") or a client object, see `transports`
+
+        results : string, default: "city_cluster_index"
+            The prefix of the files the latest cluster result of every forecast period
+            is persisted to (a <results>.json snapshot and a <results>.jsonl log), for
+            reporting and dashboards. Set to None to keep the results in memory only.
+
+        compact_every : int, default: 10000
+            The number of results logged between two compactions into the snapshot
+
+        store : string, default: "cluster_store"
+            The directory of the columnar, day-partitioned history of every cluster
+            result, which answers time-range queries (see `cluster_store`). Set to None
+            to not keep a history.
+
+        dashboard : int, default: None
+            Serve the cluster results to dashboards over HTTP on this port (see
+            `dashboard_server`). None disables the dashboard endpoint.
+
+        print_every : int, default: 100
+            Print one cluster result in this many, 0 to print none
+
+        metrics_port : int, default: None
+            Serve Prometheus metrics on this port while subscribed, see `metrics`
+
+        stats : string, default: None
+            Periodically write the metrics to this JSON file while subscribed
         """
         self.topic = topic
+        self.index = ClusterIndex(path=results, compact_every=compact_every)
+        self.store = ClusterStore(path=store) if store else None
+        self.membership = ClusterMembership()
+        self.dashboard = None
+        if dashboard is not None:
+            self.dashboard = DashboardServer(
+                self.index, self.store, spatial=SpatialIndex.from_catalog(),
+                membership=self.membership, port=dashboard,
+            )
         
-        keys = self._load_keys()
+        self.transport = make_transport(transport)
+
+        self.sample = Sampler(print_every)
+        self.exporter = MetricsExporter(port=metrics_port, stats=stats)
+        self.results = counter("cluster_results_total", "Cluster results received")
+        self.invalid = counter("cluster_results_invalid_total", "Cluster results that could not be indexed")
+        self.lag = histogram("cluster_result_lag_seconds", "Time from a cluster result being published to it being indexed")
+        self.index_seconds = histogram("stage_seconds", "Time a stage spends on an item", stage="index")
 
-        self.ensign = Ensign(
-            client_id=keys["ClientID"],
-            client_secret=keys["ClientSecret"]
-        )
-    def _load_keys(self):
-        try:
-            f = open("client.json")
-            return json.load(f)
-        except Exception as e:
-            raise OSError(f"unable to load Ensign API keys from file: ", e)
-        
     def run(self):
         """
         Run the subscriber forever.
@@ -45,55 +92,95 @@ class ClusterSubscriber:
 
     async def handle_event(self, event):
         """
-        Decode and ack the event.
+        Decode, index and ack the event. Records that cannot be indexed, e.g. with a
+        missing or malformed field, are logged and skipped rather than failing the
+        event or the subscription.
         """
+        if is_summary(event):
+            await self.handle_summary(event)
+            return
         try:
-            data = json.loads(event.data)
-        except json.JSONDecodeError:
-            print("Received invalid JSON in event payload:", event.data)
+            records = decode_event(event)
+        except ValueError as e:
+            print("Received an invalid event payload:", e)
             await event.nack(Nack.Code.UNKNOWN_TYPE)
             return
-        print("New city cluster information recieved:", data)
+        started = time.perf_counter()
+        indexed = 0
+        for data in records:
+            if self.sample():
+                print("New city cluster information recieved:", data)
+            try:
+                self.index.add(data)
+                if self.store is not None:
+                    self.store.append(data)
+            except Exception as e:
+                print(f"Could not index cluster result {data!r}: {e!r}")
+                self.invalid.inc()
+                continue
+            indexed += 1
+        self.index.evict()
+        self.index_seconds.observe(time.perf_counter() - started)
+        self.results.inc(indexed)
         await event.ack()
+
+        published = published_at(event)
+        if published is not None:
+            self.lag.observe(time.time() - published)
         
-    '''
-    This is where we would insert code to support reporting and dashboards.
-    
-    This code is intended to write some of the clustered cities and weather reports 
-    to a local file for visualization mock-ups:
-    
-        filename='city_cluster_results.json'
-        try:
-            with open(filename,'r+') as file:
-                file_data = json.load(file)
-                file_data["event records":].append(data)
-                file.seek(0)
-                json.dump(file_data, file, indent = 4)
-        except Exception as e:
-            raise OSError(f"unable to load record from file: ", e)
-
-    OR
-
-    async def write_json(self, data, filename='city_cluster_results.json'):
-        filename='city_cluster_results.json'
+    async def handle_summary(self, event):
+        """
+        Apply a window summary of the clusters (see `cluster_windows`) and ack it.
+        """
         try:
-            with open(filename,'r+') as file:
-                file_data = json.load(file)
-                file_data["event records":].append(data)
-                file.seek(0)
-                json.dump(file_data, file, indent = 4)
-        except Exception as e:
-            raise OSError(f"unable to load record from file: ", e)
-    '''
+            summary = json.loads(event.data)
+            self.membership.apply(summary)
+        except (ValueError, KeyError, TypeError) as e:
+            print("Received an invalid cluster summary:", e)
+            await event.nack(Nack.Code.UNKNOWN_TYPE)
+            return
+        self.results.inc(summary["periods"])
+        if self.sample():
+            print(
+                f"New cluster summary for {summary['start']} to {summary['end']}:",
+                {cluster["cluster"]: cluster["cities"] for cluster in summary["clusters"]},
+            )
+        await event.ack()
 
     async def subscribe(self):
         """
         Subscribe to the weather report topic and parse the events.
         """
-        id = await self.ensign.topic_id(self.topic)
-        async for event in self.ensign.subscribe(id):
-            await self.handle_event(event)
+        id = await self.transport.topic_id(self.topic)
+        runner = None
+        if self.dashboard is not None:
+            runner = await self.dashboard.start()
+            print(f"Serving the cluster dashboard API on http://{self.dashboard.host}:{self.dashboard.port}")
+        await self.exporter.start()
+
+        try:
+            async for event in self.transport.subscribe(id):
+                await self.handle_event(event)
+        finally:
+            self.index.close()
+            if self.store is not None:
+                self.store.close()
+            if runner is not None:
+                await runner.cleanup()
+            await self.exporter.stop()
             
 if __name__ == "__main__":
-    subscriber = ClusterSubscriber()
+    parser = argparse.ArgumentParser(description="Subscribe to the city cluster results")
+    transport_argument(parser)
+    parser.add_argument("--results", default="city_cluster_index", help="prefix of the cluster results files, or '' to keep them in memory")
+    parser.add_argument("--store", default="cluster_store", help="directory of the cluster history, or '' to not keep one")
+    parser.add_argument("--dashboard", type=int, default=None, metavar="PORT", help="serve the cluster results to dashboards on this port")
+    metrics_arguments(parser)
+    args = parser.parse_args()
+
+    subscriber = ClusterSubscriber(
+        transport=args.transport, results=args.results or None, store=args.store or None,
+        dashboard=args.dashboard, print_every=args.print_every, metrics_port=args.metrics_port,
+        stats=args.stats_file,
+    )
     subscriber.run()
\ No newline at end of file
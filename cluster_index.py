@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import heapq
+from functools import lru_cache
+from datetime import datetime
+
+from city_catalog import city_key
+
+
+@lru_cache(maxsize=4096)
+def _epoch(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+class ClusterIndex:
+    """
+    ClusterIndex keeps the latest cluster result of every forecast period in memory,
+    indexed by city (its catalog ID, see `city_key`) and then by the start of the
+    period, and forgets periods once their
+    end has passed.
+
+    Results are made durable by appending each one to a JSON lines log, which costs
+    O(1) per result and is flushed every `flush_every` appends. Every `compact_every` appends the live results are written to a
+    snapshot and the log is truncated; at startup the snapshot is loaded and the log
+    replayed over it. Replaying is idempotent (the latest result for a period wins), so
+    a crash between writing the snapshot and truncating the log loses nothing.
+    """
+
+    def __init__(self, path="city_cluster_index", compact_every=10000, flush_every=1000):
+        """
+        Parameters
+        ----------
+        path : string, default: "city_cluster_index"
+            The prefix of the snapshot (<path>.json) and log (<path>.jsonl) files. Set
+            to None to keep the index in memory only.
+
+        compact_every : int, default: 10000
+            The number of results appended to the log between two compactions
+
+        flush_every : int, default: 1000
+            The number of results appended to the log between two flushes to disk
+        """
+        self.path = path
+        self.compact_every = compact_every
+        self.flush_every = flush_every
+        self.cities = dict()
+        # (end, counter, city, start) of every indexed period, to evict them in order of end
+        self.expiry = []
+        self.counter = 0
+        self.appended = 0
+        self.unflushed = 0
+        self.log = None
+        # Incremented whenever a result is added or evicted, to invalidate cached views
+        self.version = 0
+
+        if self.path is not None:
+            self.load()
+            self.log = open(self.path + ".jsonl", "a", encoding="utf-8")
+
+    def __len__(self):
+        return sum(len(periods) for periods in self.cities.values())
+
+    def add(self, record, persist=True):
+        """
+        Index a cluster result, replacing any earlier result for the same city and
+        period, and append it to the log. Raises ValueError or TypeError, without
+        indexing it, if the end of the period is not an ISO 8601 timestamp.
+        """
+        city, start, end = city_key(record), record.get("start", None), record.get("end", None)
+        expires = _epoch(end) if end is not None else None
+        self.cities.setdefault(city, dict())[start] = record
+        self.version += 1
+        if expires is not None:
+            # The counter breaks ties so that city keys (IDs or names) are never compared
+            heapq.heappush(self.expiry, (expires, self.counter, city, start))
+            self.counter += 1
+
+        if persist and self.log is not None:
+            self.log.write(json.dumps(record) + "\n")
+            self.appended += 1
+            self.unflushed += 1
+            if self.appended >= self.compact_every:
+                self.compact()
+            elif self.unflushed >= self.flush_every:
+                self.flush()
+
+    def evict(self, now=None):
+        """
+        Forget every period that ended before `now` (default: the current time).
+        """
+        now = time.time() if now is None else now
+        while self.expiry and self.expiry[0][0] < now:
+            end, _, city, start = heapq.heappop(self.expiry)
+            periods = self.cities.get(city, None)
+            if periods is None or start not in periods:
+                continue
+            # A newer result for the period may have moved its end
+            current = periods[start].get("end", None)
+            if current is not None and _epoch(current) != end:
+                continue
+            del periods[start]
+            self.version += 1
+            if not periods:
+                del self.cities[city]
+
+    def latest(self, city):
+        """
+        Return the latest cluster result of each live period of a city (by key), by start.
+        """
+        periods = self.cities.get(city, dict())
+        return [periods[start] for start in sorted(periods, key=_epoch)]
+
+    def records(self):
+        for periods in self.cities.values():
+            yield from periods.values()
+
+    def load(self):
+        """
+        Load the snapshot and replay the log over it. A partially written last line
+        of the log is ignored, as are records with an invalid end.
+        """
+        try:
+            with open(self.path + ".json", encoding="utf-8") as f:
+                for record in json.load(f):
+                    self._load(record)
+        except FileNotFoundError:
+            pass
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"unable to load cluster results snapshot: {e}")
+
+        try:
+            with open(self.path + ".jsonl", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    self._load(record)
+        except FileNotFoundError:
+            pass
+        self.evict()
+
+    def _load(self, record):
+        try:
+            self.add(record, persist=False)
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            print(f"skipping cluster result {record!r}: {e}")
+
+    def compact(self):
+        """
+        Write the live results to the snapshot and start a new, empty log.
+        """
+        if self.path is None:
+            return
+        self.evict()
+
+        tmp = self.path + ".json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(list(self.records()), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path + ".json")
+
+        self.log.close()
+        self.log = open(self.path + ".jsonl", "w", encoding="utf-8")
+        self.appended = 0
+        self.unflushed = 0
+
+    def flush(self):
+        if self.log is not None:
+            self.log.flush()
+        self.unflushed = 0
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
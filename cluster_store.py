@@ -0,0 +1,389 @@
+"""
+The cluster store keeps the history of every cluster result in columnar, memory-mapped
+NumPy files partitioned by the UTC day each forecast period starts on:
+
+    <path>/cities.json            city label ("name, state") -> row city ID, in order
+                                  of first appearance
+    <path>/YYYY-MM-DD.bin         the ROW records of the periods starting that day
+
+Day files are preallocated and grown in place; unused rows have `recorded` 0. Each day
+keeps in-memory indexes from city and from cluster to its rows, built once when the day
+is first queried and maintained on append, so queries only read the rows of the days in
+their time range that match their city or cluster. At most `max_open` days are kept
+open (with their indexes), the least recently used are flushed and closed first.
+"""
+
+import os
+import json
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import datetime, timezone
+
+import numpy as np
+
+from features import FeatureExtractor
+from city_catalog import default_catalog, label
+
+
+DAY = 24 * 60 * 60
+
+MEASUREMENTS = ("temperature", "precipitation", "humidity", "dewpoint", "windspeed", "daytime")
+
+ROW = np.dtype([
+    ("start", "<i8"),
+    ("end", "<i8"),
+    ("recorded", "<f8"),
+    ("city", "<u4"),
+    ("cluster", "<i4"),
+] + [(name, "<f4") for name in MEASUREMENTS])
+
+
+@lru_cache(maxsize=4096)
+def _parse(value):
+    return datetime.fromisoformat(value)
+
+
+def epoch(value):
+    """
+    Convert an ISO 8601 string, a datetime or epoch seconds to epoch seconds.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = _parse(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+def day_of(ts):
+    return int(ts // DAY)
+
+
+class DayPartition:
+    """
+    DayPartition is the memory-mapped file of the results for the periods starting on
+    one day, with indexes from city and cluster to rows.
+    """
+
+    def __init__(self, path, capacity=4096):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.truncate(capacity * ROW.itemsize)
+        self.rows = np.memmap(path, dtype=ROW, mode="r+")
+        # Rows are appended in order, so the used rows are the ones before the first empty one
+        empty = np.flatnonzero(self.rows["recorded"] == 0)
+        self.count = int(empty[0]) if len(empty) else len(self.rows)
+        self.by_city = None
+        self.by_cluster = None
+
+    def _index(self):
+        if self.by_city is not None:
+            return
+        self.by_city, self.by_cluster = dict(), dict()
+        used = self.rows[:self.count]
+        for index, column in ((self.by_city, used["city"]), (self.by_cluster, used["cluster"])):
+            order = np.argsort(column, kind="stable")
+            keys, starts = np.unique(column[order], return_index=True)
+            for key, rows in zip(keys.tolist(), np.split(order, starts[1:])):
+                index[key] = rows.tolist()
+
+    def append(self, row, city, cluster):
+        if self.count == len(self.rows):
+            self.rows.flush()
+            capacity = len(self.rows) * 2
+            del self.rows
+            with open(self.path, "r+b") as f:
+                f.truncate(capacity * ROW.itemsize)
+            self.rows = np.memmap(self.path, dtype=ROW, mode="r+")
+
+        self.rows[self.count] = row
+        if self.by_city is not None:
+            self.by_city.setdefault(city, []).append(self.count)
+            self.by_cluster.setdefault(cluster, []).append(self.count)
+        self.count += 1
+
+    def select(self, city=None, cluster=None):
+        """
+        Return the rows of a city and/or cluster (all rows if neither is given).
+        """
+        if city is None and cluster is None:
+            return self.rows[:self.count]
+
+        self._index()
+        rows = None
+        if city is not None:
+            rows = np.asarray(self.by_city.get(city, []), dtype=np.int64)
+        if cluster is not None:
+            members = np.asarray(self.by_cluster.get(cluster, []), dtype=np.int64)
+            rows = members if rows is None else np.intersect1d(rows, members, assume_unique=True)
+        return self.rows[rows]
+
+    def flush(self):
+        self.rows.flush()
+
+
+class ClusterStore:
+    """
+    ClusterStore records the cluster result of every forecast period and answers
+    time-range queries over the history without scanning it all: only the day
+    partitions overlapping the range are opened, and within them only the rows of the
+    requested city or cluster are read.
+    """
+
+    def __init__(self, path="cluster_store", capacity=4096, flush_every=1000, max_open=64):
+        """
+        Parameters
+        ----------
+        path : string, default: "cluster_store"
+            The directory the day partitions are stored in
+
+        capacity : int, default: 4096
+            The number of rows a new day partition is preallocated with; partitions
+            double in size when they fill up
+
+        flush_every : int, default: 1000
+            The number of appended rows between two flushes to disk
+
+        max_open : int, default: 64
+            The maximum number of day partitions kept memory-mapped at once
+        """
+        self.path = path
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.max_open = max_open
+        # day -> DayPartition, least recently used first
+        self.partitions = OrderedDict()
+        self.unflushed = 0
+        self.features = FeatureExtractor(MEASUREMENTS, units="F")
+        os.makedirs(path, exist_ok=True)
+
+        self.city_ids = dict()
+        try:
+            with open(os.path.join(path, "cities.json")) as f:
+                self.city_ids = json.load(f)
+        except FileNotFoundError:
+            pass
+        self.city_names = {id: name for name, id in self.city_ids.items()}
+        self.new_cities = False
+        # The number of rows appended by this process, and its value when each city
+        # last had a row appended, to invalidate cached per-city views
+        self.version = 0
+        self.city_versions = dict()
+
+        # The days (as days since the epoch) that have a partition on disk
+        self.days = set()
+        for name in os.listdir(path):
+            if name.endswith(".bin"):
+                self.days.add(day_of(epoch(name[:-len(".bin")] + "T00:00:00+00:00")))
+
+    def partition(self, day, create=False):
+        partition = self.partitions.get(day, None)
+        if partition is not None:
+            self.partitions.move_to_end(day)
+            return partition
+
+        name = datetime.fromtimestamp(day * DAY, tz=timezone.utc).strftime("%Y-%m-%d")
+        path = os.path.join(self.path, name + ".bin")
+        if not create and not os.path.exists(path):
+            return None
+        partition = self.partitions[day] = DayPartition(path, capacity=self.capacity)
+        self.days.add(day)
+        if len(self.partitions) > self.max_open:
+            # The memory map is closed once no rows selected from it are referenced
+            _, closed = self.partitions.popitem(last=False)
+            self._save_new_cities()
+            closed.flush()
+        return partition
+
+    def city_id(self, city, create=False):
+        """
+        Return the row ID of a city given by its catalog ID, label or name.
+        """
+        if not create:
+            city = self.city_label(city)
+        id = self.city_ids.get(city, None)
+        if id is None and create:
+            id = self.city_ids[city] = len(self.city_ids)
+            self.city_names[id] = city
+            self.new_cities = True
+        return id
+
+    def city_label(self, city):
+        """
+        Return the label a city is stored under. Cities of the shared catalog can be
+        given by their ID, or by their name alone when it is unambiguous; any other
+        city by its label.
+        """
+        catalog = default_catalog()
+        id = catalog.resolve(city)
+        return city if id is None else catalog.label(id)
+
+    def _save_cities(self):
+        tmp = os.path.join(self.path, "cities.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.city_ids, f)
+        os.replace(tmp, os.path.join(self.path, "cities.json"))
+
+    def append(self, data, recorded=None):
+        """
+        Record the cluster result of a forecast period.
+        """
+        start = epoch(data.get("start", None))
+        if start is None:
+            return
+
+        city = self.city_id(label(data["city"], data.get("state", None)), create=True)
+        cluster = int(data.get("cluster", -1))
+        row = (
+            start, epoch(data.get("end", None)) or start,
+            time.time() if recorded is None else recorded, city, cluster,
+            *self.features.transform_one(data).tolist(),
+        )
+        self.partition(day_of(start), create=True).append(row, city, cluster)
+        self.version += 1
+        self.city_versions[city] = self.version
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every:
+            self.flush()
+
+    def rows(self, start, end, city=None, cluster=None):
+        """
+        Return the rows of the periods starting in [start, end), optionally only those
+        of a city and/or a cluster, ordered by start and then by when they were recorded.
+
+        Parameters
+        ----------
+        start, end : string, datetime or float
+            The time range, as ISO 8601 strings, datetimes or epoch seconds
+
+        city : int or string, default: None
+            Only return the rows of this city, see `city_id`
+
+        cluster : int, default: None
+            Only return the rows assigned to this cluster
+        """
+        start, end = epoch(start), epoch(end)
+        city_id = None
+        if city is not None:
+            city_id = self.city_id(city)
+            if city_id is None:
+                return np.zeros(0, dtype=ROW)
+
+        selected = []
+        for day in range(day_of(start), day_of(end) + 1):
+            if day not in self.days:
+                continue
+            rows = self.partition(day).select(city=city_id, cluster=cluster)
+            selected.append(rows[(rows["start"] >= start) & (rows["start"] < end)])
+
+        if not selected:
+            return np.zeros(0, dtype=ROW)
+        rows = np.concatenate(selected)
+        return rows[np.lexsort((rows["recorded"], rows["start"]))]
+
+    def history(self, city, start, end):
+        """
+        Return the cluster history of a city over a time range as a list of dicts, with
+        None for missing measurements.
+        """
+        return [
+            {"start": int(row["start"]), "end": int(row["end"]), "recorded": float(row["recorded"]),
+             "cluster": int(row["cluster"]),
+             # Missing measurements are None, since NaN is not valid JSON
+             **{name: None if np.isnan(row[name]) else float(row[name]) for name in MEASUREMENTS}}
+            for row in self.rows(start, end, city=city)
+        ]
+
+    def members(self, cluster, at):
+        """
+        Return the cities whose forecast period covering time `at` was last assigned to
+        `cluster`.
+        """
+        at = epoch(at)
+        # Periods are at most a day long, so the period covering `at` started at most a day before
+        rows = self.rows(at - DAY, at + 1)
+        rows = rows[(rows["start"] <= at) & (rows["end"] > at)]
+
+        latest = dict()
+        for city, label in zip(rows["city"].tolist(), rows["cluster"].tolist()):
+            latest[city] = label
+        return sorted(self.city_names[city] for city, label in latest.items() if label == cluster)
+
+    def aggregate(self, start, end, by="cluster", city=None, cluster=None, fields=MEASUREMENTS):
+        """
+        Group the rows of a time range and return the number of rows and the mean of
+        each field per group.
+
+        Parameters
+        ----------
+        start, end : string, datetime or float
+            The time range, see `rows`
+
+        by : string, default: "cluster"
+            Group by "cluster", "city", "day" or "hour" (UTC hour of the period start)
+
+        city, cluster : default: None
+            Only aggregate the rows of this city and/or cluster
+
+        fields : sequence of string, default: MEASUREMENTS
+            The fields to average
+
+        Returns
+        -------
+        groups : dict
+            group -> {"count": n, <field>: mean, ...}, with None for the mean of a
+            field without values in the group
+        """
+        rows = self.rows(start, end, city=city, cluster=cluster)
+        if by == "cluster":
+            keys = rows["cluster"].astype(np.int64)
+        elif by == "city":
+            keys = rows["city"].astype(np.int64)
+        elif by == "day":
+            keys = rows["start"] // DAY
+        elif by == "hour":
+            keys = rows["start"] % DAY // 3600
+        else:
+            raise ValueError(f"cannot group by {by!r}")
+
+        groups, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        means = dict()
+        for name in fields:
+            values = rows[name].astype(float)
+            present = ~np.isnan(values)
+            sums = np.bincount(inverse[present], weights=values[present], minlength=len(groups))
+            n = np.bincount(inverse[present], minlength=len(groups))
+            means[name] = np.where(n > 0, sums / np.maximum(n, 1), np.nan)
+
+        results = dict()
+        for i, group in enumerate(groups.tolist()):
+            if by == "city":
+                group = self.city_names[group]
+            elif by == "day":
+                group = datetime.fromtimestamp(group * DAY, tz=timezone.utc).strftime("%Y-%m-%d")
+            # Fields without any value in a group are None, since NaN is not valid JSON
+            results[group] = {
+                "count": int(counts[i]),
+                **{name: None if np.isnan(means[name][i]) else float(means[name][i]) for name in fields},
+            }
+        return results
+
+    def _save_new_cities(self):
+        # Save the city IDs before the rows that refer to them
+        if self.new_cities:
+            self._save_cities()
+            self.new_cities = False
+
+    def flush(self):
+        self._save_new_cities()
+        for partition in self.partitions.values():
+            partition.flush()
+        self.unflushed = 0
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,352 @@
+"""
+Windowed summaries of the cluster results, published to the city-clusters topic in
+place of one result per forecast event. Every `slide` seconds, the WeatherSubscriber
+publishes one ClusterSummary event covering the last `size` seconds of forecasts
+(tumbling windows when the slide is the size, sliding windows when it is shorter):
+
+    {
+        "start": "2023-10-17T15:00:00+00:00", "end": "2023-10-17T16:00:00+00:00",
+        "size": 3600, "slide": 3600, "features": ["temperature", "precipitation"],
+        "periods": 14000, "cities": 1000,
+        "clusters": [
+            {"cluster": 0, "periods": 2911, "cities": 204,
+             "centroid": {"temperature": 71.2, ...}, "averages": {"temperature": 70.8, ...}},
+            ...
+        ],
+        "snapshot": false,
+        "changed": {"Chicago, Illinois": 3, ...},
+        "left": ["Springfield, Illinois", ...]
+    }
+
+"centroid" is the model's center in feature units when the window closed, "averages"
+the mean features of the forecast periods assigned to the cluster during the window.
+A city's cluster is the cluster of its latest forecast period. Forecasts are only
+republished when they change, so a city without forecasts in a window keeps its last
+cluster until every forecast period received for it has ended. "cities" counts the
+cities with a cluster. "changed" holds the cities whose cluster differs from the
+previous summary and "left" the cities of the previous summary whose forecasts have
+all ended; every `snapshot_every` windows "changed" holds every city instead, with
+"snapshot": true, so that new consumers can start from there.
+"""
+
+import json
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from pyensign.events import Event
+
+from city_catalog import default_catalog
+from wire_format import NO_END
+
+
+MIMETYPE = "application/json"
+SCHEMA = "ClusterSummary"
+VERSION = "1.0.0"
+
+
+def is_summary(event):
+    """
+    Return True if the event carries a ClusterSummary.
+    """
+    type = getattr(event, "type", None)
+    return type is not None and type.name == SCHEMA
+
+
+def period_ends(records):
+    """
+    Return the epoch end time of each forecast period of a decoded event, the
+    columns of a binary event or a list of period dicts, NaN where it is unknown.
+    """
+    if isinstance(records, np.ndarray):
+        return np.where(records["flags"] & NO_END > 0, np.nan, records["end"].astype(float))
+    ends = np.full(len(records), np.nan)
+    for i, data in enumerate(records):
+        try:
+            ends[i] = datetime.fromisoformat(data["end"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            pass
+    return ends
+
+
+class Pane:
+    """
+    The results of one `slide` of time: per-cluster counts and feature sums, the
+    latest cluster of every city and the events the results came from.
+    """
+
+    def __init__(self, n_clusters, n_features):
+        self.periods = np.zeros(n_clusters, dtype=np.int64)
+        self.sums = np.zeros((n_clusters, n_features))
+        # The number of non-missing values summed, per cluster and feature
+        self.counts = np.zeros((n_clusters, n_features), dtype=np.int64)
+        self.members = dict()
+        self.sources = []
+
+
+class ClusterWindows:
+    """
+    ClusterWindows aggregates cluster results into tumbling or sliding windows of
+    processing time, aligned to multiples of `slide` seconds since the epoch. A window
+    is made of size / slide panes, so each result is added once whatever the overlap.
+    """
+
+    def __init__(self, size, slide=None, n_clusters=5, features=(), snapshot_every=24,
+                 catalog=None, clock=time.time):
+        """
+        Parameters
+        ----------
+        size : float
+            The length of each window in seconds
+
+        slide : float, default: None
+            The number of seconds between the ends of two windows; a divisor of `size`.
+            None for tumbling windows (the slide is the size).
+
+        n_clusters : int, default: 5
+            The number of clusters
+
+        features : sequence of string, default: ()
+            The names of the features of each result
+
+        snapshot_every : int, default: 24
+            Publish every city's cluster, rather than the changes, every this many
+            windows (and in the first one)
+
+        catalog : CityCatalog, default: None
+            The catalog city IDs are labelled with, cities.json by default
+
+        clock : function, default: time.time
+            Returns the current time in epoch seconds
+        """
+        self.size = size
+        self.slide = size if slide is None else slide
+        ratio = self.size / self.slide
+        if self.slide <= 0 or ratio < 1 or abs(ratio - round(ratio)) > 1e-9:
+            raise ValueError(f"the slide ({self.slide}s) must divide the window size ({self.size}s)")
+        self.window_panes = int(round(ratio))
+
+        self.n_clusters = n_clusters
+        self.features = list(features)
+        self.snapshot_every = snapshot_every
+        self.catalog = default_catalog() if catalog is None else catalog
+        self.clock = clock
+
+        # pane index -> Pane, where pane i covers [i * slide, (i + 1) * slide)
+        self.panes = dict()
+        # Windows end at the start of this pane, so this is the pane after the last window
+        self.closed = int(self.clock() // self.slide)
+        # The cluster of every city as of the last summary, and when each city's
+        # forecast periods end
+        self.members = dict()
+        self.expires = dict()
+        self.published = dict()
+        self.windows = 0
+
+    def add(self, keys, X, clusters, sources=(), ends=None, now=None):
+        """
+        Add the cluster results of a batch of forecast periods.
+
+        Parameters
+        ----------
+        keys : sequence of int or string
+            The city of each period
+
+        X : array of shape (n, n_features)
+            The features of each period
+
+        clusters : array of shape (n,)
+            The cluster of each period
+
+        sources : sequence, default: ()
+            The events the periods came from, returned by the `close` of the first
+            window that includes them
+
+        ends : array of shape (n,), default: None
+            The epoch end time of each period (NaN if unknown), see `period_ends`.
+            Without one, a city leaves the membership in the first window it has no
+            forecasts in.
+        """
+        if not len(keys):
+            return
+        now = self.clock() if now is None else now
+        index = int(now // self.slide)
+        pane = self.panes.get(index, None)
+        if pane is None:
+            pane = self.panes[index] = Pane(self.n_clusters, len(self.features))
+
+        clusters = np.asarray(clusters, dtype=np.int64)
+        pane.periods += np.bincount(clusters, minlength=self.n_clusters)
+        valid = ~np.isnan(X)
+        np.add.at(pane.sums, clusters, np.where(valid, X, 0))
+        np.add.at(pane.counts, clusters, valid)
+        pane.members.update(zip(keys, clusters.tolist()))
+        pane.sources.extend(sources)
+
+        if ends is not None:
+            expires = self.expires
+            for key, end in zip(keys, np.asarray(ends, dtype=float).tolist()):
+                # NaN compares False, so unknown ends are skipped
+                if end > expires.get(key, -np.inf):
+                    expires[key] = end
+
+    def due(self, now=None):
+        """
+        Return True if a window has ended since the last one was closed.
+        """
+        now = self.clock() if now is None else now
+        return int(now // self.slide) > self.closed
+
+    def next_end(self):
+        """
+        Return the epoch time the next window ends at.
+        """
+        return (self.closed + 1) * self.slide
+
+    def close(self, now=None, final=False, centroids=None):
+        """
+        Close the latest window that has ended (or, if `final`, the one in progress).
+        Windows that ended earlier without being closed are skipped.
+
+        Parameters
+        ----------
+        centroids : array of shape (n_clusters, n_features), default: None
+            The model's centers in feature units, included in the summary
+
+        Returns
+        -------
+        summary : dict or None
+            The summary of the window, None if it holds no results and no city left
+            the clusters
+
+        sources : list
+            The sources of the results the window is the first to include
+        """
+        now = self.clock() if now is None else now
+        end = int(now // self.slide) + (1 if final else 0)
+        if end <= self.closed:
+            return None, []
+        self.closed = end
+
+        start = end - self.window_panes
+        panes = [self.panes[index] for index in sorted(self.panes) if start <= index < end]
+        # Sources of skipped windows are released too, so that none is held forever
+        sources = []
+        for index in sorted(self.panes):
+            if index < end:
+                sources.extend(self.panes[index].sources)
+                self.panes[index].sources = []
+        # Keep the panes that are part of the windows still to come
+        for index in [index for index in self.panes if index <= start]:
+            del self.panes[index]
+
+        periods = sum((pane.periods for pane in panes), np.zeros(self.n_clusters, dtype=np.int64))
+        shape = (self.n_clusters, len(self.features))
+        sums = sum((pane.sums for pane in panes), np.zeros(shape))
+        counts = sum((pane.counts for pane in panes), np.zeros(shape, dtype=np.int64))
+        latest = dict()
+        for pane in panes:
+            latest.update(pane.members)
+        with np.errstate(all="ignore"):
+            averages = sums / counts
+
+        # Cities without forecasts in the window keep their cluster until their
+        # forecast periods have all ended, even if the window is empty
+        ended = end * self.slide
+        members = {
+            key: cluster for key, cluster in self.members.items()
+            if key not in latest and self.expires.get(key, -np.inf) > ended
+        }
+        members.update(latest)
+        self.members = members
+        for key in [key for key, expires in self.expires.items() if expires <= ended and key not in members]:
+            del self.expires[key]
+
+        labelled = {self.label(key): cluster for key, cluster in members.items()}
+        left = [city for city in self.published if city not in labelled]
+        # An empty window is only published to announce the cities that left
+        if not periods.sum() and not left:
+            return None, sources
+
+        cities = np.bincount(list(members.values()), minlength=self.n_clusters)
+        clusters = []
+        for cluster in range(self.n_clusters):
+            summary = {
+                "cluster": cluster,
+                "periods": int(periods[cluster]),
+                "cities": int(cities[cluster]),
+                "averages": self._named(averages[cluster]),
+            }
+            if centroids is not None:
+                summary["centroid"] = self._named(centroids[cluster])
+            clusters.append(summary)
+
+        snapshot = self.windows % self.snapshot_every == 0 if self.snapshot_every else self.windows == 0
+        if snapshot:
+            changed = labelled
+        else:
+            changed = {city: cluster for city, cluster in labelled.items() if self.published.get(city, None) != cluster}
+        self.published = labelled
+        self.windows += 1
+
+        return {
+            "start": self._time(start), "end": self._time(end),
+            "size": self.size, "slide": self.slide, "features": self.features,
+            "periods": int(periods.sum()), "cities": len(labelled),
+            "clusters": clusters,
+            "snapshot": snapshot, "changed": changed, "left": left,
+        }, sources
+
+    def label(self, key):
+        return self.catalog.label(key) if isinstance(key, int) and key in self.catalog else key
+
+    def _named(self, values):
+        return {name: None if np.isnan(value) else float(value) for name, value in zip(self.features, values)}
+
+    def _time(self, pane):
+        return datetime.fromtimestamp(pane * self.slide, tz=timezone.utc).isoformat()
+
+
+def make_summary_event(summary):
+    """
+    Encode a window summary as a ClusterSummary event.
+    """
+    return Event(
+        json.dumps(summary).encode("utf-8"), mimetype=MIMETYPE, schema_name=SCHEMA, schema_version=VERSION,
+    )
+
+
+class ClusterMembership:
+    """
+    ClusterMembership follows the ClusterSummary events on the consumer side: the
+    latest summary and the current cluster of every city, rebuilt from the changes.
+    """
+
+    def __init__(self):
+        self.latest = None
+        self.members = dict()
+        self.version = 0
+
+    def apply(self, summary):
+        """
+        Apply a summary: a snapshot replaces the membership, other summaries change it.
+        """
+        if summary["snapshot"]:
+            self.members = dict(summary["changed"])
+        else:
+            self.members.update(summary["changed"])
+            for city in summary["left"]:
+                self.members.pop(city, None)
+        self.latest = summary
+        self.version += 1
+
+    def render(self):
+        """
+        Return the latest summary with the cluster of every city in place of the
+        changes.
+        """
+        if self.latest is None:
+            return {"version": self.version, "summary": None}
+        summary = {key: value for key, value in self.latest.items() if key not in ("changed", "left", "snapshot")}
+        summary["members"] = self.members
+        return {"version": self.version, "summary": summary}
@@ -0,0 +1,294 @@
+import json
+import time
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from aiohttp import web
+
+from cluster_store import MEASUREMENTS, epoch
+from features import FeatureExtractor
+from city_catalog import default_catalog, label
+
+
+# The longest history /history serves, in days
+MAX_HISTORY_DAYS = 90
+
+# The most cities /nearest returns
+MAX_NEAREST = 100
+
+# The number of rendered responses kept, least recently requested first out
+MAX_CACHED = 4096
+
+
+class DashboardServer:
+    """
+    DashboardServer serves the cluster results a ClusterSubscriber has received to
+    dashboards over HTTP:
+
+        GET /clusters          the current cluster (and forecast) of every city, by
+                               "name, state"
+        GET /centroids         the number of live forecast periods in each cluster and
+                               the mean of their measurements
+        GET /history/{city}    the cluster history of a city (catalog ID, "name, state"
+                               or unambiguous name), ?days=7 by default (whole
+                               days, from 1 to MAX_HISTORY_DAYS)
+        GET /region            the current cluster of the cities within ?km= of
+                               ?lat=&lon=, or inside ?south=&west=&north=&east=, and
+                               the number of cities in each cluster
+        GET /nearest           the ?k=1 cities nearest to ?lat=&lon= with their current
+                               cluster (k from 1 to MAX_NEAREST)
+        GET /summary           the latest window summary of the clusters, with the
+                               cluster of every city (see `cluster_windows`)
+
+    Responses are rendered on the first request after the data behind them changed and
+    cached with an ETag until the next change, so any number of dashboards can poll
+    (with If-None-Match for a 304) at the cost of a version check per request. Handling
+    events only bumps version counters. The current period of a city also changes when
+    the next one starts, so the responses built from it are versioned by that time too.
+    """
+
+    def __init__(self, index, store=None, spatial=None, membership=None, host="127.0.0.1", port=8050):
+        """
+        Parameters
+        ----------
+        index : ClusterIndex
+            The latest cluster result of every live forecast period
+
+        store : ClusterStore, default: None
+            The cluster history; /history is not served without one
+
+        spatial : SpatialIndex, default: None
+            The locations of the cities; /region and /nearest are not served without one
+
+        membership : ClusterMembership, default: None
+            The window summaries received; /summary is not served without one
+
+        host : string, default: "127.0.0.1"
+            The interface to listen on
+
+        port : int, default: 8050
+            The port to listen on, 0 to pick a free port
+        """
+        self.index = index
+        self.store = store
+        self.spatial = spatial
+        self.membership = membership
+        self.host = host
+        self.port = port
+        self.features = FeatureExtractor(MEASUREMENTS, units="F")
+        # path -> (version, etag, body)
+        self.cache = OrderedDict()
+        # (version, the time the next period starts, city -> current period)
+        self.current_cache = None
+        self.renders = 0
+
+    def app(self):
+        """
+        Create the aiohttp application serving the dashboard API.
+        """
+        app = web.Application()
+        app.router.add_get("/clusters", self.handle_clusters)
+        app.router.add_get("/centroids", self.handle_centroids)
+        app.router.add_get("/history/{city}", self.handle_history)
+        app.router.add_get("/region", self.handle_region)
+        app.router.add_get("/nearest", self.handle_nearest)
+        app.router.add_get("/summary", self.handle_summary)
+        return app
+
+    async def start(self):
+        """
+        Start serving, returning the runner to clean up when done. `self.port` is set
+        to the bound port.
+        """
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return runner
+
+    def respond(self, request, key, version, render):
+        """
+        Serve the cached body for `key` if it was rendered at `version`, otherwise
+        render and cache it, answering If-None-Match with a 304 when it still matches.
+        """
+        cached = self.cache.get(key, None)
+        if cached is None or cached[0] != version:
+            body = json.dumps(render()).encode("utf-8")
+            # Versions restart with the process, so the ETag is a hash of the body itself
+            etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+            cached = self.cache[key] = (version, etag, body)
+            self.renders += 1
+            if len(self.cache) > MAX_CACHED:
+                self.cache.popitem(last=False)
+        self.cache.move_to_end(key)
+
+        _, etag, body = cached
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("If-None-Match", None) == etag:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, headers=headers, content_type="application/json")
+
+    async def handle_clusters(self, request):
+        # Periods that have ended change which period is current
+        self.index.evict()
+        return self.respond(request, "clusters", self.current_version(), self.render_clusters)
+
+    def render_clusters(self):
+        return {
+            "version": self.index.version,
+            "cities": {label(period["city"], period.get("state", None)): period for period in self.current().values()},
+        }
+
+    def current(self):
+        """
+        Return the current forecast period (with its cluster) of every city by key,
+        cached until the index changes or the next period starts.
+        """
+        now = time.time()
+        cached = self.current_cache
+        if cached is not None and cached[0] == self.index.version and now < cached[1]:
+            return cached[2]
+
+        cities = dict()
+        until = float("inf")
+        for city in self.index.cities:
+            periods = self.index.latest(city)
+            if not periods:
+                continue
+            # The period in progress, or the next one if none is
+            current = periods[0]
+            for period in periods:
+                if period["start"] is None:
+                    continue
+                start = epoch(period["start"])
+                if start <= now:
+                    current = period
+                else:
+                    until = min(until, start)
+            cities[city] = current
+        self.current_cache = (self.index.version, until, cities)
+        return cities
+
+    def current_version(self):
+        """
+        Return the version of `current`: the index version and when the next period
+        starts.
+        """
+        self.current()
+        return self.current_cache[:2]
+
+    def assignments(self):
+        self.index.evict()
+        return {city: period.get("cluster", None) for city, period in self.current().items()}
+
+    async def handle_centroids(self, request):
+        self.index.evict()
+        return self.respond(request, "centroids", self.index.version, self.render_centroids)
+
+    def render_centroids(self):
+        records = [record for record in self.index.records() if record.get("cluster", None) is not None]
+        clusters = dict()
+        if records:
+            X = self.features.transform(records)
+            labels = np.array([record["cluster"] for record in records])
+            for cluster in np.unique(labels).tolist():
+                members = X[labels == cluster]
+                with np.errstate(all="ignore"):
+                    means = np.nanmean(members, axis=0)
+                clusters[cluster] = {
+                    "count": len(members),
+                    "centroid": {name: None if np.isnan(mean) else float(mean) for name, mean in zip(MEASUREMENTS, means)},
+                }
+        return {"version": self.index.version, "clusters": clusters}
+
+    async def handle_history(self, request):
+        if self.store is None:
+            raise web.HTTPNotFound(text="the cluster history is not being recorded")
+
+        city = request.match_info["city"]
+        try:
+            # Whole days in a fixed range, so clients cannot grow the cache without bound
+            days = min(max(round(float(request.query.get("days", 7))), 1), MAX_HISTORY_DAYS)
+        except (ValueError, OverflowError):
+            raise web.HTTPBadRequest(text="days must be a number")
+
+        city_id = self.store.city_id(city)
+        if city_id is None:
+            raise web.HTTPNotFound(text=f"no history for {city}")
+        city = self.store.city_names[city_id]
+
+        # The window moves with the clock, so the version includes the hour too
+        hour = int(time.time() // 3600)
+        version = (self.store.city_versions.get(city_id, 0), hour)
+
+        def render():
+            end = (hour + 1) * 3600
+            # Forecast periods run up to a week ahead of when they were published
+            history = self.store.history(city, end - days * 24 * 3600, end + 8 * 24 * 3600)
+            return {"city": city, "days": days, "history": history}
+
+        return self.respond(request, f"history/{city_id}?days={days}", version, render)
+
+    def _coordinates(self, request, *names):
+        try:
+            return [float(request.query[name]) for name in names]
+        except KeyError as e:
+            raise web.HTTPBadRequest(text=f"missing query parameter {e}")
+        except ValueError:
+            raise web.HTTPBadRequest(text=f"{', '.join(names)} must be numbers")
+
+    async def handle_region(self, request):
+        if self.spatial is None:
+            raise web.HTTPNotFound(text="city locations are not available")
+
+        if "south" in request.query:
+            bbox = self._coordinates(request, "south", "west", "north", "east")
+            key = "region?south={}&west={}&north={}&east={}".format(*bbox)
+            query = dict(bbox=bbox)
+        else:
+            lat, lon, km = self._coordinates(request, "lat", "lon", "km")
+            key = f"region?lat={lat}&lon={lon}&km={km}"
+            query = dict(lat=lat, lon=lon, km=km)
+
+        def render():
+            cities, mix = self.spatial.cluster_mix(self.assignments(), **query)
+            catalog = default_catalog()
+            return {
+                "cities": {catalog.label(city): cluster for city, cluster in cities.items()},
+                "mix": dict(mix),
+            }
+
+        self.index.evict()
+        return self.respond(request, key, self.current_version(), render)
+
+    async def handle_nearest(self, request):
+        if self.spatial is None:
+            raise web.HTTPNotFound(text="city locations are not available")
+
+        lat, lon = self._coordinates(request, "lat", "lon")
+        try:
+            k = int(request.query.get("k", 1))
+        except ValueError:
+            raise web.HTTPBadRequest(text="k must be an integer")
+        if k < 1:
+            raise web.HTTPBadRequest(text="k must be at least 1")
+        # A bounded k also bounds the number of cached responses per location
+        k = min(k, MAX_NEAREST)
+
+        def render():
+            assignments = self.assignments()
+            catalog = default_catalog()
+            return [
+                {"city_id": city, "city": catalog.label(city), "distance_km": distance, "cluster": assignments.get(city, None)}
+                for city, distance in self.spatial.nearest(lat, lon, k=k)
+            ]
+
+        self.index.evict()
+        return self.respond(request, f"nearest?lat={lat}&lon={lon}&k={k}", self.current_version(), render)
+
+    async def handle_summary(self, request):
+        if self.membership is None:
+            raise web.HTTPNotFound(text="cluster summaries are not being received")
+        return self.respond(request, "summary", self.membership.version, self.membership.render)
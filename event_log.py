@@ -0,0 +1,537 @@
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import asyncio
+from collections import deque
+
+from pyensign import mimetypes as mtype
+from pyensign.events import Type
+from pyensign.api.v1beta1.ensign_pb2 import Nack
+
+
+# Every record is a fixed header followed by the schema type, the metadata and the
+# data, padded to an 8 byte boundary:
+#   length (data), crc32 (data), published (epoch), mimetype, type length, meta length
+HEADER = struct.Struct("<IIdHHI")
+ALIGN = 8
+SEALED = 0xFFFFFFFF
+PADDING = bytes(ALIGN)
+OFFSET = struct.Struct("<Q")
+
+# Nacks with these codes ask for the event to be delivered again; any other nack
+# means the event can never be handled, so it is consumed like an ack
+REDELIVER = {
+    Nack.Code.UNPROCESSED,
+    Nack.Code.TIMEOUT,
+    Nack.Code.DELIVER_AGAIN_ANY,
+    Nack.Code.DELIVER_AGAIN_NOT_ME,
+}
+
+
+class Segment:
+    """
+    A Segment is one memory-mapped, preallocated file of a topic's log. Records are
+    only ever appended, and a segment that is full is sealed with a marker that tells
+    readers to continue with the next segment. A record torn by a crash is truncated
+    away when the writer next opens the segment.
+    """
+
+    def __init__(self, path, base, size=None):
+        """
+        Open (or, if `size` is given and the file does not exist, create) a segment
+        whose first record has offset `base`. Only the writer passes a size.
+        """
+        self.path = path
+        self.base = base
+        writable = size is not None
+        if writable and not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.truncate(size)
+
+        self.file = open(path, "r+b" if writable else "rb")
+        access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        self.map = mmap.mmap(self.file.fileno(), 0, access=access)
+        self.size = len(self.map)
+        self.position = 0
+        self.count = 0
+        self.sealed = False
+
+        if writable:
+            # Find the end of the records written before the log was last closed
+            while True:
+                try:
+                    record = self.read(self.position)
+                except IOError as e:
+                    # A record torn by a crash while it was written: truncate the
+                    # segment to the records before it
+                    print(f"truncating {path} at {self.position}: {e}")
+                    self.map[self.position:] = bytes(self.size - self.position)
+                    self.map.flush()
+                    break
+                if record is None:
+                    break
+                if record is SEALED:
+                    self.sealed = True
+                    break
+                self.position = record[-1]
+                self.count += 1
+
+    def append(self, data, published, mimetype, type, meta):
+        """
+        Append a record, returning False if the segment does not have enough room.
+        """
+        record = b"".join((
+            HEADER.pack(len(data), zlib.crc32(data), published, mimetype, len(type), len(meta)),
+            type, meta, data, PADDING[:-(HEADER.size + len(type) + len(meta) + len(data)) % ALIGN],
+        ))
+        end = self.position + len(record)
+        # Always leave room for the sealed marker
+        if end + 4 > self.size:
+            return False
+
+        # The length is written last so that readers never see a partial record
+        self.map[self.position + 4:end] = record[4:]
+        self.map[self.position:self.position + 4] = record[:4]
+        self.position = end
+        self.count += 1
+        return True
+
+    def seal(self):
+        struct.pack_into("<I", self.map, self.position, SEALED)
+        self.sealed = True
+
+    def read(self, position):
+        """
+        Read the record at `position`.
+
+        Returns
+        -------
+        record : tuple, SEALED or None
+            (data, published, mimetype, type, meta, next position), SEALED if the
+            segment is full, or None if no record has been written there yet
+
+        Raises
+        ------
+        IOError
+            If the record is corrupt or runs past the end of the segment
+        """
+        if position + 4 > self.size:
+            return None
+
+        length = struct.unpack_from("<I", self.map, position)[0]
+        if length == SEALED:
+            return SEALED
+        if length == 0:
+            return None
+
+        if position + HEADER.size > self.size:
+            raise IOError(f"truncated record at {self.path}:{position}")
+        _, crc, published, mimetype, type_length, meta_length = HEADER.unpack_from(self.map, position)
+        start = position + HEADER.size
+        end = start + type_length + meta_length + length
+        if end > self.size:
+            raise IOError(f"truncated record at {self.path}:{position}")
+        body = self.map[start:end]
+        data = body[type_length + meta_length:]
+        if zlib.crc32(data) != crc:
+            raise IOError(f"corrupt record at {self.path}:{position}")
+
+        type = body[:type_length]
+        meta = body[type_length:type_length + meta_length]
+        return data, published, mimetype, type, meta, end + (-end % ALIGN)
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class TopicLog:
+    """
+    TopicLog is the append-only log of a single topic: a directory of segments named
+    after the offset of their first record.
+    """
+
+    def __init__(self, path, segment_size):
+        self.path = path
+        self.segment_size = segment_size
+        os.makedirs(path, exist_ok=True)
+
+        bases = self.segment_bases()
+        base = bases[-1] if bases else 0
+        self.writer = Segment(self.segment_path(base), base, size=segment_size)
+        if self.writer.sealed:
+            self._roll()
+        self.next_offset = self.writer.base + self.writer.count
+        self.appended = asyncio.Event()
+
+    def segment_bases(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith(".log"))
+
+    def segment_path(self, base):
+        return os.path.join(self.path, f"{base:020d}.log")
+
+    def _roll(self):
+        base = self.writer.base + self.writer.count
+        if not self.writer.sealed:
+            self.writer.seal()
+        self.writer.close()
+        self.writer = Segment(self.segment_path(base), base, size=self.segment_size)
+
+    def append(self, data, published, mimetype, type, meta):
+        """
+        Append a record and return its offset.
+        """
+        if not self.writer.append(data, published, mimetype, type, meta):
+            self._roll()
+            if not self.writer.append(data, published, mimetype, type, meta):
+                raise ValueError(f"event of {len(data)} bytes does not fit in a segment")
+
+        offset = self.next_offset
+        self.next_offset += 1
+        return offset
+
+    def notify(self):
+        # Wake up subscribers in this process that are waiting for new records
+        self.appended.set()
+        self.appended = asyncio.Event()
+
+    def close(self):
+        self.writer.flush()
+        self.writer.close()
+
+
+class Cursor:
+    """
+    Cursor reads the records of a topic in order starting from an offset. It follows
+    the log into new segments as they are created, including segments written by
+    another process.
+    """
+
+    def __init__(self, topic, offset):
+        self.topic = topic
+        bases = [base for base in topic.segment_bases() if base <= offset] or [0]
+        self.segment = Segment(topic.segment_path(bases[-1]), bases[-1])
+        self.offset = self.segment.base
+        self.position = 0
+
+        # Skip forward to the requested offset
+        while self.offset < offset and self.next() is not None:
+            pass
+
+    def next(self):
+        """
+        Return the next (offset, record) or None if the end of the log was reached.
+        """
+        while True:
+            record = self.segment.read(self.position)
+            if record is None:
+                return None
+            if record is SEALED:
+                path = self.topic.segment_path(self.offset)
+                if not os.path.exists(path):
+                    return None
+                self.segment.close()
+                self.segment = Segment(path, self.offset)
+                self.position = 0
+                continue
+
+            offset = self.offset
+            self.offset += 1
+            self.position = record[-1]
+            return offset, record
+
+    def close(self):
+        self.segment.close()
+
+
+class LocalAck:
+    """
+    LocalAck mirrors the Ack that Ensign passes to a publisher's on_ack callback.
+    """
+
+    class Timestamp:
+        def __init__(self, ts):
+            self.seconds = int(ts)
+            self.nanos = int((ts - self.seconds) * 1e9)
+
+    def __init__(self, id, committed):
+        self.id = id
+        self.committed = self.Timestamp(committed)
+
+
+class LocalEvent:
+    """
+    LocalEvent mirrors the pyensign Event yielded to subscribers: it exposes the data,
+    mimetype, type and metadata of the event and can be acked or nacked.
+    """
+
+    __slots__ = ("_subscription", "topic", "offset", "id", "data", "published", "mimetype", "type", "meta")
+
+    # Schema types are parsed once per distinct type rather than once per event
+    types = dict()
+
+    def __init__(self, subscription, topic, offset, record):
+        data, published, mimetype, type, meta, _ = record
+        self._subscription = subscription
+        self.topic = topic
+        self.offset = offset
+        self.id = offset
+        self.data = data
+        self.published = published
+        self.mimetype = mimetype
+        self.type = self.types.get(type, None)
+        if self.type is None:
+            name, _, version = type.decode("utf-8").partition(" ")
+            self.type = self.types[type] = Type(name, version or None)
+        self.meta = json.loads(meta) if meta else dict()
+
+    async def ack(self):
+        self._subscription.acknowledge(self)
+        return True
+
+    async def nack(self, code):
+        if code in REDELIVER:
+            self._subscription.redeliver.append(self)
+        else:
+            self._subscription.acknowledge(self)
+        return True
+
+
+class Subscription:
+    """
+    Subscription tracks the acked offsets of a consumer group on one topic. The
+    committed offset is the first offset that has not been acked, so that events that
+    were delivered but not acked are delivered again after a restart.
+    """
+
+    def __init__(self, path, commit_every=1000):
+        self.path = path
+        self.commit_every = commit_every
+        self.committed = self._load()
+        self.acked = set()
+        self.uncommitted = 0
+        self.redeliver = deque()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb") as f:
+            return OFFSET.unpack(f.read(OFFSET.size))[0]
+
+    def acknowledge(self, event):
+        self.acked.add(event.offset)
+        while self.committed in self.acked:
+            self.acked.remove(self.committed)
+            self.committed += 1
+            self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.save()
+
+    def save(self):
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(OFFSET.pack(self.committed))
+        os.replace(self.path + ".tmp", self.path)
+        self.uncommitted = 0
+
+
+class EventLog:
+    """
+    EventLog is an embedded, append-only event log that can be used instead of Ensign
+    to run the whole pipeline on one machine, e.g. for development, replay and
+    benchmarking. It implements the parts of the Ensign client the publisher and
+    subscribers use (`ensure_topic_exists`, `topic_id`, `publish` and `subscribe`),
+    with events stored in memory-mapped segment files under `path`, one directory per
+    topic, and consumer group offsets stored next to them.
+    """
+
+    def __init__(self, path="eventlog", segment_size=64 * 1024 * 1024, poll_interval=0.05,
+                 commit_every=1000):
+        """
+        Parameters
+        ----------
+        path : string, default: "eventlog"
+            The directory the topics are stored in
+
+        segment_size : int, default: 67108864
+            The size in bytes of each segment file
+
+        poll_interval : float, default: 0.05
+            How often a caught up subscriber checks for events appended by another
+            process
+
+        commit_every : int, default: 1000
+            How many acks a consumer group accumulates before its offset is saved
+        """
+        self.path = path
+        self.segment_size = segment_size
+        self.poll_interval = poll_interval
+        self.commit_every = commit_every
+        self.topics = dict()
+        self.subscriptions = []
+        os.makedirs(path, exist_ok=True)
+
+    def _topic(self, name):
+        if name not in self.topics:
+            self.topics[name] = TopicLog(os.path.join(self.path, name), self.segment_size)
+        return self.topics[name]
+
+    async def ensure_topic_exists(self, topic_name):
+        self._topic(topic_name)
+        return topic_name
+
+    async def topic_id(self, name):
+        if not os.path.isdir(os.path.join(self.path, name)):
+            raise ValueError(f"topic {name} does not exist")
+        return name
+
+    async def publish(self, topic, *events, on_ack=None, on_nack=None, ensure_exists=True):
+        """
+        Append events to a topic. Events are committed as soon as they are written to
+        the log, so `on_ack` is invoked for each event before this returns.
+        """
+        if len(events) == 1 and isinstance(events[0], (list, tuple)):
+            events = events[0]
+        if len(events) == 0:
+            raise ValueError("no events provided")
+
+        log = self._topic(topic)
+        committed = time.time()
+        offsets = []
+        types = dict()
+        for event in events:
+            mimetype = event.mimetype
+            if isinstance(mimetype, str):
+                mimetype = mtype.parse(mimetype)
+            type = types.get(id(event.type), None)
+            if type is None:
+                type = types[id(event.type)] = f"{event.type.name} {event.type.semver()}".encode("utf-8")
+            meta = json.dumps(dict(event.meta)).encode("utf-8") if event.meta else b""
+            offsets.append(log.append(event.data, committed, mimetype, type, meta))
+        log.notify()
+
+        if on_ack is not None:
+            for offset in offsets:
+                await on_ack(LocalAck(offset, committed))
+
+    async def subscribe(self, *topics, consumer_group=None, offset=None, query="", params=None):
+        """
+        Yield the events of the topics in order (round-robin across topics), starting
+        at the consumer group's committed offset, forever.
+
+        Parameters
+        ----------
+        topics : iterable of str
+            The topics to subscribe to
+
+        consumer_group : string or ConsumerGroup, default: None
+            The consumer group whose offsets are used; defaults to "default"
+
+        offset : int, default: None
+            Start at this offset instead of the committed offset
+        """
+        if len(topics) == 1 and isinstance(topics[0], (list, tuple)):
+            topics = topics[0]
+        if len(topics) == 0:
+            raise ValueError("no topics provided")
+        if query:
+            raise ValueError("queries are not supported by the local event log")
+
+        group = getattr(consumer_group, "name", consumer_group) or "default"
+        readers = []
+        for name in topics:
+            log = self._topic(name)
+            subscription = Subscription(
+                os.path.join(log.path, f"{group}.offset"), commit_every=self.commit_every
+            )
+            self.subscriptions.append(subscription)
+            start = subscription.committed if offset is None else offset
+            subscription.committed = start
+            readers.append((name, log, subscription, Cursor(log, start)))
+
+        try:
+            while True:
+                delivered = 0
+                for name, log, subscription, cursor in readers:
+                    while subscription.redeliver:
+                        yield subscription.redeliver.popleft()
+                        delivered += 1
+
+                    # Yield a bounded run per topic so other topics are not starved
+                    for _ in range(1024):
+                        record = cursor.next()
+                        if record is None:
+                            break
+                        yield LocalEvent(subscription, name, *record)
+                        delivered += 1
+
+                if not delivered:
+                    waits = [asyncio.ensure_future(log.appended.wait()) for _, log, _, _ in readers]
+                    await asyncio.wait(waits, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                    for wait in waits:
+                        wait.cancel()
+        finally:
+            for _, _, subscription, cursor in readers:
+                subscription.save()
+                cursor.close()
+
+    def read(self, topic, offset=0):
+        """
+        Yield the events of a topic from `offset` up to the current end of the log,
+        without a consumer group, e.g. to replay it. The events cannot be acked.
+        """
+        if not os.path.isdir(os.path.join(self.path, topic)):
+            raise ValueError(f"topic {topic} does not exist")
+        cursor = Cursor(self._topic(topic), offset)
+        try:
+            while True:
+                record = cursor.next()
+                if record is None:
+                    return
+                yield LocalEvent(None, topic, *record)
+        finally:
+            cursor.close()
+
+    def close(self):
+        """
+        Flush the topics and save the consumer group offsets.
+        """
+        for subscription in self.subscriptions:
+            subscription.save()
+        for log in self.topics.values():
+            log.close()
+        self.topics.clear()
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pyensign.events import Event
+
+    # A quick throughput check of the log on this machine
+    with tempfile.TemporaryDirectory() as path:
+        log = EventLog(path)
+        event = Event(json.dumps({"city": "Chicago", "temperature": 50}).encode("utf-8"), mimetype="application/json")
+
+        async def bench(n=1_000_000, batch=1000):
+            started = time.perf_counter()
+            for _ in range(n // batch):
+                await log.publish("bench", [event] * batch)
+            elapsed = time.perf_counter() - started
+            print(f"published {n} events in {elapsed:.2f}s ({n / elapsed:,.0f} events/s)")
+
+            started = time.perf_counter()
+            count = 0
+            async for received in log.subscribe("bench"):
+                count += 1
+                if count == n:
+                    break
+            elapsed = time.perf_counter() - started
+            print(f"consumed {n} events in {elapsed:.2f}s ({n / elapsed:,.0f} events/s)")
+
+        asyncio.run(bench())
+        log.close()
@@ -0,0 +1,204 @@
+"""
+Feature extraction turns forecast periods into the dense float vectors the clustering
+model learns from. Each feature is a column of the vector:
+
+    temperature    in the extractor's units (F or C)
+    precipitation  probability of precipitation, percent
+    humidity       relative humidity, percent
+    dewpoint       in the extractor's units (NOAA reports degC)
+    windspeed      mph; the midpoint of ranges like "10 to 15 mph"
+    daytime        1 for daytime periods, 0 for night
+    hour_sin       sine and cosine of the local time of day the period starts, so that
+    hour_cos       23:00 and 01:00 are close together
+
+Missing values are filled with 0 for precipitation and wind speed (NOAA leaves them out
+when there is none) and NaN otherwise.
+"""
+
+import re
+import math
+from functools import lru_cache
+from datetime import datetime
+
+import numpy as np
+
+from wire_format import DAYTIME, NO_DAYTIME, NO_DEWPOINT, NO_HUMIDITY, NO_PRECIPITATION, NO_START, NULL_INT
+
+
+FEATURES = ("temperature", "precipitation", "humidity", "dewpoint", "windspeed", "daytime", "hour_sin", "hour_cos")
+
+# Features that are not in the fixed-width columns of the binary wire format
+STRING_FEATURES = {"windspeed"}
+
+WIND = re.compile(r"(\d+(?:\.\d+)?)(?:\s+to\s+(\d+(?:\.\d+)?))?\s*(mph|km/h|kt)?", re.IGNORECASE)
+WIND_UNITS = {"mph": 1.0, "km/h": 0.621371, "kt": 1.15078}
+
+
+@lru_cache(maxsize=1024)
+def parse_windspeed(value):
+    """
+    Parse a NOAA wind speed such as "7 mph" or "10 to 15 mph" into mph, using the
+    midpoint of a range. NOAA only uses a few dozen distinct strings, so they are cached.
+    """
+    if not value:
+        return 0.0
+    match = WIND.search(value)
+    if match is None:
+        return math.nan
+    low, high, units = match.groups()
+    speed = float(low) if high is None else (float(low) + float(high)) / 2
+    return speed * WIND_UNITS[(units or "mph").lower()]
+
+
+@lru_cache(maxsize=4096)
+def parse_hour(value):
+    """
+    Return the local time of day (in hours) of an ISO 8601 timestamp.
+    """
+    if value is None:
+        return math.nan
+    ts = datetime.fromisoformat(value)
+    return ts.hour + ts.minute / 60
+
+
+def _measurement(data, field):
+    measurement = data.get(field, None)
+    if measurement is None:
+        return None
+    return measurement.get("value", None)
+
+
+def _convert(value, units, to):
+    if value is None:
+        return math.nan
+    if units == to or units is None:
+        return float(value)
+    if to == "F":
+        return value * 9 / 5 + 32
+    return (value - 32) * 5 / 9
+
+
+class FeatureExtractor:
+    """
+    FeatureExtractor converts forecast periods into feature vectors, one period at a
+    time or a batch at a time straight into a NumPy array, either from the decoded
+    period dicts or from the fixed-width columns of binary events.
+    """
+
+    def __init__(self, features=("temperature", "precipitation"), units="F"):
+        """
+        Parameters
+        ----------
+        features : sequence of string, default: ("temperature", "precipitation")
+            The features to extract, in order; see FEATURES
+
+        units : string, default: "F"
+            The units temperatures and dewpoints are normalized to, "F" or "C"
+        """
+        unknown = [name for name in features if name not in FEATURES]
+        if unknown:
+            raise ValueError(f"unknown features {unknown}, choose from {list(FEATURES)}")
+        if units not in ("F", "C"):
+            raise ValueError(f"units must be 'F' or 'C', not {units!r}")
+
+        self.features = tuple(features)
+        self.units = units
+        self.n_features = len(self.features)
+        # Whether binary events can be transformed without decoding their strings
+        self.columnar = not STRING_FEATURES.intersection(self.features)
+        self.extractors = [getattr(self, "_" + name) for name in self.features]
+
+    def _temperature(self, data):
+        return _convert(data.get("temperature", None), data.get("units", None), self.units)
+
+    def _precipitation(self, data):
+        value = _measurement(data, "precipitation")
+        return 0.0 if value is None else float(value)
+
+    def _humidity(self, data):
+        value = _measurement(data, "humidity")
+        return math.nan if value is None else float(value)
+
+    def _dewpoint(self, data):
+        return _convert(_measurement(data, "dewpoint"), "C", self.units)
+
+    def _windspeed(self, data):
+        return parse_windspeed(data.get("windspeed", None))
+
+    def _daytime(self, data):
+        daytime = data.get("daytime", None)
+        return math.nan if daytime is None else float(daytime)
+
+    def _hour_sin(self, data):
+        return math.sin(2 * math.pi * parse_hour(data.get("start", None)) / 24)
+
+    def _hour_cos(self, data):
+        return math.cos(2 * math.pi * parse_hour(data.get("start", None)) / 24)
+
+    def transform_one(self, data):
+        """
+        Return the feature vector of a single forecast period dict.
+        """
+        return np.array([extract(data) for extract in self.extractors])
+
+    def transform(self, records):
+        """
+        Return the feature vectors of a list of forecast period dicts as an array of
+        shape (len(records), n_features).
+        """
+        X = np.empty((len(records), self.n_features))
+        for j, extract in enumerate(self.extractors):
+            X[:, j] = [extract(data) for data in records]
+        return X
+
+    def transform_columns(self, records):
+        """
+        Return the feature vectors of the periods of a binary event, given the
+        structured array returned by `wire_format.columns`. Only available when
+        `columnar` is True.
+        """
+        if not self.columnar:
+            raise ValueError(f"{sorted(STRING_FEATURES.intersection(self.features))} need decoded events")
+
+        flags = records["flags"]
+        hours = None
+        X = np.empty((len(records), self.n_features))
+        for j, name in enumerate(self.features):
+            if name == "temperature":
+                column = np.where(records["temperature"] == NULL_INT, np.nan, records["temperature"].astype(float))
+                celsius = records["units"] == ord("C")
+                fahrenheit = records["units"] == ord("F")
+                if self.units == "F":
+                    column = np.where(celsius, column * 9 / 5 + 32, column)
+                else:
+                    column = np.where(fahrenheit, (column - 32) * 5 / 9, column)
+            elif name == "precipitation":
+                column = records["precipitation"].astype(float)
+                column[(records["precipitation"] == NULL_INT) | (flags & NO_PRECIPITATION > 0)] = 0
+            elif name == "humidity":
+                column = records["humidity"].astype(float)
+                column[(records["humidity"] == NULL_INT) | (flags & NO_HUMIDITY > 0)] = np.nan
+            elif name == "dewpoint":
+                column = records["dewpoint"].astype(float)
+                column[flags & NO_DEWPOINT > 0] = np.nan
+                if self.units == "F":
+                    column = column * 9 / 5 + 32
+            elif name == "daytime":
+                column = (flags & DAYTIME > 0).astype(float)
+                column[flags & NO_DAYTIME > 0] = np.nan
+            else:
+                if hours is None:
+                    local = records["start"] + records["start_offset"].astype(np.int64) * 60
+                    hours = (local % 86400) / 3600
+                    hours[flags & NO_START > 0] = np.nan
+                trig = np.sin if name == "hour_sin" else np.cos
+                column = trig(2 * np.pi * hours / 24)
+            X[:, j] = column
+        return X
+
+
+def feature_list(value):
+    """
+    Parse a comma separated list of feature names, e.g. from the command line.
+    """
+    return [name.strip() for name in value.split(",") if name.strip()]
@@ -0,0 +1,98 @@
+import os
+import json
+import time
+
+
+class ForecastLinkCache:
+    """
+    ForecastLinkCache remembers which NOAA forecast URL (and grid cell) each city
+    resolves to, so that the `/points` lookup only has to be made once per city
+    rather than once per sweep. The cache is persisted to disk so that restarting the
+    publisher does not pay the lookup cost again.
+    """
+
+    def __init__(self, path="forecast_links.json", ttl=7 * 24 * 60 * 60):
+        """
+        Parameters
+        ----------
+        path : string, default: "forecast_links.json"
+            The file the cache is loaded from and saved to. Set to None to keep the
+            cache in memory only.
+
+        ttl : int, default: 604800
+            The number of seconds an entry is trusted before the `/points` lookup is
+            made again to revalidate it. NOAA rarely moves grid cells, so a week is a
+            sensible default.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.entries = self._load()
+        self.dirty = False
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return dict()
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"unable to load forecast link cache, starting empty: {e}")
+            return dict()
+
+    def get(self, city):
+        """
+        Return the cached entry for a city, or None if the city has never been
+        resolved or its entry is older than the TTL.
+
+        Returns
+        -------
+        entry : dict or None
+            A dictionary with the "forecast" URL, "gridId", "gridX", "gridY" and the
+            "fetched" timestamp of the lookup
+        """
+        entry = self.entries.get(city, None)
+        if entry is None:
+            return None
+        if time.time() - entry.get("fetched", 0) > self.ttl:
+            return None
+        return entry
+
+    def put(self, city, properties):
+        """
+        Record the forecast URL and grid cell from the properties of a `/points`
+        response for a city.
+        """
+        entry = {
+            "forecast": properties["forecast"],
+            "gridId": properties.get("gridId", None),
+            "gridX": properties.get("gridX", None),
+            "gridY": properties.get("gridY", None),
+            "fetched": time.time(),
+        }
+        self.entries[city] = entry
+        self.dirty = True
+        return entry
+
+    def invalidate(self, city):
+        """
+        Drop a city's entry, e.g. because its forecast URL returned a 404 or its
+        `/points` response no longer contains a forecast link.
+        """
+        if self.entries.pop(city, None) is not None:
+            self.dirty = True
+
+    def save(self):
+        """
+        Write the cache to disk if it has changed. The file is replaced atomically so
+        that a crash mid-write never leaves a corrupt cache behind.
+        """
+        if self.path is None or not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except Exception as e:
+            print(f"unable to save forecast link cache: {e}")
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+
+
+# Fields that identify the city of a period rather than its forecast, left out of
+# the hashes so that e.g. renumbering the city catalog does not republish everything
+CITY_FIELDS = ("city_id", "city", "state")
+
+
+class ForecastState:
+    """
+    ForecastState remembers what the publisher has already seen from the NOAA API so
+    that unchanged forecasts cost (almost) nothing on the next sweep:
+
+        - the ETag/Last-Modified validators of each forecast URL, which are sent back
+          as If-None-Match/If-Modified-Since so NOAA can answer 304 Not Modified
+        - a content hash per (city, period start), so that only new or changed
+          periods are published when a forecast has been regenerated
+
+    Both are only recorded once the events of a forecast have been committed (see
+    `record` and `update_validators`), so a forecast that failed to publish is
+    fetched and published again rather than answered with 304 or skipped as
+    unchanged.
+    """
+
+    def __init__(self, path="forecast_state.json"):
+        """
+        Parameters
+        ----------
+        path : string, default: "forecast_state.json"
+            The file the state is loaded from and saved to. Set to None to keep the
+            state in memory only.
+        """
+        self.path = path
+        state = self._load()
+        self.validators = state.get("validators", dict())
+        self.hashes = state.get("hashes", dict())
+        self.dirty = False
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return dict()
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"unable to load forecast state, starting empty: {e}")
+            return dict()
+
+    def conditional_headers(self, url):
+        """
+        Return the request headers that make a GET of `url` conditional on the
+        forecast having changed since it was last retrieved.
+        """
+        validator = self.validators.get(url, None)
+        if validator is None:
+            return dict()
+
+        headers = dict()
+        if validator.get("etag", None) is not None:
+            headers["If-None-Match"] = validator["etag"]
+        if validator.get("last_modified", None) is not None:
+            headers["If-Modified-Since"] = validator["last_modified"]
+        return headers
+
+    def update_validators(self, url, headers):
+        """
+        Store the ETag/Last-Modified headers of a successful forecast response.
+        """
+        validator = {
+            "etag": headers.get("ETag", None),
+            "last_modified": headers.get("Last-Modified", None),
+        }
+        if validator["etag"] is None and validator["last_modified"] is None:
+            if self.validators.pop(url, None) is not None:
+                self.dirty = True
+            return
+
+        if self.validators.get(url, None) != validator:
+            self.validators[url] = validator
+            self.dirty = True
+
+    def invalidate(self, url):
+        """
+        Forget the validators of a forecast URL so the next GET is unconditional.
+        """
+        if self.validators.pop(url, None) is not None:
+            self.dirty = True
+
+    def _digest(self, data):
+        forecast = {field: value for field, value in data.items() if field not in CITY_FIELDS}
+        return hashlib.blake2b(
+            json.dumps(forecast, sort_keys=True).encode("utf-8"), digest_size=8
+        ).hexdigest()
+
+    def changed(self, city, data):
+        """
+        Return True if the period in `data` is new or differs from the last version
+        recorded as published for this city.
+        """
+        periods = self.hashes.get(city, None)
+        return periods is None or periods.get(data["start"], None) != self._digest(data)
+
+    def record(self, city, data):
+        """
+        Remember the hash of a period once it has been published for this city.
+        """
+        digest = self._digest(data)
+        periods = self.hashes.setdefault(city, dict())
+        if periods.get(data["start"], None) != digest:
+            periods[data["start"]] = digest
+            self.dirty = True
+
+    def retain(self, city, starts):
+        """
+        Drop the hashes of periods that are no longer part of a city's forecast so
+        the state does not grow without bound.
+        """
+        periods = self.hashes.get(city, None)
+        if periods is None:
+            return
+        for start in set(periods) - set(starts):
+            del periods[start]
+            self.dirty = True
+
+    def save(self):
+        """
+        Write the state to disk if it has changed, replacing the file atomically.
+        """
+        if self.path is None or not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"validators": self.validators, "hashes": self.hashes}, f)
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except Exception as e:
+            print(f"unable to save forecast state: {e}")
@@ -0,0 +1,61 @@
+import time
+import asyncio
+
+
+class MicroBatcher:
+    """
+    MicroBatcher collects items and hands them to a coroutine in batches, whenever
+    `size` items have been collected or `timeout` seconds have passed since the first
+    item of the batch arrived, whichever comes first.
+    """
+
+    def __init__(self, handle_batch, size=512, timeout=1.0):
+        """
+        Parameters
+        ----------
+        handle_batch : coroutine function
+            Called with the list of items in each batch
+
+        size : int, default: 512
+            The maximum number of items in a batch
+
+        timeout : float, default: 1.0
+            The maximum number of seconds an item waits for its batch to fill up
+        """
+        self.handle_batch = handle_batch
+        self.size = size
+        self.timeout = timeout
+        self.items = []
+        self.started = None
+        self.lock = asyncio.Lock()
+        self.timer = None
+
+    async def add(self, item):
+        """
+        Add an item, handling the batch if it is full.
+        """
+        if not self.items:
+            self.started = time.monotonic()
+            self.timer = asyncio.create_task(self._flush_after(self.timeout))
+        self.items.append(item)
+
+        if len(self.items) >= self.size:
+            await self.flush()
+
+    async def _flush_after(self, delay):
+        await asyncio.sleep(delay)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        """
+        Handle the items collected so far, if any.
+        """
+        async with self.lock:
+            if not self.items:
+                return
+            items, self.items = self.items, []
+            if self.timer is not None and self.timer is not asyncio.current_task():
+                self.timer.cancel()
+            self.timer = None
+            await self.handle_batch(items)
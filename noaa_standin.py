@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+from aiohttp import web
+
+
+ME = "(https://rotational.io/data-playground/noaa/, veldman@uchicago.edu)"
+NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+SUMMARIES = ["Sunny", "Mostly Sunny", "Partly Cloudy", "Mostly Cloudy", "Chance Rain Showers", "Rain"]
+
+
+class NOAAStandIn:
+    """
+    NOAAStandIn is a local stand-in for the parts of api.weather.gov that the
+    WeatherPublisher uses: the `/points/{lat},{long}` lookup and the grid forecast.
+    Responses come from recorded fixtures where available and are otherwise generated
+    deterministically from the coordinates, so the publisher can be load tested
+    offline. Latency, failures and rate limiting can be injected to see how the
+    publisher copes with a misbehaving API.
+    """
+
+    def __init__(self, fixtures=None, latency=0.05, latency_jitter=0.02, timeout_rate=0,
+                 error_rate=0, missing_forecast_rate=0, rate_limit=None, hang=60,
+                 update_period=3600, max_age=600, seed=0):
+        """
+        Parameters
+        ----------
+        fixtures : string, default: None
+            A directory of fixtures written by `record`. Points and forecasts that
+            are not in the fixtures are generated.
+
+        latency : float, default: 0.05
+            The mean number of seconds each response is delayed by
+
+        latency_jitter : float, default: 0.02
+            The standard deviation of the response delay
+
+        timeout_rate : float, default: 0
+            The fraction of requests that hang for `hang` seconds, long enough for the
+            client to time out
+
+        error_rate : float, default: 0
+            The fraction of requests answered with a 500, 502 or 503
+
+        missing_forecast_rate : float, default: 0
+            The fraction of `/points` responses that do not contain a "forecast" link
+
+        rate_limit : float, default: None
+            The maximum number of requests per second; requests over the limit are
+            answered with 429 and a Retry-After header. None disables the limit.
+
+        hang : int, default: 60
+            The number of seconds a "timed out" request hangs for
+
+        update_period : int, default: 3600
+            How often generated forecasts change, which also changes their ETag
+
+        max_age : int, default: 600
+            The max-age advertised in the Cache-Control header of forecasts
+
+        seed : int, default: 0
+            Seed for the injected latency and failures
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.timeout_rate = timeout_rate
+        self.error_rate = error_rate
+        self.missing_forecast_rate = missing_forecast_rate
+        self.rate_limit = rate_limit
+        self.hang = hang
+        self.update_period = update_period
+        self.max_age = max_age
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self.tokens = rate_limit or 0
+        self.refilled = time.monotonic()
+        self.points, self.forecasts = self._load_fixtures(fixtures)
+
+    def _load_fixtures(self, fixtures):
+        if fixtures is None:
+            return dict(), dict()
+        try:
+            with open(os.path.join(fixtures, "points.json")) as f:
+                points = json.load(f)
+            with open(os.path.join(fixtures, "forecasts.json")) as f:
+                forecasts = json.load(f)
+            return points, forecasts
+        except Exception as e:
+            raise OSError(f"unable to load NOAA fixtures from {fixtures}: ", e)
+
+    def app(self):
+        """
+        Create the aiohttp application serving the stand-in API.
+        """
+        app = web.Application(middlewares=[self.inject])
+        app.router.add_get("/points/{point}", self.handle_points)
+        app.router.add_get("/gridpoints/{office}/{grid}/forecast", self.handle_forecast)
+        app.router.add_get("/_stats", self.handle_stats)
+        return app
+
+    @web.middleware
+    async def inject(self, request, handler):
+        """
+        Apply the configured latency, rate limit and failures to every request.
+        """
+        if request.path == "/_stats":
+            return await handler(request)
+
+        self.stats["requests"] += 1
+        await asyncio.sleep(max(0, self.random.gauss(self.latency, self.latency_jitter)))
+
+        if self.rate_limit is not None and not self._take_token():
+            self.stats["429"] += 1
+            return web.json_response(
+                {"title": "Too Many Requests", "status": 429},
+                status=429, headers={"Retry-After": "1"},
+            )
+
+        roll = self.random.random()
+        if roll < self.timeout_rate:
+            self.stats["timeout"] += 1
+            await asyncio.sleep(self.hang)
+        elif roll < self.timeout_rate + self.error_rate:
+            status = self.random.choice([500, 502, 503])
+            self.stats[str(status)] += 1
+            return web.json_response(
+                {"title": "Unexpected Problem", "status": status}, status=status
+            )
+
+        response = await handler(request)
+        self.stats[str(response.status)] += 1
+        return response
+
+    def _take_token(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate_limit, self.tokens + (now - self.refilled) * self.rate_limit)
+        self.refilled = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.stats))
+
+    async def handle_points(self, request):
+        point = request.match_info["point"]
+        try:
+            lat, long = [float(x) for x in point.split(",")]
+        except ValueError:
+            return web.json_response({"title": "Invalid Parameter", "status": 400}, status=400)
+
+        if point in self.points:
+            properties = dict(self.points[point]["properties"])
+        else:
+            office, x, y = grid_cell(lat, long)
+            properties = {"gridId": office, "gridX": x, "gridY": y}
+
+        # Point the forecast link back at the stand-in rather than api.weather.gov
+        grid = f"{properties['gridX']},{properties['gridY']}"
+        properties["forecast"] = f"{request.scheme}://{request.host}/gridpoints/{properties['gridId']}/{grid}/forecast"
+
+        if self.random.random() < self.missing_forecast_rate:
+            self.stats["missing_forecast"] += 1
+            del properties["forecast"]
+
+        return web.json_response({"properties": properties}, content_type="application/geo+json")
+
+    async def handle_forecast(self, request):
+        office = request.match_info["office"]
+        grid = request.match_info["grid"]
+        key = f"{office}/{grid}"
+
+        if key in self.forecasts:
+            forecast = self.forecasts[key]
+            etag = '"' + hashlib.blake2b(json.dumps(forecast).encode("utf-8"), digest_size=8).hexdigest() + '"'
+        else:
+            generation = int(time.time() // self.update_period)
+            etag = f'"{office}-{grid}-{generation}"'
+            forecast = None
+
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={self.max_age}"}
+        if request.headers.get("If-None-Match", None) == etag:
+            return web.Response(status=304, headers=headers)
+
+        if forecast is None:
+            forecast = generate_forecast(office, grid, generation * self.update_period)
+        return web.json_response(forecast, headers=headers, content_type="application/geo+json")
+
+
+def grid_cell(lat, long, size=0.025):
+    """
+    Map a coordinate to a synthetic grid cell roughly the size of an NWS 2.5km cell.
+    """
+    office = "S" + str(int((long + 180) // 10)).zfill(2)
+    return office, int((lat + 90) / size), int((long + 180) / size)
+
+
+def generate_forecast(office, grid, generated):
+    """
+    Generate a deterministic 14 period forecast for a grid cell in the NOAA format.
+    """
+    rng = random.Random(f"{office}/{grid}/{generated}")
+    x, _ = [int(v) for v in grid.split(",")]
+    lat = x * 0.025 - 90
+    base = 95 - abs(lat) * 1.2 + rng.uniform(-8, 8)
+
+    generated_at = datetime.fromtimestamp(generated, tz=timezone.utc)
+    start = generated_at.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    periods = []
+    for number in range(1, 15):
+        daytime = 6 <= start.hour < 18
+        end = start + timedelta(hours=12 - (start.hour % 12))
+        precipitation = rng.choice([None, rng.randint(0, 100)])
+        periods.append({
+            "number": number,
+            "name": NAMES[start.weekday()] + ("" if daytime else " Night"),
+            "startTime": start.isoformat(),
+            "endTime": end.isoformat(),
+            "isDaytime": daytime,
+            "temperature": round(base + (6 if daytime else -6) + rng.uniform(-4, 4)),
+            "temperatureUnit": "F",
+            "probabilityOfPrecipitation": {"unitCode": "wmoUnit:percent", "value": precipitation},
+            "dewpoint": {"unitCode": "wmoUnit:degC", "value": rng.uniform(-5, 20)},
+            "relativeHumidity": {"unitCode": "wmoUnit:percent", "value": rng.randint(20, 100)},
+            "windSpeed": rng.choice(["5 mph", "7 mph", "10 mph", "5 to 10 mph", "10 to 15 mph"]),
+            "windDirection": rng.choice(["N", "E", "S", "W"]),
+            "shortForecast": rng.choice(SUMMARIES),
+        })
+        start = end
+
+    timestamp = generated_at.isoformat()
+    return {"properties": {
+        "updated": timestamp, "generatedAt": timestamp, "updateTime": timestamp,
+        "units": "us", "periods": periods,
+    }}
+
+
+async def serve(standin, host="127.0.0.1", port=8080):
+    """
+    Start serving the stand-in API, returning the runner and the bound port.
+    """
+    runner = web.AppRunner(standin.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, port
+
+
+async def record(fixtures, cities="cities.json", user=ME):
+    """
+    Record the real NOAA API responses for every city in `cities` into the fixtures
+    directory, for the stand-in to replay.
+    """
+    with open(cities) as f:
+        locations = json.load(f)
+
+    points, forecasts = dict(), dict()
+    headers = {"User-Agent": user}
+    async with aiohttp.ClientSession(headers=headers, raise_for_status=True) as session:
+        for location in locations:
+            point = f"{location['latitude']},{location['longitude']}"
+            try:
+                async with session.get("https://api.weather.gov/points/" + point) as response:
+                    points[point] = await response.json(content_type=None)
+                properties = points[point]["properties"]
+                async with session.get(properties["forecast"]) as response:
+                    key = f"{properties['gridId']}/{properties['gridX']},{properties['gridY']}"
+                    forecasts[key] = await response.json(content_type=None)
+            except Exception as e:
+                print(f"unable to record {location['city']}: {e}")
+
+    os.makedirs(fixtures, exist_ok=True)
+    with open(os.path.join(fixtures, "points.json"), "w") as f:
+        json.dump(points, f)
+    with open(os.path.join(fixtures, "forecasts.json"), "w") as f:
+        json.dump(forecasts, f)
+    print(f"recorded {len(points)} points and {len(forecasts)} forecasts to {fixtures}")
+
+
+def standin_arguments(parser):
+    """
+    Add the stand-in's latency and failure options to an argument parser.
+    """
+    parser.add_argument("--fixtures", default=None, help="directory of recorded fixtures")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean response delay in seconds")
+    parser.add_argument("--timeout-rate", type=float, default=0, help="fraction of requests that hang")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests that fail with 5xx")
+    parser.add_argument("--missing-forecast-rate", type=float, default=0, help="fraction of points without a forecast link")
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second before answering 429")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def standin_from_arguments(args):
+    return NOAAStandIn(
+        fixtures=args.fixtures,
+        latency=args.latency,
+        latency_jitter=args.latency / 2.5,
+        timeout_rate=args.timeout_rate,
+        error_rate=args.error_rate,
+        missing_forecast_rate=args.missing_forecast_rate,
+        rate_limit=args.rate_limit,
+        seed=args.seed,
+    )
+
+
+async def main(args):
+    if args.command == "record":
+        await record(args.fixtures or "noaa_fixtures")
+        return
+
+    runner, port = await serve(standin_from_arguments(args), port=args.port)
+    print(f"NOAA stand-in listening on http://127.0.0.1:{port}/points/")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the NOAA weather API")
+    parser.add_argument("command", nargs="?", choices=["serve", "record"], default="serve")
+    parser.add_argument("--port", type=int, default=8080)
+    standin_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,182 @@
+import time
+import asyncio
+from collections import deque, Counter
+
+from metrics import Histogram, counter, gauge, histogram
+
+
+class PublishPipeline:
+    """
+    PublishPipeline publishes events to a topic without waiting for each one to be
+    committed before sending the next. At most `window` events are in flight (sent
+    but not yet acked or nacked) at any time, and acks/nacks are tallied into
+    counters and latency statistics rather than printed one by one.
+
+    NOTE: pyensign binds the ack/nack callbacks to a topic's publish stream the first
+    time it is published to, so the callbacks are the pipeline's own bound methods and
+    acks are matched to send times in the order they were sent.
+    """
+
+    def __init__(self, transport, topic, window=256, drain_timeout=30):
+        """
+        Parameters
+        ----------
+        transport : Ensign or EventLog
+            The client used to publish events
+
+        topic : string
+            The name of the topic to publish to
+
+        window : int, default: 256
+            The maximum number of events that may be awaiting an ack or nack
+
+        drain_timeout : int, default: 30
+            The number of seconds `drain` waits for outstanding acks before the
+            remaining events are counted as lost
+        """
+        self.transport = transport
+        self.topic = topic
+        self.window = window
+        self.drain_timeout = drain_timeout
+        self.slots = asyncio.Semaphore(window)
+        self.pending = deque()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.reset()
+
+        self.totals = {
+            outcome: counter(f"events_{outcome}_total", f"Events {outcome} on the topic", topic=topic)
+            for outcome in ("sent", "acked", "nacked", "lost")
+        }
+        self.ack_seconds = histogram(
+            "publish_ack_seconds", "Time from sending an event to its ack or nack", topic=topic
+        )
+        gauge("publish_in_flight", "Events awaiting an ack or nack", fn=lambda: len(self.pending), topic=topic)
+
+    def reset(self):
+        """
+        Start a new set of counters, e.g. at the beginning of a sweep.
+        """
+        self.started = time.monotonic()
+        self.sent = 0
+        self.acked = 0
+        self.nacked = 0
+        self.lost = 0
+        self.errors = Counter()
+        # Fixed buckets rather than every latency, so a long-running pipeline stays bounded
+        self.latencies = Histogram()
+        self.max_latency = 0.0
+
+    async def publish(self, event, on_commit=None):
+        """
+        Send an event, or a list of events, once there is room in the window. Lists
+        longer than the window are sent in chunks of at most `window` events, each one
+        once the previous chunks have made room for it. Returns as soon as the events
+        have been queued for publishing.
+
+        Parameters
+        ----------
+        event : Event or list of Event
+            The events to publish
+
+        on_commit : coroutine function, default: None
+            Called for each event with True once it is acked, or False if it is
+            nacked or lost
+        """
+        events = event if isinstance(event, list) else [event]
+        for start in range(0, len(events), self.window):
+            await self._send(events[start:start + self.window], on_commit)
+
+    async def _send(self, events, on_commit):
+        entries = []
+        for _ in events:
+            await self.slots.acquire()
+            entry = (time.monotonic(), on_commit)
+            entries.append(entry)
+            self.pending.append(entry)
+        self.idle.clear()
+        self.sent += len(events)
+        self.totals["sent"].inc(len(events))
+        try:
+            await self.transport.publish(
+                self.topic, *events, on_ack=self.on_ack, on_nack=self.on_nack
+            )
+        except Exception:
+            # Fail this send's events only, not the earlier ones still awaiting acks
+            failed = {id(entry) for entry in entries}
+            self.pending = deque(entry for entry in self.pending if id(entry) not in failed)
+            for entry in entries:
+                await self._finish(entry, False)
+            if not self.pending:
+                self.idle.set()
+            raise
+
+    async def on_ack(self, ack):
+        self.acked += 1
+        self.totals["acked"].inc()
+        await self._complete(True)
+
+    async def on_nack(self, nack):
+        self.nacked += 1
+        self.totals["nacked"].inc()
+        self.errors[f"{nack.code}: {nack.error}"] += 1
+        await self._complete(False)
+
+    async def _complete(self, committed):
+        if self.pending:
+            await self._finish(self.pending.popleft(), committed)
+        if not self.pending:
+            self.idle.set()
+
+    async def _finish(self, entry, committed):
+        sent, on_commit = entry
+        latency = time.monotonic() - sent
+        self.latencies.observe(latency)
+        self.max_latency = max(self.max_latency, latency)
+        self.ack_seconds.observe(latency)
+        self.slots.release()
+        if on_commit is not None:
+            await on_commit(committed)
+
+    async def drain(self):
+        """
+        Wait for every in-flight event to be acked or nacked. Events that are still
+        outstanding after `drain_timeout` seconds are counted as lost and their slots
+        are returned to the window.
+        """
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            self.lost += len(self.pending)
+            self.totals["lost"].inc(len(self.pending))
+            pending, self.pending = self.pending, deque()
+            for _, on_commit in pending:
+                self.slots.release()
+                if on_commit is not None:
+                    await on_commit(False)
+            self.idle.set()
+
+    def summary(self):
+        """
+        Summarize the counters since the last `reset` in a single line.
+        """
+        elapsed = time.monotonic() - self.started
+        line = (
+            f"published {self.sent} events in {elapsed:.2f}s "
+            f"({self.sent / elapsed if elapsed else 0:.1f}/s): "
+            f"{self.acked} acked, {self.nacked} nacked, {self.lost} lost"
+        )
+
+        if self.latencies.count:
+            # Quantiles are bucket upper bounds, so they are capped by the max
+            p50, p99 = (
+                min(self.max_latency, self.latencies.quantile(q) or self.max_latency) for q in (0.5, 0.99)
+            )
+            line += (
+                f"; ack latency p50<={p50 * 1000:.1f}ms p99<={p99 * 1000:.1f}ms "
+                f"max={self.max_latency * 1000:.1f}ms"
+            )
+
+        for error, count in self.errors.most_common(3):
+            line += f"; nack {error} x{count}"
+        return line
@@ -0,0 +1,391 @@
+"""
+Admission control for the NOAA API requests of the publisher. Every request goes
+through one RequestLimiter shared by the /points and forecast endpoints:
+
+    a token bucket      starts at most `rate` requests per second (with bursts of up to
+                        `burst`), halves the rate on a 429 and creeps back up to `rate`
+                        as requests succeed, and starts no request before a Retry-After
+    retries             429s, 5xx, timeouts and connection errors are retried up to
+                        `max_retries` times with exponential backoff and full jitter
+                        (or after Retry-After if it is longer), as long as the retry
+                        budget allows: retries are capped at a fraction of requests, so
+                        an outage does not multiply the load
+    a circuit breaker   opens after `failures` failed attempts in a row (5xx, timeouts
+                        and connection errors, not 429s), rejecting every request with
+                        CircuitOpen for `reset_timeout` seconds, then lets one request
+                        through to probe whether NOAA has recovered
+
+Other errors (e.g. 404) are not retried and are raised as they are.
+"""
+
+import time
+import random
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+from metrics import counter, gauge
+
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of making a request while the circuit breaker is open.
+    """
+
+
+class TokenBucket:
+    """
+    TokenBucket spaces out requests to an average of `rate` per second. Waiters are
+    served in order, one at a time: the first one waits until a token has been earned,
+    re-checking after every sleep, so a `pause` or `slow_down` in the meantime delays
+    the requests already waiting too. The rate adapts: `slow_down` multiplies it by `decrease` (at most once per
+    `cooldown`, since the requests in flight are all answered 429 together) and every
+    `speed_up` adds back `recovery` times the maximum rate.
+    """
+
+    def __init__(self, rate, burst=1, min_rate=None, decrease=0.5, recovery=0.05, cooldown=1.0,
+                 clock=time.monotonic):
+        """
+        Parameters
+        ----------
+        rate : float
+            The maximum number of requests per second
+
+        burst : float, default: 1
+            The number of requests that may start at once after an idle period
+
+        min_rate : float, default: None
+            The rate is never slowed down below this, `rate` / 10 by default
+
+        decrease : float, default: 0.5
+            The factor the rate is multiplied by when slowing down
+
+        recovery : float, default: 0.05
+            The fraction of the maximum rate added back on each success
+
+        cooldown : float, default: 1.0
+            The minimum number of seconds between two slow downs
+
+        clock : function, default: time.monotonic
+            Returns the current time in seconds
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 10 if min_rate is None else min_rate
+        self.capacity = burst
+        self.decrease = decrease
+        self.recovery = recovery
+        self.cooldown = cooldown
+        self.clock = clock
+        self.slowed = None
+        self.waiters = asyncio.Lock()
+        self.tokens = burst
+        # Tokens are earned from this time on, which is in the future while paused
+        self.updated = clock()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self):
+        """
+        Return the number of seconds until a token is available at the current rate.
+        """
+        now = self.clock()
+        self._refill(now)
+        return max(0.0, self.updated - now) + max(0.0, 1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        """
+        Wait until a request may be started.
+        """
+        # asyncio.Lock wakes its waiters in order
+        async with self.waiters:
+            while True:
+                delay = self.wait_time()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self.tokens -= 1
+
+    def pause(self, seconds):
+        """
+        Start no request for `seconds`, e.g. as asked by a Retry-After header.
+        """
+        now = self.clock()
+        self._refill(now)
+        if now + seconds > self.updated:
+            self.updated = now + seconds
+            # Resume at the rate rather than with a burst
+            self.tokens = min(self.tokens, 0)
+
+    def slow_down(self):
+        now = self.clock()
+        if self.slowed is not None and now - self.slowed < self.cooldown:
+            return
+        self._refill(now)
+        self.slowed = now
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    def speed_up(self):
+        if self.rate < self.max_rate:
+            self._refill(self.clock())
+            self.rate = min(self.max_rate, self.rate + self.recovery * self.max_rate)
+
+
+class RetryBudget:
+    """
+    RetryBudget caps retries at a fraction of requests: every request deposits
+    `ratio` of a retry, every retry withdraws one, and `reserve` retries are always
+    available to start with. The balance is capped so a long healthy period does not
+    bank an unbounded burst of retries.
+    """
+
+    def __init__(self, ratio=0.2, reserve=10, cap=100):
+        self.ratio = ratio
+        self.cap = cap
+        self.balance = reserve
+
+    def deposit(self):
+        self.balance = min(self.cap, self.balance + self.ratio)
+
+    def withdraw(self):
+        """
+        Return True and spend a retry if the budget allows one.
+        """
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker stops requests to a service that keeps failing. It is closed
+    (requests go through) until `failures` attempts in a row fail, then open (every
+    request is rejected) for `reset_timeout` seconds, then half open: a single probe
+    request goes through, closing the circuit if it succeeds and opening it again if
+    it fails.
+    """
+
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self, failures=20, reset_timeout=30, clock=time.monotonic):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.consecutive = 0
+        self.opened = 0.0
+        self.probing = False
+
+    def allow(self):
+        """
+        Return True if a request may be made now.
+        """
+        if self.state == self.OPEN:
+            if self.clock() - self.opened < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.probing = False
+        if self.state == self.HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def success(self):
+        self.state = self.CLOSED
+        self.consecutive = 0
+        self.probing = False
+
+    def failure(self):
+        """
+        Record a failed attempt, returning True if it opened the circuit.
+        """
+        self.consecutive += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.consecutive >= self.failures):
+            self.state = self.OPEN
+            self.opened = self.clock()
+            self.probing = False
+            return True
+        return False
+
+
+def retry_after(headers, now=None):
+    """
+    Return the number of seconds a Retry-After header (in seconds or an HTTP date)
+    asks to wait, or None if there is none.
+    """
+    value = headers.get("Retry-After", None) if headers else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = datetime.now(timezone.utc).timestamp() if now is None else now
+    return max(0.0, when.timestamp() - now)
+
+
+class RequestLimiter:
+    """
+    RequestLimiter runs requests to an API through a shared token bucket, retry
+    budget and circuit breaker (see the module docstring).
+    """
+
+    def __init__(self, rate=10, burst=1, max_retries=3, backoff=0.5, max_backoff=30, max_retry_after=300,
+                 retry_ratio=0.2, failures=20, reset_timeout=30, seed=None):
+        """
+        Parameters
+        ----------
+        rate : float, default: 10
+            The maximum number of requests started per second
+
+        burst : float, default: 1
+            The number of requests that may start at once after an idle period
+
+        max_retries : int, default: 3
+            The maximum number of retries of a request
+
+        backoff : float, default: 0.5
+            The base of the exponential backoff in seconds: retry n waits a random
+            time up to backoff * 2^n
+
+        max_backoff : float, default: 30
+            The maximum backoff in seconds
+
+        max_retry_after : float, default: 300
+            Retry-After values are capped at this many seconds
+
+        retry_ratio : float, default: 0.2
+            The maximum number of retries per request, over time
+
+        failures : int, default: 20
+            The number of failed attempts in a row that opens the circuit breaker
+
+        reset_timeout : float, default: 30
+            The number of seconds the circuit stays open before a probe is let through
+
+        seed : int, default: None
+            Seed for the backoff jitter
+        """
+        self.bucket = TokenBucket(rate, burst=burst)
+        self.budget = RetryBudget(ratio=retry_ratio)
+        self.breaker = CircuitBreaker(failures=failures, reset_timeout=reset_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.random = random.Random(seed)
+
+        self.metrics = dict()
+        gauge("noaa_request_rate", "Current NOAA API request rate limit per second", fn=lambda: self.bucket.rate)
+        gauge("noaa_circuit_state", "NOAA circuit breaker state: 0 closed, 1 open, 2 half open",
+              fn=lambda: self.breaker.state)
+        gauge("noaa_retry_budget", "Retries of NOAA API requests currently allowed", fn=lambda: self.budget.balance)
+
+    def _counters(self, endpoint):
+        counters = self.metrics.get(endpoint, None)
+        if counters is None:
+            counters = self.metrics[endpoint] = {
+                "retries": counter("noaa_retries_total", "NOAA API requests retried", endpoint=endpoint),
+                "throttled": counter("noaa_throttled_total", "NOAA API 429 responses", endpoint=endpoint),
+                "rejected": counter(
+                    "noaa_circuit_rejections_total", "NOAA API requests rejected by the open circuit",
+                    endpoint=endpoint,
+                ),
+            }
+        return counters
+
+    def classify(self, error):
+        """
+        Return whether a failed attempt should be retried, and the Retry-After in
+        seconds if the response had one.
+        """
+        if isinstance(error, aiohttp.ClientResponseError):
+            if error.status not in RETRY_STATUSES:
+                return False, None
+            wait = retry_after(error.headers)
+            return True, None if wait is None else min(wait, self.max_retry_after)
+        return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)), None
+
+    def delay(self, attempt):
+        """
+        Return the backoff before retry number `attempt` (from 1), with full jitter.
+        """
+        return self.random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def call(self, request, endpoint="noaa"):
+        """
+        Make a request, retrying it as allowed, and return its result.
+
+        Parameters
+        ----------
+        request : coroutine function
+            Makes one attempt of the request, raising on failure
+
+        endpoint : string, default: "noaa"
+            The name of the endpoint, for metrics
+
+        Raises
+        ------
+        CircuitOpen
+            If the circuit breaker is open
+        """
+        counters = self._counters(endpoint)
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                counters["rejected"].inc()
+                raise CircuitOpen(f"NOAA API circuit open after {self.breaker.consecutive} failures")
+            await self.bucket.acquire()
+
+            try:
+                result = await request()
+            except asyncio.CancelledError:
+                # A cancelled probe must not leave the circuit half open forever
+                self.breaker.probing = False
+                raise
+            except Exception as e:
+                retry, wait = self.classify(e)
+                if not retry:
+                    # The API answered, e.g. 404, so this says nothing about its health
+                    if self.breaker.state == CircuitBreaker.HALF_OPEN:
+                        self.breaker.success()
+                    raise
+
+                if isinstance(e, aiohttp.ClientResponseError) and e.status == 429:
+                    # The API is healthy and asks to slow down, which is the bucket's job
+                    counters["throttled"].inc()
+                    self.bucket.slow_down()
+                    if self.breaker.state == CircuitBreaker.HALF_OPEN:
+                        self.breaker.success()
+                elif self.breaker.failure():
+                    print(f"Pausing NOAA API requests for {self.breaker.reset_timeout}s after repeated failures: {e}")
+                if wait is not None:
+                    self.bucket.pause(wait)
+
+                if attempt >= self.max_retries or not self.budget.withdraw():
+                    raise
+                attempt += 1
+                counters["retries"].inc()
+                await asyncio.sleep(max(wait or 0, self.delay(attempt)))
+                continue
+
+            self.breaker.success()
+            self.bucket.speed_up()
+            return result
@@ -0,0 +1,180 @@
+import re
+import time
+import heapq
+import random
+import asyncio
+
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class RefreshScheduler:
+    """
+    RefreshScheduler decides when each city's forecast should be fetched next. Cities
+    are kept in a priority queue ordered by their next refresh time, which is derived
+    from the freshness the NOAA API advertises for the previous response rather than
+    a fixed interval. Requests themselves are rate limited by the publisher's
+    RequestLimiter, so cities that expire together do not turn into a burst.
+    """
+
+    def __init__(self, min_interval=60, max_interval=3600, update_period=3600,
+                 jitter=0.1, seed=None):
+        """
+        Parameters
+        ----------
+        min_interval : int, default: 60
+            The minimum number of seconds between two fetches of the same city, no
+            matter what the response headers say
+
+        max_interval : int, default: 3600
+            The maximum number of seconds between two fetches of the same city
+
+        update_period : int, default: 3600
+            How often NOAA is expected to regenerate a forecast. When the response
+            has no Cache-Control/Expires headers, the next fetch is scheduled this
+            long after the forecast's updateTime/generatedAt, or after now if that
+            has already passed.
+
+        jitter : float, default: 0.1
+            Each refresh is delayed by a random fraction (up to `jitter`) of its
+            interval, so that cities fetched together drift apart over time
+
+        seed : int, default: None
+            Seed for the jitter, for reproducible schedules
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.update_period = update_period
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.queue = []
+        self.scheduled = dict()
+        self.counter = 0
+        self.wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self.scheduled)
+
+    def add(self, key, due):
+        """
+        Schedule `key` to be refreshed at the epoch timestamp `due`, replacing any
+        refresh that was already scheduled for it.
+        """
+        # The counter breaks ties so that keys themselves are never compared
+        self.scheduled[key] = (due, self.counter)
+        heapq.heappush(self.queue, (due, self.counter, key))
+        self.counter += 1
+        self.wakeup.set()
+
+    def expedite(self, key, due):
+        """
+        Move the refresh of `key` forward to `due`, unless it is already scheduled
+        to happen sooner than that.
+        """
+        scheduled = self.scheduled.get(key, None)
+        if scheduled is not None and scheduled[0] <= due:
+            return
+        self.add(key, due)
+
+    def remove(self, key):
+        """
+        Stop refreshing `key`.
+        """
+        self.scheduled.pop(key, None)
+
+    async def due(self):
+        """
+        Yield keys forever, each one as soon as it is due for a refresh.
+        """
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            delay = self.queue[0][0] - time.time()
+            if delay > 0:
+                # Wake up early if a key is added that is due before the current head
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due, counter, key = heapq.heappop(self.queue)
+
+            # Skip entries that have since been rescheduled or removed
+            if self.scheduled.get(key, None) != (due, counter):
+                continue
+            del self.scheduled[key]
+            yield key
+
+    def next_refresh(self, headers, forecast=None):
+        """
+        Compute when a city should be fetched again from a forecast response.
+
+        Parameters
+        ----------
+        headers : mapping
+            The headers of the forecast response (including a 304 Not Modified)
+
+        forecast : dict, default: None
+            The JSON forecast, if the response had a body
+
+        Returns
+        -------
+        due : float
+            The epoch timestamp of the next refresh
+        """
+        now = time.time()
+        expires = self._expires(headers, now)
+        if expires is None and forecast is not None:
+            expires = self._next_update(forecast, now)
+        if expires is None:
+            expires = now + self.update_period
+
+        interval = min(max(expires - now, self.min_interval), self.max_interval)
+        return now + interval * (1 + self.random.uniform(0, self.jitter))
+
+    def retry_at(self):
+        """
+        Compute when a city whose fetch failed should be tried again.
+        """
+        return time.time() + self.min_interval * (1 + self.random.uniform(0, self.jitter))
+
+    def _expires(self, headers, now):
+        cache_control = headers.get("Cache-Control", "")
+        match = MAX_AGE.search(cache_control)
+        if match is not None:
+            return now + int(match.group(1))
+
+        expires = headers.get("Expires", None)
+        if expires is not None:
+            try:
+                return parsedate_to_datetime(expires).timestamp()
+            except (TypeError, ValueError):
+                pass
+        return None
+
+    def _next_update(self, forecast, now):
+        properties = forecast.get("properties", None) or dict()
+        for field in ("updateTime", "generatedAt"):
+            value = properties.get(field, None)
+            if value is None:
+                continue
+            try:
+                updated = datetime.fromisoformat(value).timestamp()
+            except ValueError:
+                continue
+            expected = updated + self.update_period
+            if expected <= now:
+                # NOAA is late regenerating this forecast (or the API is serving a
+                # stale copy), so wait a full period rather than polling it again
+                # every `min_interval`
+                return now + self.update_period
+            return expected
+        return None
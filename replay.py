@@ -0,0 +1,317 @@
+"""
+Offline replay and backfill of recorded forecasts through the clusterer. The events of
+a local event log topic, or the forecast periods of a JSON lines or JSON array file
+(e.g. from `synthetic_events.py --jsonl`), are run through the decode, features and
+model stages of a WeatherSubscriber as fast as they go: there is no subscription,
+nothing is acked and no results are published. The model is seeded, so a replay of
+the same events with the same parameters always gives the same clusters.
+
+With --compare the streaming clusters are scored against a full-batch k-means of
+every forecast period (standardized with the model's final statistics): the inertia
+of both sets of centers, and the adjusted Rand index of the clusters assigned as the
+events streamed in and of the final centers against the reference clusters.
+
+    python replay.py --log eventlog --compare
+    python replay.py --file synthetic.jsonl --clusters 6 --halflife 0.2 --compare
+
+With --checkpoint the model is restored from and saved to a checkpoint, together with
+the offset of the last event replayed from the log, so a backfilled model can be
+handed to the live subscriber, which resumes right after that offset.
+"""
+
+import json
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+from city_catalog import city_key, iter_json_array
+from event_log import EventLog
+from features import FEATURES, feature_list
+from stage_pipeline import Stage, StagedPipeline
+from weather_subscriber_streamkmeans import ForecastBatch, WeatherSubscriber
+
+
+class Replay:
+    """
+    Replay runs batches of recorded forecasts through the stages of a WeatherSubscriber
+    and tallies the results.
+    """
+
+    def __init__(self, subscriber, keep=False):
+        """
+        Parameters
+        ----------
+        subscriber : WeatherSubscriber
+            The subscriber whose decode, features and model stages are replayed
+
+        keep : bool, default: False
+            Keep the features and the cluster of every forecast period, for `compare`
+        """
+        self.subscriber = subscriber
+        self.keep = keep
+        self.events = 0
+        self.periods = 0
+        self.rejected = 0
+        self.X = []
+        self.labels = []
+
+    def record(self, batch):
+        # Replayed events are done with once the model has learned from them
+        for event in batch.events:
+            self.subscriber.acks.received(event)
+            self.subscriber.acks.acked(event)
+        self.events += len(batch.events)
+        self.periods += len(batch.X)
+        self.rejected += len(batch.rejected)
+        if self.keep and len(batch.X):
+            self.X.append(batch.X)
+            self.labels.append(batch.clusters)
+
+    async def run(self, batches, decoded=False):
+        """
+        Replay ForecastBatches of events, or of already decoded forecast periods if
+        `decoded` is set.
+        """
+        subscriber = self.subscriber
+        stages = [
+            Stage("features", subscriber.extract, concurrency=subscriber.feature_workers),
+            Stage("model", subscriber.learn),
+            Stage("record", self.record),
+        ]
+        if not decoded:
+            stages.insert(0, Stage("decode", subscriber.decode, concurrency=subscriber.decode_workers))
+
+        pipeline = StagedPipeline(stages, queue_size=subscriber.queue_size)
+        pipeline.start()
+        try:
+            for batch in batches:
+                await pipeline.put(batch)
+            await pipeline.close()
+        finally:
+            pipeline.cancel()
+            subscriber.save_model(force=True)
+
+    def features(self):
+        return np.concatenate(self.X) if self.X else np.empty((0, self.subscriber.features.n_features))
+
+    def clusters(self):
+        return np.concatenate(self.labels) if self.labels else np.empty(0, dtype=np.int64)
+
+
+def log_batches(path, topic, batch_size, offset=0):
+    """
+    Yield ForecastBatches of `batch_size` events read from a topic of an event log.
+    """
+    events = []
+    for event in EventLog(path).read(topic, offset):
+        events.append(event)
+        if len(events) == batch_size:
+            yield ForecastBatch(events)
+            events = []
+    if events:
+        yield ForecastBatch(events)
+
+
+def read_periods(path):
+    """
+    Yield the forecast periods of a JSON array file, or of a JSON lines file with one
+    period, or one {"periods": [...]} object, per line.
+    """
+    with open(path, encoding="utf-8") as f:
+        start = f.read(1)
+        while start.isspace():
+            start = f.read(1)
+        f.seek(0)
+        if start == "[":
+            yield from iter_json_array(f)
+            return
+        for line in f:
+            if line.strip():
+                data = json.loads(line)
+                yield from data.get("periods", [data])
+
+
+def file_batches(path, batch_size):
+    """
+    Yield decoded ForecastBatches of `batch_size` forecast periods read from a file.
+    """
+    def batch(records):
+        decoded = ForecastBatch([])
+        decoded.decoded.append((None, records))
+        # Periods recorded without a city (like retired/synthetic_events.json) have no key
+        decoded.keys = [city_key(data) if "city" in data else None for data in records]
+        return decoded
+
+    records = []
+    for data in read_periods(path):
+        records.append(data)
+        if len(records) == batch_size:
+            yield batch(records)
+            records = []
+    if records:
+        yield batch(records)
+
+
+def assign(X, centers, chunk=1 << 18):
+    """
+    Return the closest center of each observation and the squared distance to it,
+    a chunk of observations at a time to bound the memory used.
+    """
+    labels = np.empty(len(X), dtype=np.int64)
+    distances = np.empty(len(X))
+    norms = (centers ** 2).sum(axis=1)
+    for start in range(0, len(X), chunk):
+        rows = X[start:start + chunk]
+        squared = (rows ** 2).sum(axis=1)[:, np.newaxis] - 2 * rows @ centers.T + norms
+        labels[start:start + chunk] = squared.argmin(axis=1)
+        distances[start:start + chunk] = np.maximum(squared.min(axis=1), 0)
+    return labels, distances
+
+
+def kmeans(X, n_clusters, seed=0, iterations=100, restarts=4, tol=1e-6):
+    """
+    Full-batch k-means: Lloyd's algorithm from k-means++ initial centers, keeping the
+    run with the lowest inertia out of `restarts`.
+
+    Returns
+    -------
+    centers, labels, inertia
+    """
+    rng = np.random.default_rng(seed)
+    best = None
+    for _ in range(restarts):
+        # k-means++: each next center is drawn in proportion to the squared distance
+        # to the closest center drawn so far
+        centers = X[[rng.integers(len(X))]]
+        for _ in range(1, n_clusters):
+            _, distances = assign(X, centers)
+            total = distances.sum()
+            index = rng.choice(len(X), p=distances / total) if total > 0 else rng.integers(len(X))
+            centers = np.vstack([centers, X[index]])
+
+        previous = np.inf
+        for _ in range(iterations):
+            labels, distances = assign(X, centers)
+            inertia = distances.sum()
+            counts = np.bincount(labels, minlength=n_clusters)
+            for dimension in range(X.shape[1]):
+                sums = np.bincount(labels, weights=X[:, dimension], minlength=n_clusters)
+                # Empty clusters keep their center
+                centers[:, dimension] = np.where(counts > 0, sums / np.maximum(counts, 1), centers[:, dimension])
+            if previous - inertia <= tol * previous:
+                break
+            previous = inertia
+
+        labels, distances = assign(X, centers)
+        inertia = distances.sum()
+        if best is None or inertia < best[2]:
+            best = (centers, labels, inertia)
+    return best
+
+
+def adjusted_rand_index(a, b):
+    """
+    Return the adjusted Rand index of two clusterings of the same observations: 1 if
+    they group the observations identically (whatever the cluster numbers), around 0
+    if they agree no more than chance.
+    """
+    a = np.unique(a, return_inverse=True)[1]
+    b = np.unique(b, return_inverse=True)[1]
+    columns = b.max() + 1
+    table = np.bincount(a * columns + b, minlength=(a.max() + 1) * columns).reshape(-1, columns)
+
+    def pairs(counts):
+        counts = counts.astype(float)
+        return (counts * (counts - 1) / 2).sum()
+
+    index = pairs(table)
+    rows = pairs(table.sum(axis=1))
+    cols = pairs(table.sum(axis=0))
+    expected = rows * cols / pairs(np.array([len(a)]))
+    maximum = (rows + cols) / 2
+    if maximum == expected:
+        return 1.0
+    return (index - expected) / (maximum - expected)
+
+
+def compare(replay, seed=0, iterations=100, restarts=4):
+    """
+    Score the streaming model of a replay against a full-batch k-means reference.
+    """
+    model = replay.subscriber.model
+    X = model.scaler.transform_many(replay.features())
+    online = replay.clusters()
+
+    _, reference, reference_inertia = kmeans(X, model.n_clusters, seed=seed, iterations=iterations, restarts=restarts)
+    final, distances = assign(X, model.centers)
+    inertia = distances.sum()
+
+    return {
+        "periods": len(X),
+        "streaming_inertia": float(inertia),
+        "reference_inertia": float(reference_inertia),
+        "inertia_ratio": float(inertia / reference_inertia) if reference_inertia else None,
+        "ari_online": adjusted_rand_index(online, reference),
+        "ari_final": adjusted_rand_index(final, reference),
+        "streaming_sizes": np.bincount(final, minlength=model.n_clusters).tolist(),
+        "reference_sizes": np.bincount(reference, minlength=model.n_clusters).tolist(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded forecasts through the clusterer")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--log", help="replay a topic of the event log in this directory")
+    source.add_argument("--file", help="replay the forecast periods of a JSON lines or JSON array file")
+    parser.add_argument("--topic", default="weather-forecasts", help="the topic of the event log to replay")
+    parser.add_argument("--batch-size", type=int, default=1024, help="events (periods from a file) per model update")
+    parser.add_argument("--features", type=feature_list, default=["temperature", "precipitation"],
+                        help=f"comma separated features to cluster on, from {','.join(FEATURES)}")
+    parser.add_argument("--units", choices=["F", "C"], default="F", help="temperature units of the features")
+    parser.add_argument("--clusters", type=int, default=5)
+    parser.add_argument("--halflife", type=float, default=0.5)
+    parser.add_argument("--sigma", type=float, default=1.5)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the model and of the reference k-means")
+    parser.add_argument("--decode-workers", type=int, default=1, help="batches decoded concurrently")
+    parser.add_argument("--feature-workers", type=int, default=1, help="batches whose features are extracted concurrently")
+    parser.add_argument("--checkpoint", default=None, help="restore the model from and save it to this checkpoint")
+    parser.add_argument("--compare", action="store_true", help="score the clusters against full-batch k-means")
+    parser.add_argument("--restarts", type=int, default=4, help="k-means++ restarts of the reference")
+    args = parser.parse_args()
+
+    subscriber = WeatherSubscriber(
+        transport=object(), checkpoint=args.checkpoint, checkpoint_every=float("inf"),
+        features=args.features, units=args.units, n_clusters=args.clusters,
+        halflife=args.halflife, sigma=args.sigma, seed=args.seed,
+        decode_workers=args.decode_workers, feature_workers=args.feature_workers,
+    )
+    replay = Replay(subscriber, keep=args.compare)
+
+    started = time.perf_counter()
+    if args.log:
+        # A restored model resumes right after the last event it learned from
+        offset = 0 if subscriber.offset is None else subscriber.offset + 1
+        asyncio.run(replay.run(log_batches(args.log, args.topic, args.batch_size, offset)))
+    else:
+        asyncio.run(replay.run(file_batches(args.file, args.batch_size), decoded=True))
+    elapsed = time.perf_counter() - started
+
+    source = f"{replay.events:,} events of {args.log}/{args.topic}" if args.log else args.file
+    print(
+        f"replayed {replay.periods:,} forecast periods from {source} in {elapsed:.2f}s "
+        f"({replay.periods / elapsed:,.0f} periods/s), {replay.rejected} invalid events"
+    )
+    if args.checkpoint:
+        print(f"saved the model to {args.checkpoint} at offset {subscriber.offset}")
+
+    if args.compare and replay.periods:
+        started = time.perf_counter()
+        scores = compare(replay, seed=args.seed, restarts=args.restarts)
+        print(f"full-batch k-means of {scores['periods']:,} periods in {time.perf_counter() - started:.2f}s")
+        print(f"inertia: streaming {scores['streaming_inertia']:,.1f}, reference {scores['reference_inertia']:,.1f} "
+              f"({scores['inertia_ratio']:.3f}x)")
+        print(f"adjusted Rand index vs reference: {scores['ari_online']:.3f} as streamed, "
+              f"{scores['ari_final']:.3f} with the final centers")
+        print(f"cluster sizes: streaming {scores['streaming_sizes']}, reference {scores['reference_sizes']}")
@@ -0,0 +1,188 @@
+import zlib
+import multiprocessing as mp
+
+import numpy as np
+
+from streaming_kmeans import RunningScaler, StreamingKMeans
+
+
+def shard_worker(shard, inbox, outbox, n_clusters, n_features, halflife, sigma, seed):
+    """
+    Run a shard's local clusterer until it receives None. Observations arrive already
+    standardized by the coordinator, so every shard clusters in the same space.
+    """
+    model = StreamingKMeans(
+        n_clusters=n_clusters, n_features=n_features, halflife=halflife, sigma=sigma,
+        seed=seed, scale=False,
+    )
+    while True:
+        message = inbox.get()
+        if message is None:
+            return
+
+        command, payload = message
+        if command == "learn":
+            outbox.put((shard, model.learn_predict_many(payload)))
+        elif command == "centers":
+            outbox.put((shard, (model.centers.copy(), model.weights.copy())))
+        elif command == "set":
+            # Adopt the global centers and count weights from zero until the next merge
+            model.centers = payload.copy()
+            model.weights = np.zeros(n_clusters)
+
+
+class ShardedClusterer:
+    """
+    ShardedClusterer spreads the streaming clustering over a pool of processes. Each
+    observation is routed to a shard by the hash of its city, and each shard keeps a
+    local StreamingKMeans. Every `merge_every` observations the coordinator collects
+    the shards' centers and the number of observations each absorbed, merges them into
+    global centers with a weighted k-means over those k * shards weighted points (a
+    coreset of the data), and broadcasts the global centers back to every shard.
+
+    Every shard starts from the same centers and the merge is seeded with the previous
+    global centers, so center i means the same cluster on every shard and across
+    merges, and the labels published downstream stay consistent.
+    """
+
+    def __init__(self, shards=4, n_clusters=5, n_features=2, halflife=0.5, sigma=1.5, seed=0,
+                 merge_every=10000, merge_iterations=10):
+        """
+        Parameters
+        ----------
+        shards : int, default: 4
+            The number of worker processes
+
+        n_clusters, n_features, halflife, sigma, seed
+            See StreamingKMeans
+
+        merge_every : int, default: 10000
+            The number of observations between two merges of the shards' centers
+
+        merge_iterations : int, default: 10
+            The number of weighted Lloyd iterations used to merge the centers
+        """
+        self.shards = shards
+        self.n_clusters = n_clusters
+        self.n_features = n_features
+        self.merge_every = merge_every
+        self.merge_iterations = merge_iterations
+        self.scaler = RunningScaler(n_features)
+        self.centers = np.random.default_rng(seed).normal(0, sigma, size=(n_clusters, n_features))
+        self.weights = np.zeros(n_clusters)
+        self.unmerged = 0
+
+        context = mp.get_context()
+        self.outbox = context.Queue()
+        self.inboxes = []
+        self.workers = []
+        for shard in range(shards):
+            inbox = context.Queue()
+            worker = context.Process(
+                target=shard_worker,
+                args=(shard, inbox, self.outbox, n_clusters, n_features, halflife, sigma, seed),
+                daemon=True,
+            )
+            worker.start()
+            self.inboxes.append(inbox)
+            self.workers.append(worker)
+
+    def shard_of(self, key):
+        return zlib.crc32(str(key).encode("utf-8")) % self.shards
+
+    def learn_predict_many(self, X, keys):
+        """
+        Update the shards with a batch of observations and return the cluster of each.
+
+        Parameters
+        ----------
+        X : array-like of shape (n, n_features)
+            The observations
+
+        keys : sequence of length n
+            The city of each observation, used to choose its shard
+        """
+        X = np.asarray(X, dtype=float).reshape(-1, self.n_features)
+        labels = np.zeros(len(X), dtype=np.int64)
+        if len(X) == 0:
+            return labels
+
+        self.scaler.learn_many(X)
+        scaled = self.scaler.transform_many(X)
+
+        shards = np.array([self.shard_of(key) for key in keys])
+        rows = dict()
+        for shard in np.unique(shards):
+            rows[shard] = np.flatnonzero(shards == shard)
+            self.inboxes[shard].put(("learn", scaled[rows[shard]]))
+
+        for _ in range(len(rows)):
+            shard, shard_labels = self.outbox.get()
+            labels[rows[shard]] = shard_labels
+
+        self.unmerged += len(X)
+        if self.unmerged >= self.merge_every:
+            self.merge()
+        return labels
+
+    def predict_many(self, X):
+        """
+        Return the cluster of each observation according to the global centers.
+        """
+        X = self.scaler.transform_many(np.asarray(X, dtype=float).reshape(-1, self.n_features))
+        distances = ((X[:, np.newaxis, :] - self.centers[np.newaxis, :, :]) ** 2).sum(axis=2)
+        return distances.argmin(axis=1)
+
+    def merge(self):
+        """
+        Merge the shards' centers into global centers and broadcast them back.
+        """
+        self.centers, self.weights = self.merged()
+        self.broadcast()
+        self.unmerged = 0
+
+    def merged(self):
+        """
+        Return the global centers and weights a merge would produce, without changing
+        the model or the shards, e.g. to checkpoint them.
+        """
+        for inbox in self.inboxes:
+            inbox.put(("centers", None))
+
+        points, weights = [], []
+        for _ in self.inboxes:
+            _, (centers, counts) = self.outbox.get()
+            points.append(centers)
+            weights.append(counts)
+        points = np.concatenate(points)
+        weights = np.concatenate(weights)
+
+        centers = self.centers.copy()
+        merged = self.weights.copy()
+        if weights.sum() > 0:
+            for _ in range(self.merge_iterations):
+                distances = ((points[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2).sum(axis=2)
+                labels = distances.argmin(axis=1)
+                totals = np.bincount(labels, weights=weights, minlength=self.n_clusters)
+                for dimension in range(self.n_features):
+                    sums = np.bincount(labels, weights=weights * points[:, dimension], minlength=self.n_clusters)
+                    # Clusters that absorbed nothing keep their previous center
+                    centers[:, dimension] = np.where(totals > 0, sums / np.maximum(totals, 1e-12), centers[:, dimension])
+            merged += np.bincount(labels, weights=weights, minlength=self.n_clusters)
+        return centers, merged
+
+    def broadcast(self):
+        """
+        Send the global centers to every shard, e.g. after restoring a checkpoint.
+        """
+        for inbox in self.inboxes:
+            inbox.put(("set", self.centers))
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
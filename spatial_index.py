@@ -0,0 +1,227 @@
+import math
+import time
+import argparse
+from collections import Counter
+
+import numpy as np
+
+from city_catalog import default_catalog
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat, lon, lats, lons):
+    """
+    Return the great-circle distance in km from (lat, lon) to each of (lats, lons),
+    all in degrees.
+    """
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+class SpatialIndex:
+    """
+    SpatialIndex answers nearest-city, radius and bounding-box queries over the city
+    catalog. Cities are bucketed into a grid of `cell` degree cells, with the cities of
+    each cell stored contiguously in arrays sorted by cell, so a query only computes
+    distances to the cities in the cells its area overlaps.
+
+    Cities are identified by a key, their catalog ID for the city catalog. Queries can
+    be combined with cluster assignments (city -> cluster, e.g. the current
+    cluster of each city) to find the cluster mix of a region or the cluster covering a
+    point.
+    """
+
+    def __init__(self, keys, lats, lons, cell=1.0):
+        """
+        Parameters
+        ----------
+        keys : sequence
+            The key of each city, e.g. its catalog ID
+
+        lats, lons : sequence of float
+            The coordinates of each city, in degrees
+
+        cell : float, default: 1.0
+            The size of the grid cells in degrees
+        """
+        self.cell = cell
+        rows = np.floor((np.asarray(lats, dtype=float) + 90) / cell).astype(np.int64)
+        cols = np.floor((np.asarray(lons, dtype=float) + 180) / cell).astype(np.int64)
+        self.columns = int(math.ceil(360 / cell)) + 1
+        cell_keys = rows * self.columns + cols
+
+        order = np.argsort(cell_keys, kind="stable")
+        self.keys = np.asarray(keys, dtype=object)[order]
+        self.lats = np.asarray(lats, dtype=float)[order]
+        self.lons = np.asarray(lons, dtype=float)[order]
+
+        # cell key -> (first, last + 1) positions of its cities in the sorted arrays
+        cells, starts, counts = np.unique(cell_keys[order], return_index=True, return_counts=True)
+        self.cells = {key: (start, start + count) for key, start, count in zip(cells.tolist(), starts.tolist(), counts.tolist())}
+
+    @classmethod
+    def from_catalog(cls, catalog=None, cell=1.0):
+        """
+        Build the index over the cities of a CityCatalog (default: cities.json), keyed
+        by catalog ID.
+        """
+        catalog = default_catalog() if catalog is None else catalog
+        return cls(catalog.ids(), catalog.lats, catalog.lons, cell=cell)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _candidates(self, south, west, north, east):
+        """
+        Return the positions of the cities in the cells overlapping a bounding box.
+        """
+        first_row = int(math.floor((max(south, -90) + 90) / self.cell))
+        last_row = int(math.floor((min(north, 90) + 90) / self.cell))
+        first_col = int(math.floor((max(west, -180) + 180) / self.cell))
+        last_col = int(math.floor((min(east, 180) + 180) / self.cell))
+
+        ranges = []
+        if (last_row - first_row + 1) * (last_col - first_col + 1) > len(self.cells):
+            # The box covers more cells than there are occupied ones
+            for key, span in self.cells.items():
+                row, col = divmod(key, self.columns)
+                if first_row <= row <= last_row and first_col <= col <= last_col:
+                    ranges.append(span)
+        else:
+            for row in range(first_row, last_row + 1):
+                for col in range(first_col, last_col + 1):
+                    span = self.cells.get(row * self.columns + col, None)
+                    if span is not None:
+                        ranges.append(span)
+
+        if not ranges:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in ranges])
+
+    def bbox(self, south, west, north, east):
+        """
+        Return the keys of the cities inside a bounding box (in degrees).
+        """
+        candidates = self._candidates(south, west, north, east)
+        lats, lons = self.lats[candidates], self.lons[candidates]
+        inside = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+        return self.keys[candidates[inside]].tolist()
+
+    def _within(self, lat, lon, km):
+        dlat = km / KM_PER_DEGREE
+        # Near the poles the circle spans every longitude
+        coslat = math.cos(math.radians(min(abs(lat) + dlat, 90)))
+        dlon = 180 if coslat < 1e-9 else min(km / (KM_PER_DEGREE * coslat), 180)
+
+        candidates = self._candidates(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        distances = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+        inside = distances <= km
+        return candidates[inside], distances[inside]
+
+    def radius(self, lat, lon, km):
+        """
+        Return (key, distance in km) of the cities within `km` of a point, nearest first.
+        """
+        positions, distances = self._within(lat, lon, km)
+        order = np.argsort(distances, kind="stable")
+        return list(zip(self.keys[positions[order]].tolist(), distances[order].tolist()))
+
+    def nearest(self, lat, lon, k=1):
+        """
+        Return (key, distance in km) of the `k` cities nearest to a point, nearest first.
+        """
+        k = min(k, len(self))
+        if k == 0:
+            return []
+
+        # Widen the search until it holds k cities: the k nearest are then all inside it
+        km = self.cell * KM_PER_DEGREE
+        while True:
+            positions, distances = self._within(lat, lon, km)
+            if len(positions) >= k or km > math.pi * EARTH_RADIUS_KM:
+                break
+            km *= 2
+
+        order = np.argsort(distances, kind="stable")[:k]
+        return list(zip(self.keys[positions[order]].tolist(), distances[order].tolist()))
+
+    def cluster_mix(self, assignments, lat=None, lon=None, km=None, bbox=None):
+        """
+        Count the clusters of the cities within `km` of (lat, lon), or inside `bbox`
+        (south, west, north, east), that have an assignment.
+
+        Parameters
+        ----------
+        assignments : dict
+            city -> cluster, e.g. the current cluster of each city
+
+        Returns
+        -------
+        cities : dict
+            city -> cluster of the cities in the region that have an assignment
+
+        mix : Counter
+            cluster -> number of those cities
+        """
+        if bbox is not None:
+            keys = self.bbox(*bbox)
+        else:
+            keys = [key for key, _ in self.radius(lat, lon, km)]
+
+        cities = {key: assignments[key] for key in keys if key in assignments}
+        return cities, Counter(cities.values())
+
+    def cluster_at(self, assignments, lat, lon):
+        """
+        Return the nearest city to a point that has an assignment, its cluster and its
+        distance in km, or None if no city has an assignment.
+        """
+        k = 1
+        while True:
+            nearest = self.nearest(lat, lon, k=k)
+            for key, distance in nearest:
+                if key in assignments:
+                    return key, assignments[key], distance
+            if len(nearest) < k:
+                return None
+            k *= 4
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SpatialIndex queries over a synthetic catalog")
+    parser.add_argument("--cities", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Synthetic cities spread over the contiguous US
+    rng = np.random.default_rng(args.seed)
+    lats = rng.uniform(25, 49, args.cities)
+    lons = rng.uniform(-124, -67, args.cities)
+
+    started = time.perf_counter()
+    index = SpatialIndex(range(1, args.cities + 1), lats, lons)
+    print(f"indexed {args.cities} cities in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    points = list(zip(rng.uniform(25, 49, args.queries), rng.uniform(-124, -67, args.queries)))
+    for name, query in [
+        ("nearest", lambda lat, lon: index.nearest(lat, lon)),
+        ("nearest 10", lambda lat, lon: index.nearest(lat, lon, k=10)),
+        ("radius 100km", lambda lat, lon: index.radius(lat, lon, 100)),
+        ("bbox 2x2 degrees", lambda lat, lon: index.bbox(lat - 1, lon - 1, lat + 1, lon + 1)),
+    ]:
+        latencies = []
+        for lat, lon in points:
+            started = time.perf_counter()
+            query(lat, lon)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        print(
+            f"{name:<18} p50={latencies[len(latencies) // 2] * 1e6:7.1f}us "
+            f"p99={latencies[int(len(latencies) * 0.99)] * 1e6:7.1f}us"
+        )
@@ -0,0 +1,152 @@
+import time
+import asyncio
+import inspect
+
+from metrics import gauge, histogram
+
+
+class Stage:
+    """
+    Stage is one step of a StagedPipeline: a function applied to every item, with at
+    most `concurrency` items in progress at once.
+    """
+
+    def __init__(self, name, fn, concurrency=1):
+        """
+        Parameters
+        ----------
+        name : string
+            The name of the stage, used in error messages
+
+        fn : function or coroutine function
+            Called with each item, returns the item passed on to the next stage or
+            None to drop it. Plain functions run in the default thread pool when
+            `concurrency` is more than 1, so they should release the GIL (e.g. NumPy)
+            to overlap.
+
+        concurrency : int, default: 1
+            The maximum number of items the stage works on at once
+        """
+        self.name = name
+        self.fn = fn
+        self.concurrency = concurrency
+        self.slots = asyncio.Semaphore(concurrency)
+        self.seconds = histogram("stage_seconds", "Time a stage spends on an item", stage=name)
+
+    async def run(self, item):
+        started = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(self.fn):
+                return await self.fn(item)
+            if self.concurrency > 1:
+                return await asyncio.get_running_loop().run_in_executor(None, self.fn, item)
+            return self.fn(item)
+        finally:
+            self.seconds.observe(time.perf_counter() - started)
+            self.slots.release()
+
+
+class StagedPipeline:
+    """
+    StagedPipeline runs items through a sequence of stages connected by bounded
+    queues, so that every stage works at the same time on different items, e.g. one
+    batch is decoded while the previous one updates the model and the one before that
+    is published.
+
+    The queues hold the pending results of each stage in the order the items arrived,
+    so items leave every stage in order even when a stage works on several at once.
+    When a queue is full the stage feeding it waits, so a slow stage holds back every
+    stage before it and eventually `put`, and at most `queue_size` + `concurrency`
+    items are held per stage.
+    """
+
+    END = object()
+
+    def __init__(self, stages, queue_size=8, on_error=None):
+        """
+        Parameters
+        ----------
+        stages : list of Stage
+            The stages in the order items go through them
+
+        queue_size : int, default: 8
+            The maximum number of items waiting between two stages
+
+        on_error : coroutine function, default: None
+            Called with the item, the stage and the exception when a stage raises; the
+            item is dropped either way
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_error = on_error
+        self.queues = []
+        self.tasks = []
+
+    def start(self):
+        """
+        Start a task per stage, plus one that collects the results of the last stage.
+        """
+        self.queues = [asyncio.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        for stage, queue in zip(self.stages, self.queues):
+            gauge("stage_queue_depth", "Items waiting in front of a stage", fn=queue.qsize, stage=stage.name)
+        self.tasks = [
+            asyncio.create_task(self._run(stage, inbox, outbox))
+            for stage, inbox, outbox in zip(self.stages, self.queues, self.queues[1:])
+        ]
+        self.tasks.append(asyncio.create_task(self._collect(self.queues[-1])))
+
+    async def put(self, item):
+        """
+        Add an item to the pipeline, waiting while the first stage is backed up.
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.set_result((item, item))
+        await self.queues[0].put(future)
+
+    async def _run(self, stage, inbox, outbox):
+        while True:
+            pending = await inbox.get()
+            if pending is self.END:
+                await outbox.put(self.END)
+                return
+
+            # Wait for the previous stage to finish this item, in arrival order
+            source, item = await pending
+            if item is None:
+                continue
+
+            await stage.slots.acquire()
+            await outbox.put(asyncio.create_task(self._apply(stage, source, item)))
+
+    async def _apply(self, stage, source, item):
+        try:
+            return source, await stage.run(item)
+        except Exception as e:
+            print(f"The {stage.name} stage failed: {e!r}")
+            if self.on_error is not None:
+                await self.on_error(source, stage, e)
+            return source, None
+
+    async def _collect(self, inbox):
+        while True:
+            pending = await inbox.get()
+            if pending is self.END:
+                return
+            await pending
+
+    def depths(self):
+        """
+        Return the number of items waiting in front of each stage, by stage name.
+        """
+        return {stage.name: queue.qsize() for stage, queue in zip(self.stages, self.queues)}
+
+    async def close(self):
+        """
+        Wait for every item already added to go through the pipeline.
+        """
+        await self.queues[0].put(self.END)
+        await asyncio.gather(*self.tasks)
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
@@ -0,0 +1,207 @@
+import numpy as np
+
+
+class RunningScaler:
+    """
+    RunningScaler standardizes features with a running mean and variance, like river's
+    StandardScaler, but keeps its statistics in arrays and updates them a batch at a
+    time (Chan et al.'s parallel variance update).
+
+    Missing values (NaN, e.g. a forecast without humidity) are imputed with the
+    running mean, or the batch mean before anything has been learned, so they neither
+    poison the statistics nor pull observations towards any cluster: a missing
+    feature is 0 once standardized.
+    """
+
+    def __init__(self, n_features):
+        self.count = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+
+    @property
+    def var(self):
+        if self.count == 0:
+            return np.zeros_like(self.m2)
+        return self.m2 / self.count
+
+    def impute(self, X):
+        """
+        Return X with its missing values replaced by the running mean.
+        """
+        missing = np.isnan(X)
+        if not missing.any():
+            return X
+        fill = self.mean
+        if self.count == 0:
+            rows = np.atleast_2d(X)
+            valid = (~np.isnan(rows)).sum(axis=0)
+            fill = np.nan_to_num(rows).sum(axis=0) / np.maximum(valid, 1)
+        return np.where(missing, fill, X)
+
+    def learn_one(self, x):
+        x = self.impute(x)
+        self.count += 1
+        delta = x - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (x - self.mean)
+
+    def learn_many(self, X):
+        n = len(X)
+        if n == 0:
+            return
+        X = self.impute(X)
+        mean = X.mean(axis=0)
+        m2 = ((X - mean) ** 2).sum(axis=0)
+
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * n / total)
+        self.count = total
+
+    def transform_many(self, X):
+        std = np.sqrt(self.var)
+        # Features that have not varied yet are centered but not scaled
+        std[std == 0] = 1
+        X = (X - self.mean) / std
+        X[np.isnan(X)] = 0
+        return X
+
+
+class StreamingKMeans:
+    """
+    StreamingKMeans is an online k-means clusterer with array-backed centers that
+    replaces the river StandardScaler + STREAMKMeans pipeline.
+
+    Like river's KMeans, every center starts at a random draw from N(0, sigma) and the
+    center closest to an observation moves towards it by `halflife` of the distance.
+    Observations are standardized with running statistics first. Centers exist from
+    construction, so the model can predict from the very first event.
+
+    Batches are assigned to the centers from before the batch in one vectorized step,
+    then each center is moved through its assigned observations in order with the
+    closed form of the sequential update:
+
+        c_n = (1 - h)^n c_0 + sum_i h (1 - h)^(n - i) x_i
+    """
+
+    def __init__(self, n_clusters=5, n_features=2, halflife=0.5, sigma=1.5, seed=0, scale=True):
+        """
+        Parameters
+        ----------
+        n_clusters : int, default: 5
+            The number of clusters
+
+        n_features : int, default: 2
+            The number of features of each observation
+
+        halflife : float, default: 0.5
+            How far (as a fraction of the distance) the closest center moves towards
+            each observation
+
+        sigma : float, default: 1.5
+            The standard deviation of the random initial centers
+
+        seed : int, default: 0
+            Seed for the initial centers
+
+        scale : bool, default: True
+            Standardize observations with running statistics before clustering
+        """
+        self.n_clusters = n_clusters
+        self.n_features = n_features
+        self.halflife = halflife
+        self.sigma = sigma
+        self.seed = seed
+        self.scaler = RunningScaler(n_features) if scale else None
+
+        rng = np.random.default_rng(seed)
+        self.centers = rng.normal(0, sigma, size=(n_clusters, n_features))
+        # The number of observations each center has absorbed
+        self.weights = np.zeros(n_clusters)
+
+    def _scale(self, X):
+        if self.scaler is None:
+            return X
+        return self.scaler.transform_many(X)
+
+    def _assign(self, X):
+        distances = (
+            (X ** 2).sum(axis=1)[:, np.newaxis]
+            - 2 * X @ self.centers.T
+            + (self.centers ** 2).sum(axis=1)[np.newaxis, :]
+        )
+        return distances.argmin(axis=1)
+
+    def _update(self, X, labels):
+        counts = np.bincount(labels, minlength=self.n_clusters)
+        decay = 1 - self.halflife
+
+        # Rank each observation within its cluster, preserving arrival order
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        ranks = np.empty(len(labels), dtype=np.int64)
+        ranks[order] = np.arange(len(labels)) - np.repeat(starts, counts)
+
+        weights = self.halflife * decay ** (counts[labels] - 1 - ranks)
+        pulled = np.zeros_like(self.centers)
+        np.add.at(pulled, labels, X * weights[:, np.newaxis])
+
+        self.centers = self.centers * (decay ** counts)[:, np.newaxis] + pulled
+        self.weights += counts
+
+    def learn_many(self, X):
+        """
+        Update the scaler statistics and centers with a batch of observations.
+
+        Parameters
+        ----------
+        X : array-like of shape (n, n_features)
+        """
+        self.learn_predict_many(X)
+        return self
+
+    def learn_predict_many(self, X):
+        """
+        Update the model with a batch of observations and return the cluster of each
+        one according to the updated centers.
+        """
+        X = np.asarray(X, dtype=float).reshape(-1, self.n_features)
+        if len(X) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        if self.scaler is not None:
+            self.scaler.learn_many(X)
+        X = self._scale(X)
+        self._update(X, self._assign(X))
+        return self._assign(X)
+
+    def predict_many(self, X):
+        """
+        Return the cluster of each observation in a batch without updating the model.
+        """
+        X = np.asarray(X, dtype=float).reshape(-1, self.n_features)
+        return self._assign(self._scale(X))
+
+    def learn_one(self, x):
+        self.learn_predict_one(x)
+        return self
+
+    def learn_predict_one(self, x):
+        """
+        Update the model with a single observation and return its cluster. This is the
+        same update as a batch of one, without the batch bookkeeping.
+        """
+        x = np.asarray(x, dtype=float)
+        if self.scaler is not None:
+            self.scaler.learn_one(x)
+            x = self.scaler.transform_many(x)
+
+        label = int(((self.centers - x) ** 2).sum(axis=1).argmin())
+        # Moving the closest center towards x keeps it the closest center
+        self.centers[label] += self.halflife * (x - self.centers[label])
+        self.weights[label] += 1
+        return label
+
+    def predict_one(self, x):
+        return int(self.predict_many([x])[0])
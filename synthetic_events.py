@@ -0,0 +1,201 @@
+"""
+Seeded synthetic forecast periods for every city of the catalog, in the shape the
+WeatherPublisher publishes, at any volume. Each "sweep" forecasts the next 12 hour
+period of every city. Temperatures follow the latitude, the season and the time of day
+plus a persistent per-city offset and a slowly varying weather anomaly, and humidity,
+dewpoint, precipitation and the summary follow a per-city wet/dry state, so that
+consecutive periods of a city are correlated the way real forecasts are. The same seed
+always generates the same periods.
+
+    python synthetic_events.py --events 1000000 --log eventlog
+    python synthetic_events.py --events 10000 --jsonl synthetic.jsonl
+"""
+
+import json
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from city_catalog import default_catalog
+from event_log import EventLog
+from wire_format import make_event
+
+
+PERIOD = timedelta(hours=12)
+NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+WINDSPEEDS = ["0 mph", "5 mph", "5 to 10 mph", "10 mph", "10 to 15 mph", "15 to 20 mph", "20 to 30 mph"]
+SKIES = ["Sunny", "Mostly Sunny", "Partly Cloudy", "Mostly Cloudy"]
+
+
+class SyntheticForecasts:
+    """
+    SyntheticForecasts generates forecast periods for every city of a catalog, one
+    sweep over the cities at a time.
+    """
+
+    def __init__(self, catalog=None, seed=0, start="2023-10-14T18:00:00+00:00"):
+        """
+        Parameters
+        ----------
+        catalog : CityCatalog, default: None
+            The cities to forecast for, cities.json by default
+
+        seed : int, default: 0
+            Seed of the generator
+
+        start : string or datetime, default: "2023-10-14T18:00:00+00:00"
+            The start of the first period, in UTC
+        """
+        self.catalog = default_catalog() if catalog is None else catalog
+        self.rng = np.random.default_rng(seed)
+        self.start = datetime.fromisoformat(start) if isinstance(start, str) else start
+        self.sweeps = 0
+
+        n = len(self.catalog)
+        self.ids = np.asarray(self.catalog.ids())
+        self.lats = np.asarray(self.catalog.lats)
+        # Local time zones, approximated from the longitude
+        self.offsets = np.round(np.asarray(self.catalog.lons) / 15).astype(int)
+        self.climate = self.rng.normal(0, 5, n)
+        self.anomaly = self.rng.normal(0, 4, n)
+        self.wetness = self.rng.normal(0, 1, n)
+        self.zones = {offset: timezone(timedelta(hours=int(offset))) for offset in np.unique(self.offsets)}
+
+    def sweep(self):
+        """
+        Return the next period of every city as a list of forecast period dicts.
+        """
+        rng = self.rng
+        n = len(self.ids)
+        start = self.start + self.sweeps * PERIOD
+        end = start + PERIOD
+        self.sweeps += 1
+
+        # The weather of each city drifts from one period to the next
+        self.anomaly = 0.8 * self.anomaly + rng.normal(0, 2.5, n)
+        self.wetness = 0.7 * self.wetness + rng.normal(0, 0.7, n)
+
+        local_hours = (start.hour + self.offsets) % 24
+        daytime = (local_hours >= 6) & (local_hours < 18)
+        season = np.cos(2 * np.pi * (start.timetuple().tm_yday - 200) / 365.25)
+        temperature = (
+            95 - 1.2 * np.abs(self.lats) + 15 * season * np.abs(self.lats) / 45
+            + np.where(daytime, 7, -7) + self.climate + self.anomaly
+        )
+        humidity = np.clip(62 + 18 * self.wetness + rng.normal(0, 8, n) - np.where(daytime, 8, -8), 5, 100)
+        # Dewpoint from temperature and humidity, in Celsius
+        celsius = (temperature - 32) * 5 / 9
+        dewpoint = celsius - (100 - humidity) / 5
+        chance = 100 / (1 + np.exp(-2 * (self.wetness - 0.5)))
+        precipitation = np.where(rng.random(n) < 0.25, -1, np.round(chance / 5) * 5)
+        wind = np.clip(np.round(rng.gamma(2, 1.2, n)), 0, len(WINDSPEEDS) - 1).astype(int)
+        sky = np.clip(np.round(1.5 + 1.5 * self.wetness + rng.normal(0, 0.5, n)), 0, len(SKIES) - 1).astype(int)
+
+        # The times of the period are formatted once per time zone
+        times = dict()
+        for offset, zone in self.zones.items():
+            local_start = start.astimezone(zone)
+            times[offset] = (NAMES[local_start.weekday()], local_start.isoformat(), end.astimezone(zone).isoformat())
+
+        periods = []
+        for i in range(n):
+            day, local_start, local_end = times[self.offsets[i]]
+            chance = precipitation[i]
+            if chance >= 60:
+                summary = "Rain"
+            elif chance >= 30:
+                summary = "Chance Rain Showers"
+            else:
+                summary = SKIES[sky[i]]
+            city = int(self.ids[i])
+            periods.append({
+                "city_id": city,
+                "city": self.catalog.name(city),
+                "state": self.catalog.state(city),
+                "name": day if daytime[i] else day + " Night",
+                "summary": summary,
+                "temperature": int(round(temperature[i])),
+                "units": "F",
+                "precipitation": {"unitCode": "wmoUnit:percent", "value": None if chance < 0 else int(chance)},
+                "dewpoint": {"unitCode": "wmoUnit:degC", "value": float(dewpoint[i])},
+                "humidity": {"unitCode": "wmoUnit:percent", "value": int(round(humidity[i]))},
+                "windspeed": WINDSPEEDS[wind[i]],
+                "daytime": bool(daytime[i]),
+                "start": local_start,
+                "end": local_end,
+            })
+        return periods
+
+    def periods(self, count):
+        """
+        Yield `count` forecast periods, sweep after sweep.
+        """
+        while count > 0:
+            sweep = self.sweep()[:count]
+            count -= len(sweep)
+            yield from sweep
+
+    def events(self, count, per_event=1, wire="binary"):
+        """
+        Yield events holding `count` forecast periods in total, `per_event` periods
+        per event, encoded like the WeatherPublisher does.
+        """
+        batch = []
+        for data in self.periods(count):
+            batch.append(data)
+            if len(batch) == per_event:
+                yield make_event(batch, wire=wire)
+                batch = []
+        if batch:
+            yield make_event(batch, wire=wire)
+
+
+async def write_log(path, topic, events, chunk=1000):
+    """
+    Append events to a topic of an EventLog, returning the number written.
+    """
+    log = EventLog(path)
+    written = 0
+    chunk_events = []
+    for event in events:
+        chunk_events.append(event)
+        if len(chunk_events) == chunk:
+            await log.publish(topic, chunk_events, ensure_exists=True)
+            written += len(chunk_events)
+            chunk_events = []
+    if chunk_events:
+        await log.publish(topic, chunk_events, ensure_exists=True)
+        written += len(chunk_events)
+    log.close()
+    return written
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Generate synthetic forecast periods for every city")
+    parser.add_argument("--events", type=int, default=100000, help="number of forecast periods")
+    parser.add_argument("--per-event", type=int, default=1, help="forecast periods per event")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--wire", choices=["binary", "json"], default="binary")
+    parser.add_argument("--log", default=None, help="append the events to this EventLog directory")
+    parser.add_argument("--topic", default="weather-forecasts")
+    parser.add_argument("--jsonl", default=None, help="write the forecast periods to this JSON lines file")
+    args = parser.parse_args()
+
+    generator = SyntheticForecasts(seed=args.seed)
+    started = time.perf_counter()
+    if args.jsonl:
+        with open(args.jsonl, "w") as f:
+            for data in generator.periods(args.events):
+                f.write(json.dumps(data) + "\n")
+    elif args.log:
+        events = asyncio.run(write_log(args.log, args.topic, generator.events(args.events, args.per_event, args.wire)))
+        print(f"appended {events} events to {args.log}/{args.topic}")
+    else:
+        for _ in generator.periods(args.events):
+            pass
+    elapsed = time.perf_counter() - started
+    print(f"generated {args.events} forecast periods in {elapsed:.2f}s ({args.events / elapsed:,.0f}/s)")
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from checkpoint import load_checkpoint, save_checkpoint
+from features import FeatureExtractor
+from streaming_kmeans import StreamingKMeans
+
+
+def test_checkpoint_is_only_restored_with_the_same_features(tmp_path):
+    path = str(tmp_path / "model.ckpt")
+    features = FeatureExtractor(("temperature", "humidity"), units="F")
+    model = StreamingKMeans(n_features=2)
+    model.learn_many(np.random.default_rng(0).normal(size=(50, 2)))
+    save_checkpoint(path, model, offset=7, features=features)
+
+    restored = StreamingKMeans(n_features=2, seed=1)
+    assert load_checkpoint(path, restored, features) == 7
+    assert np.array_equal(restored.centers, model.centers)
+    assert restored.scaler.count == 50
+
+    for other in (FeatureExtractor(("temperature", "dewpoint")), FeatureExtractor(("temperature", "humidity"), units="C")):
+        with pytest.raises(ValueError):
+            load_checkpoint(path, StreamingKMeans(n_features=2), other)
@@ -0,0 +1,39 @@
+import io
+import json
+
+import pytest
+
+from city_catalog import CityCatalog, iter_json_array
+
+
+def test_streaming_parser_matches_json_load_across_chunks():
+    cities = [
+        {"city": "Springfield", "state": "Illinois", "latitude": 39.78, "longitude": -89.65, "note": "[, \"]"},
+        {"city": "Springfield", "state": "Missouri", "latitude": 37.21, "longitude": -93.29},
+        {"city": "Chicago", "state": "Illinois", "latitude": 41.88, "longitude": -87.63, "growth": [1.5, -0.2]},
+    ]
+    text = "  \n" + json.dumps(cities, indent=2)
+    # Chunks smaller than an element, and numbers split across chunks
+    for chunk_size in (1, 7, 64, 1 << 16):
+        assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == cities
+    assert list(iter_json_array(io.StringIO("[]"))) == []
+
+    for invalid in ('{"city": "Chicago"}', '[{"city": "Chicago"}', "[1, 2"):
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.StringIO(invalid), chunk_size=4))
+
+
+def test_catalog_keys_cities_by_name_and_state(tmp_path):
+    path = tmp_path / "cities.json"
+    path.write_text(json.dumps([
+        {"city": "Springfield", "state": "Illinois", "latitude": 39.78, "longitude": -89.65},
+        {"city": "Springfield", "state": "Missouri", "latitude": 37.21, "longitude": -93.29},
+        {"city": "Chicago", "state": "Illinois", "latitude": 41.88, "longitude": -87.63},
+        {"city": "Chicago", "state": "Illinois", "latitude": 0, "longitude": 0},
+    ]))
+    catalog = CityCatalog.load(str(path))
+    assert len(catalog) == 3
+    assert catalog.id_of("Springfield") is None
+    assert catalog.resolve("Springfield, Missouri") == 2
+    assert catalog.resolve("Chicago") == catalog.resolve("3") == 3
+    assert catalog[3].lat == 41.88 and 0 not in catalog
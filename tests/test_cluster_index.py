@@ -0,0 +1,31 @@
+import json
+from datetime import datetime
+
+from cluster_index import ClusterIndex
+
+
+END = "2099-01-01T06:00:00+00:00"
+
+
+def test_cities_with_and_without_ids_expire_together():
+    index = ClusterIndex(path=None)
+    index.add({"city_id": 7, "city": "Chicago", "start": "2099-01-01T00:00:00+00:00", "end": END})
+    index.add({"city": "Springfield", "state": "Illinois", "start": "2099-01-01T00:00:00+00:00", "end": END})
+    assert len(index) == 2
+
+    index.evict(now=datetime.fromisoformat(END).timestamp() + 1)
+    assert len(index) == 0
+
+
+def test_load_skips_results_with_an_invalid_end(tmp_path):
+    path = str(tmp_path / "index")
+    index = ClusterIndex(path=path, flush_every=2)
+    index.add({"city_id": 1, "start": "2099-01-01T00:00:00+00:00", "end": END, "cluster": 0})
+    index.close()
+    with open(path + ".jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps({"city_id": 2, "start": "2099-01-01T00:00:00+00:00", "end": "tomorrow"}) + "\n")
+        f.write(json.dumps({"city_id": 3, "start": "2099-01-01T00:00:00+00:00", "end": END}) + "\n")
+
+    restored = ClusterIndex(path=path)
+    assert sorted(restored.cities) == [1, 3]
+    restored.close()
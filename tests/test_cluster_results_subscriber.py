@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+from city_cluster_results_subscriber import ClusterSubscriber
+
+
+class FakeEvent:
+    """
+    A JSON cluster results event that records whether it was acked.
+    """
+
+    mimetype = "application/json"
+    type = None
+
+    def __init__(self, records):
+        self.data = json.dumps({"periods": records}).encode("utf-8")
+        self.acked = False
+        self.nacked = False
+
+    async def ack(self):
+        self.acked = True
+
+    async def nack(self, code):
+        self.nacked = True
+
+
+def test_malformed_records_are_skipped_and_the_event_acked(tmp_path):
+    subscriber = ClusterSubscriber(transport=object(), results=None, store=str(tmp_path / "store"), print_every=0)
+    invalid = subscriber.invalid.value
+    event = FakeEvent([
+        {"city": "Chicago", "state": "Illinois", "start": "2023-10-17T15:00:00-05:00",
+         "end": "2023-10-17T16:00:00-05:00", "temperature": 58, "units": "F", "cluster": 2},
+        {"city": "Denver", "state": "Colorado", "start": "not a date", "cluster": 1},
+        {"cluster": 1},
+    ])
+
+    asyncio.run(subscriber.handle_event(event))
+    assert event.acked and not event.nacked
+    assert subscriber.invalid.value - invalid == 2
+    assert len(subscriber.store.history("Chicago, Illinois", "2023-10-17T00:00:00+00:00", "2023-10-18T00:00:00+00:00")) == 1
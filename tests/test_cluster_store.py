@@ -0,0 +1,50 @@
+import json
+
+from cluster_store import DAY, ClusterStore
+
+
+def result(city, day, hour, cluster, temperature=None):
+    start = day * DAY + hour * 3600
+    return {
+        "city": city, "state": "Illinois", "cluster": cluster, "temperature": temperature, "units": "F",
+        "start": start, "end": start + 3600,
+    }
+
+
+def test_history_members_and_aggregate(tmp_path):
+    store = ClusterStore(str(tmp_path), capacity=2)
+    day = 19647
+    for hour in range(4):
+        store.append(result("Chicago", day, hour, hour % 2, 50 + hour), recorded=1)
+        store.append(result("Springfield", day, hour, 1), recorded=1)
+    # A later result for the same period wins
+    store.append(result("Chicago", day, 0, 1, 50), recorded=2)
+
+    history = store.history("Chicago, Illinois", day * DAY, (day + 1) * DAY)
+    assert [row["cluster"] for row in history] == [0, 1, 1, 0, 1]
+    assert history[0]["temperature"] == 50.0 and history[0]["humidity"] is None
+
+    assert store.members(1, day * DAY + 1800) == ["Chicago, Illinois", "Springfield, Illinois"]
+    assert store.members(0, day * DAY + 2 * 3600 + 1800) == ["Chicago, Illinois"]
+
+    groups = store.aggregate(day * DAY, (day + 1) * DAY, by="cluster")
+    assert groups[0]["count"] == 2 and groups[0]["temperature"] == 51.0
+    # Springfield never has a temperature, and no row has a humidity
+    assert store.aggregate(day * DAY, (day + 1) * DAY, by="city")["Springfield, Illinois"]["temperature"] is None
+    assert groups[1]["humidity"] is None
+    json.dumps(groups, allow_nan=False)
+
+
+def test_open_partitions_are_bounded_and_persisted(tmp_path):
+    store = ClusterStore(str(tmp_path), max_open=2)
+    days = range(19640, 19645)
+    for day in days:
+        store.append(result("Chicago", day, 12, day % 3), recorded=1)
+    assert len(store.partitions) == 2
+
+    assert [row["cluster"] for row in store.history("Chicago", days[0] * DAY, (days[-1] + 1) * DAY)] == [day % 3 for day in days]
+    assert len(store.partitions) == 2
+    store.close()
+
+    reopened = ClusterStore(str(tmp_path))
+    assert len(reopened.history("Chicago, Illinois", days[0] * DAY, (days[-1] + 1) * DAY)) == len(days)
@@ -0,0 +1,49 @@
+import numpy as np
+
+from city_catalog import CityCatalog
+from cluster_windows import ClusterMembership, ClusterWindows
+
+
+def test_quiet_cities_keep_their_cluster_until_their_periods_end():
+    windows = ClusterWindows(3600, n_clusters=2, features=["temperature"], catalog=CityCatalog(), clock=lambda: 0)
+    membership = ClusterMembership()
+
+    def window(index, keys, clusters, ends):
+        now = index * 3600 + 10
+        windows.add(keys, np.array([[60.0]] * len(keys)), clusters, ends=np.array(ends, dtype=float), now=now)
+        summary, _ = windows.close(now=now, final=True)
+        membership.apply(summary)
+        return summary
+
+    # Chicago's forecast runs for a day, Denver's periods end with the second hour
+    window(0, ["Chicago, Illinois", "Denver, Colorado"], [0, 1], [86400, 7200])
+
+    summary = window(1, ["Denver, Colorado"], [0], [7200])
+    assert summary["left"] == [] and summary["cities"] == 2
+    assert membership.members == {"Chicago, Illinois": 0, "Denver, Colorado": 0}
+
+    summary = window(2, ["Chicago, Illinois"], [1], [86400])
+    assert summary["left"] == ["Denver, Colorado"]
+    assert membership.members == {"Chicago, Illinois": 1}
+
+    # Without end times a city leaves as soon as it has no forecasts in a window
+    summary = window(3, ["Houston, Texas"], [0], [np.nan])
+    assert summary["left"] == [] and summary["cities"] == 2
+    summary = window(4, ["Chicago, Illinois"], [1], [86400])
+    assert summary["left"] == ["Houston, Texas"]
+
+
+def test_empty_window_announces_the_cities_that_left():
+    windows = ClusterWindows(3600, n_clusters=2, features=["temperature"], catalog=CityCatalog(), clock=lambda: 0)
+    membership = ClusterMembership()
+    windows.add(["Denver, Colorado"], np.array([[60.0]]), [1], ends=np.array([9000.0]), now=10)
+    membership.apply(windows.close(now=10, final=True)[0])
+
+    # Nothing arrives in the next window, which still ends before Denver's period
+    assert windows.close(now=3610, final=True) == (None, [])
+
+    summary, _ = windows.close(now=7210, final=True)
+    assert summary["periods"] == 0 and summary["left"] == ["Denver, Colorado"]
+    membership.apply(summary)
+    assert membership.members == {}
+    assert windows.close(now=10810, final=True) == (None, [])
@@ -0,0 +1,45 @@
+import asyncio
+from datetime import datetime, timezone
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from cluster_index import ClusterIndex
+from dashboard_server import MAX_NEAREST, DashboardServer
+from spatial_index import SpatialIndex
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+def test_current_period_moves_on_when_the_next_one_starts(monkeypatch):
+    now = 4_000_000_000
+    monkeypatch.setattr("dashboard_server.time.time", lambda: now)
+    index = ClusterIndex(path=None)
+    index.add({"city_id": 3, "city": "Chicago", "start": iso(now - 60), "end": iso(now + 60), "cluster": 0})
+    index.add({"city_id": 3, "city": "Chicago", "start": iso(now + 60), "end": iso(now + 120), "cluster": 1})
+    dashboard = DashboardServer(index)
+
+    version = dashboard.current_version()
+    assert dashboard.current()[3]["cluster"] == 0
+
+    # The index has not changed, but the second period has started
+    now += 61
+    assert dashboard.current()[3]["cluster"] == 1
+    assert dashboard.current_version() != version
+
+
+def test_nearest_rejects_invalid_k_and_caps_it():
+    async def main():
+        dashboard = DashboardServer(ClusterIndex(path=None), spatial=SpatialIndex.from_catalog())
+        async with TestClient(TestServer(dashboard.app())) as client:
+            statuses = []
+            for k in ("0", "-3", "1.5", "x"):
+                response = await client.get(f"/nearest?lat=41.9&lon=-87.6&k={k}")
+                statuses.append(response.status)
+            response = await client.get("/nearest?lat=41.9&lon=-87.6&k=100000")
+            return statuses, await response.json()
+
+    statuses, nearest = asyncio.run(main())
+    assert statuses == [400, 400, 400, 400]
+    assert len(nearest) == MAX_NEAREST
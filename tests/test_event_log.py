@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+from pyensign.events import Event
+
+from event_log import EventLog
+
+
+def make_events(*payloads):
+    return [
+        Event(payload, mimetype="application/json", schema_name="Forecast", schema_version="1.2.0", meta={"n": str(i)})
+        for i, payload in enumerate(payloads)
+    ]
+
+
+def test_events_round_trip_and_resume_from_the_committed_offset(tmp_path):
+    async def main():
+        log = EventLog(str(tmp_path), segment_size=4096, commit_every=1)
+        await log.ensure_topic_exists("forecasts")
+        # Enough events to roll over into several segments
+        await log.publish("forecasts", make_events(*(b"x" * 100 + bytes([i]) for i in range(100))))
+
+        received = []
+        async for event in log.subscribe("forecasts"):
+            received.append(event)
+            if event.offset < 60:
+                await event.ack()
+            if len(received) == 100:
+                break
+        log.close()
+
+        resumed = EventLog(str(tmp_path))
+        async for event in resumed.subscribe("forecasts"):
+            first = event
+            break
+        resumed.close()
+        return received, first
+
+    received, first = asyncio.run(main())
+    assert [event.offset for event in received] == list(range(100))
+    assert [event.data[-1] for event in received] == list(range(100))
+    event = received[7]
+    assert event.type.name == "Forecast" and event.type.semver() == "1.2.0"
+    assert event.meta == {"n": "7"}
+    assert len(os.listdir(tmp_path / "forecasts")) > 2
+    assert first.offset == 60
+
+
+def test_torn_tail_record_is_truncated_when_the_log_is_reopened(tmp_path):
+    async def main():
+        log = EventLog(str(tmp_path))
+        await log.publish("forecasts", make_events(b"first", b"second", b"third"))
+        log.close()
+
+        # A crash left the length of the last record on disk but not all of its data
+        path = os.path.join(tmp_path, "forecasts", os.listdir(tmp_path / "forecasts")[0])
+        with open(path, "r+b") as f:
+            contents = f.read()
+            f.seek(contents.index(b"third"))
+            f.write(b"thi\0\0")
+
+        reopened = EventLog(str(tmp_path))
+        await reopened.publish("forecasts", make_events(b"fourth"))
+        events = [(event.offset, event.data) for event in reopened.read("forecasts")]
+        reopened.close()
+        return events
+
+    assert asyncio.run(main()) == [(0, b"first"), (1, b"second"), (2, b"fourth")]
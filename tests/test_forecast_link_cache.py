@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+from forecast_link_cache import ForecastLinkCache
+from weather_publisher import WeatherPublisher
+
+POINTS = {"forecast": "https://api.weather.gov/gridpoints/LOT/76,73/forecast", "gridId": "LOT", "gridX": 76, "gridY": 73}
+
+
+def test_links_persist_and_expire(tmp_path):
+    path = str(tmp_path / "links.json")
+    links = ForecastLinkCache(path)
+    links.put("Chicago, Illinois", POINTS)
+    links.save()
+    assert not links.dirty
+
+    restored = ForecastLinkCache(path, ttl=60)
+    assert restored.get("Chicago, Illinois")["gridId"] == "LOT"
+    restored.entries["Chicago, Illinois"]["fetched"] = time.time() - 61
+    assert restored.get("Chicago, Illinois") is None
+
+    restored.invalidate("Chicago, Illinois")
+    restored.save()
+    assert ForecastLinkCache(path).entries == {}
+
+    # A corrupt cache starts empty rather than failing the publisher
+    with open(path, "w") as f:
+        f.write("{")
+    assert ForecastLinkCache(path).entries == {}
+
+
+def test_cached_link_skips_the_points_lookup():
+    publisher = WeatherPublisher(transport=object(), link_cache=None, state=None)
+    location = publisher.catalog[3]
+    publisher.links.put(location.label, POINTS)
+    # No session: a /points request would fail
+    link = asyncio.run(publisher.resolve_forecast_link(None, location, asyncio.Semaphore(1)))
+    assert link == POINTS["forecast"]
@@ -0,0 +1,72 @@
+import asyncio
+
+from forecast_state import ForecastState
+from weather_publisher import ForecastCommit, WeatherPublisher
+
+URL = "https://api.weather.gov/gridpoints/LOT/76,73/forecast"
+HEADERS = {"ETag": '"abc"'}
+PERIOD = {"start": "2023-10-17T15:00:00-05:00", "temperature": 58}
+
+
+def test_changed_does_not_record():
+    state = ForecastState(path=None)
+    assert state.changed("Chicago, Illinois", PERIOD)
+    assert state.changed("Chicago, Illinois", PERIOD)
+    state.record("Chicago, Illinois", PERIOD)
+    assert not state.changed("Chicago, Illinois", PERIOD)
+
+
+def test_forecast_is_recorded_only_once_committed():
+    async def main(outcome):
+        state = ForecastState(path=None)
+        commit = ForecastCommit(state, URL, HEADERS)
+        on_commit = commit.track("Chicago, Illinois", [PERIOD])
+        commit.seal()
+        assert not state.validators
+        await on_commit(outcome)
+        return state
+
+    state = asyncio.run(main(False))
+    assert not state.validators and state.changed("Chicago, Illinois", PERIOD)
+
+    state = asyncio.run(main(True))
+    assert state.conditional_headers(URL) == {"If-None-Match": '"abc"'}
+    assert not state.changed("Chicago, Illinois", PERIOD)
+
+
+def test_hash_only_covers_the_forecast():
+    state = ForecastState(path=None)
+    state.record("Chicago, Illinois", dict(PERIOD, city_id=3, city="Chicago", state="Illinois"))
+    # The catalog was renumbered, the forecast is the same
+    assert not state.changed("Chicago, Illinois", dict(PERIOD, city_id=4, city="Chicago", state="Illinois"))
+    assert state.changed("Chicago, Illinois", dict(PERIOD, city_id=4, temperature=60))
+
+
+class FailingPipeline:
+    """
+    Commits the events of the first city and fails to publish the next.
+    """
+
+    async def publish(self, event, on_commit=None):
+        if getattr(self, "published", False):
+            raise ConnectionError("stream closed")
+        self.published = True
+        await on_commit(True)
+
+
+def test_failed_cell_is_sealed_and_fetched_unconditionally():
+    forecast = {"properties": {"periods": [{"startTime": PERIOD["start"], "temperature": 58}]}}
+
+    async def main():
+        publisher = WeatherPublisher(transport=object(), link_cache=None, state=None)
+        publisher.pipeline = FailingPipeline()
+        publisher.join_cell(1, URL)
+        publisher.join_cell(2, URL)
+        publisher.state.validators.clear()
+        await publisher.publish_cell(forecast, URL, HEADERS)
+        return publisher
+
+    publisher = asyncio.run(main())
+    first, second = publisher.catalog.label(1), publisher.catalog.label(2)
+    assert not publisher.state.validators
+    assert first in publisher.state.hashes and second not in publisher.state.hashes
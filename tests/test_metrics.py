@@ -0,0 +1,92 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+
+from metrics import Histogram, MetricsExporter, Registry, Sampler, published_at
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram(buckets=(0.1, 1.0, 10.0))
+    assert histogram.quantile(0.5) is None
+
+    # A value on a bound falls in that bound's bucket
+    for value in (0.05, 0.1, 0.5, 0.5, 5.0, 20.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 2, 1, 1]
+    assert histogram.count == 6 and histogram.sum == pytest.approx(26.15)
+    assert histogram.quantile(0.3) == 0.1
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(0.8) == 10.0
+    assert histogram.quantile(0.99) is None
+
+
+def test_registry_reuses_metrics_and_renders_prometheus_text():
+    registry = Registry()
+    registry.counter("events_total", "Events handled", stage="decode").inc(3)
+    registry.counter("events_total", stage="decode").inc()
+    registry.counter("events_total", stage="model").inc()
+    depth = [7]
+    registry.gauge("queue_depth", "Queued events", fn=lambda: depth[0])
+    registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0)).observe(0.5)
+
+    with pytest.raises(ValueError):
+        registry.gauge("events_total")
+
+    depth[0] = 2
+    lines = registry.render().splitlines()
+    assert "# TYPE events_total counter" in lines
+    assert 'events_total{stage="decode"} 4' in lines
+    assert 'events_total{stage="model"} 1' in lines
+    assert "queue_depth 2" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 0' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 1' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in lines
+    assert "latency_seconds_count 1" in lines
+
+    snapshot = registry.snapshot()
+    assert snapshot['events_total{stage="decode"}'] == 4
+    assert snapshot["latency_seconds"] == {"count": 1, "mean": 0.5, "p50": 1.0, "p99": 1.0}
+
+
+def test_exporter_serves_metrics_and_writes_stats(tmp_path):
+    registry = Registry()
+    registry.counter("published_total", "Events published").inc(5)
+    stats = tmp_path / "stats.json"
+
+    async def main():
+        exporter = MetricsExporter(registry, port=0, stats=str(stats), interval=3600)
+        await exporter.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{exporter.port}/metrics") as resp:
+                    return await resp.text()
+        finally:
+            await exporter.stop()
+
+    assert "published_total 5" in asyncio.run(main()).splitlines()
+    # The stats file is written on stop
+    assert json.loads(stats.read_text())["metrics"] == {"published_total": 5}
+
+
+def test_sampler_prints_the_first_event_then_every_nth():
+    sampler = Sampler(every=3)
+    assert [sampler() for _ in range(7)] == [True, False, False, True, False, False, True]
+    assert not any(Sampler(every=0)() for _ in range(5))
+
+
+def test_published_at_ignores_the_ensign_method():
+    local = SimpleNamespace(published=1697500000.5)
+    assert published_at(local) == 1697500000.5
+
+    class EnsignEvent:
+        committed = SimpleNamespace(seconds=0, nanos=0)
+        created = SimpleNamespace(seconds=1697500000, nanos=250000000)
+
+        def published(self):
+            return True
+
+    assert published_at(EnsignEvent()) == pytest.approx(1697500000.25)
+    assert published_at(SimpleNamespace()) is None
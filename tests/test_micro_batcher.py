@@ -0,0 +1,30 @@
+import asyncio
+
+from micro_batcher import MicroBatcher
+
+
+def test_batches_flush_when_full_or_after_the_timeout():
+    async def main():
+        batches = []
+
+        async def handle_batch(items):
+            batches.append(items)
+
+        batcher = MicroBatcher(handle_batch, size=3, timeout=0.05)
+        for item in range(7):
+            await batcher.add(item)
+        # Two full batches are handled right away, the last item waits for the timeout
+        full = list(batches)
+        await asyncio.sleep(0.1)
+        timed_out = list(batches)
+
+        await batcher.add(7)
+        await batcher.flush()
+        await batcher.flush()
+        return full, timed_out, batches, batcher
+
+    full, timed_out, batches, batcher = asyncio.run(main())
+    assert full == [[0, 1, 2], [3, 4, 5]]
+    assert timed_out == [[0, 1, 2], [3, 4, 5], [6]]
+    assert batches == [[0, 1, 2], [3, 4, 5], [6], [7]]
+    assert batcher.timer is None
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from publish_pipeline import PublishPipeline
+
+
+class FakeTransport:
+    """
+    Accepts every event and acks it on a later turn of the event loop like Ensign, or
+    holds the acks back until `deliver` if `hold` is set.
+    """
+
+    def __init__(self, hold=False):
+        self.hold = hold
+        self.fail = False
+        self.sends = []
+        self.held = []
+
+    async def publish(self, topic, *events, on_ack=None, on_nack=None):
+        if self.fail:
+            raise ConnectionError("stream closed")
+        self.sends.append(len(events))
+        for _ in events:
+            if self.hold:
+                self.held.append(on_ack)
+            else:
+                asyncio.get_running_loop().call_soon(asyncio.ensure_future, on_ack(None))
+
+    async def deliver(self):
+        held, self.held = self.held, []
+        for on_ack in held:
+            await on_ack(None)
+
+
+def test_publish_more_events_than_the_window():
+    async def main():
+        transport = FakeTransport()
+        pipeline = PublishPipeline(transport, "test-publish-window", window=256)
+        committed = []
+
+        async def on_commit(ok):
+            committed.append(ok)
+
+        await asyncio.wait_for(pipeline.publish(list(range(300)), on_commit=on_commit), timeout=5)
+        await pipeline.drain()
+        return transport, pipeline, committed
+
+    transport, pipeline, committed = asyncio.run(main())
+    assert transport.sends == [256, 44]
+    assert committed == [True] * 300
+    assert pipeline.acked == 300 and not pipeline.pending
+
+
+def test_failed_send_only_fails_its_own_events():
+    async def main():
+        transport = FakeTransport(hold=True)
+        pipeline = PublishPipeline(transport, "test-publish-failure", window=8)
+        committed = []
+
+        async def on_commit(ok, name):
+            committed.append((name, ok))
+
+        await pipeline.publish([1, 2], on_commit=lambda ok: on_commit(ok, "first"))
+        transport.fail = True
+        with pytest.raises(ConnectionError):
+            await pipeline.publish([3], on_commit=lambda ok: on_commit(ok, "second"))
+        await transport.deliver()
+        await pipeline.drain()
+        return pipeline, committed
+
+    pipeline, committed = asyncio.run(main())
+    assert committed == [("second", False), ("first", True), ("first", True)]
+    assert pipeline.slots._value == 8
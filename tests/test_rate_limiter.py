@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import aiohttp
+
+from rate_limiter import CircuitBreaker, RequestLimiter, TokenBucket
+
+
+def test_pause_delays_requests_already_waiting():
+    async def main():
+        bucket = TokenBucket(20)
+        started = time.monotonic()
+        starts = []
+
+        async def request():
+            await bucket.acquire()
+            starts.append(time.monotonic() - started)
+
+        tasks = [asyncio.create_task(request()) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        bucket.pause(0.3)
+        await asyncio.gather(*tasks)
+        return starts
+
+    starts = asyncio.run(main())
+    assert starts[0] < 0.05
+    assert all(start >= 0.3 for start in starts[1:])
+
+
+def test_throttling_does_not_open_the_circuit():
+    async def main():
+        limiter = RequestLimiter(rate=1000, max_retries=0, failures=3, seed=0)
+
+        async def throttled():
+            raise aiohttp.ClientResponseError(None, (), status=429, message="Too Many Requests")
+
+        for _ in range(10):
+            try:
+                await limiter.call(throttled)
+            except aiohttp.ClientResponseError:
+                pass
+        return limiter
+
+    limiter = asyncio.run(main())
+    assert limiter.breaker.state == CircuitBreaker.CLOSED
+    assert limiter.bucket.rate < limiter.bucket.max_rate
@@ -0,0 +1,46 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from refresh_scheduler import RefreshScheduler
+
+
+def forecast(updated):
+    return {"properties": {"updateTime": datetime.fromtimestamp(updated, tz=timezone.utc).isoformat()}}
+
+
+def test_next_refresh_follows_the_response_freshness():
+    scheduler = RefreshScheduler(min_interval=60, max_interval=3600, update_period=3600, jitter=0)
+    now = time.time()
+
+    assert abs(scheduler.next_refresh({"Cache-Control": "public, max-age=600"}) - (now + 600)) < 5
+    # Bounded by the minimum and maximum intervals
+    assert abs(scheduler.next_refresh({"Cache-Control": "max-age=5"}) - (now + 60)) < 5
+    assert abs(scheduler.next_refresh({"Cache-Control": "max-age=86400"}) - (now + 3600)) < 5
+
+    # Without headers, an update period after the forecast was generated
+    assert abs(scheduler.next_refresh({}, forecast(now - 3000)) - (now + 600)) < 5
+    # A forecast that should have been regenerated already is not polled every minute
+    assert abs(scheduler.next_refresh({}, forecast(now - 7 * 3600)) - (now + 3600)) < 5
+
+
+def test_due_yields_keys_in_order_and_skips_rescheduled_ones():
+    async def main():
+        scheduler = RefreshScheduler(seed=0)
+        now = time.time()
+        # Catalog IDs and names are never compared, even when due at the same time
+        scheduler.add(2, now - 1)
+        scheduler.add("Springfield, Illinois", now - 1)
+        scheduler.add(1, now - 2)
+        scheduler.add(3, now - 3)
+        scheduler.add(3, now + 60)
+        scheduler.remove(2)
+        scheduler.expedite(3, now - 0.5)
+
+        keys = []
+        async for key in scheduler.due():
+            keys.append(key)
+            if len(keys) == 3:
+                return keys
+
+    assert asyncio.run(asyncio.wait_for(main(), timeout=5)) == [1, "Springfield, Illinois", 3]
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from replay import Replay, adjusted_rand_index, compare, file_batches, kmeans, log_batches
+from synthetic_events import SyntheticForecasts, write_log
+from weather_subscriber_streamkmeans import WeatherSubscriber
+
+
+def subscriber(checkpoint=None):
+    return WeatherSubscriber(
+        transport=object(), checkpoint=checkpoint, checkpoint_every=float("inf"),
+        n_clusters=3, seed=0, print_every=0,
+    )
+
+
+def test_adjusted_rand_index():
+    labels = np.array([0, 0, 1, 1, 2, 2])
+    assert adjusted_rand_index(labels, labels) == pytest.approx(1.0)
+    # Cluster numbers do not matter, only the grouping
+    assert adjusted_rand_index(labels, np.array([5, 5, 3, 3, 4, 4])) == pytest.approx(1.0)
+    assert adjusted_rand_index(labels, np.array([0, 1, 2, 0, 1, 2])) < 0
+    assert adjusted_rand_index(np.zeros(4, dtype=int), np.zeros(4, dtype=int)) == 1.0
+
+
+def test_kmeans_finds_separated_clusters():
+    rng = np.random.default_rng(1)
+    truth = np.repeat([0, 1, 2], 50)
+    X = np.array([[0, 0], [10, 0], [0, 10]])[truth] + rng.normal(scale=0.5, size=(150, 2))
+    centers, labels, inertia = kmeans(X, 3, seed=0)
+    assert adjusted_rand_index(labels, truth) == pytest.approx(1.0)
+    assert inertia < 150
+
+
+def test_log_replay_is_deterministic_and_checkpoints_the_offset(tmp_path):
+    log = tmp_path / "eventlog"
+    generator = SyntheticForecasts(seed=3)
+    written = asyncio.run(write_log(str(log), "weather-forecasts", generator.events(1500, per_event=10)))
+    assert written == 150
+
+    def replay(checkpoint=None):
+        run = Replay(subscriber(checkpoint), keep=True)
+        asyncio.run(run.run(log_batches(str(log), "weather-forecasts", 64)))
+        return run
+
+    first, second = replay(str(tmp_path / "model.ckpt")), replay()
+    assert first.events == 150 and first.periods == 1500 and first.rejected == 0
+    assert np.array_equal(first.clusters(), second.clusters())
+    assert np.allclose(first.subscriber.model.centers, second.subscriber.model.centers)
+
+    # Every replayed event is done with, so the checkpoint resumes after the last one
+    assert first.subscriber.offset == written - 1
+    assert subscriber(str(tmp_path / "model.ckpt")).offset == written - 1
+
+
+def test_file_replay_compares_against_full_batch_kmeans(tmp_path):
+    path = tmp_path / "periods.jsonl"
+    with open(path, "w") as f:
+        for data in SyntheticForecasts(seed=5).periods(1200):
+            f.write(json.dumps(data) + "\n")
+
+    run = Replay(subscriber(), keep=True)
+    asyncio.run(run.run(file_batches(str(path), 100), decoded=True))
+    assert run.periods == 1200 and run.features().shape == (1200, 2)
+
+    scores = compare(run, restarts=2)
+    assert scores["periods"] == 1200
+    assert sum(scores["streaming_sizes"]) == sum(scores["reference_sizes"]) == 1200
+    # The full-batch reference fits the periods at least as well as the streaming
+    # centers, which still agree with it better than chance
+    assert scores["reference_inertia"] <= scores["streaming_inertia"]
+    assert scores["inertia_ratio"] >= 1
+    assert 0 < scores["ari_final"] <= 1 and 0 < scores["ari_online"] <= 1
@@ -0,0 +1,34 @@
+import numpy as np
+
+from checkpoint import load_checkpoint, save_checkpoint
+from sharded_clusterer import ShardedClusterer
+from streaming_kmeans import StreamingKMeans
+
+
+def test_shards_merge_into_global_centers(tmp_path):
+    rng = np.random.default_rng(0)
+    X = np.concatenate([rng.normal(-5, 0.5, size=(200, 2)), rng.normal(5, 0.5, size=(200, 2))])
+    keys = [f"city-{i % 37}" for i in range(len(X))]
+    model = ShardedClusterer(shards=2, n_clusters=2, n_features=2, merge_every=10 ** 6)
+    try:
+        labels = model.learn_predict_many(X, keys)
+        assert labels.shape == (400,) and set(labels) <= {0, 1}
+        assert model.unmerged == 400
+
+        # Checkpointing merges into the snapshot, not into the model
+        centers = model.centers.copy()
+        path = str(tmp_path / "model.ckpt")
+        save_checkpoint(path, model)
+        assert model.unmerged == 400
+        assert np.array_equal(model.centers, centers)
+
+        model.merge()
+        assert model.unmerged == 0
+        restored = StreamingKMeans(n_clusters=2, n_features=2)
+        load_checkpoint(path, restored)
+        assert np.allclose(restored.centers, model.centers)
+        # The two blobs end up in different clusters
+        assert len(set(model.predict_many([[-5, -5], [5, 5]]))) == 2
+    finally:
+        model.close()
+    assert not any(worker.is_alive() for worker in model.workers)
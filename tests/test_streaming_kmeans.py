@@ -0,0 +1,31 @@
+import numpy as np
+
+from features import FeatureExtractor
+from streaming_kmeans import StreamingKMeans
+
+
+def period(temperature, humidity=None):
+    data = {"temperature": temperature, "units": "F", "precipitation": {"value": 0}}
+    if humidity is not None:
+        data["humidity"] = {"value": humidity}
+    return data
+
+
+def test_missing_humidity_does_not_poison_the_model():
+    extractor = FeatureExtractor(features=("temperature", "humidity"))
+    model = StreamingKMeans(n_clusters=3, n_features=2, seed=0)
+
+    X = extractor.transform([period(50, 80), period(60), period(70, 20)])
+    assert np.isnan(X[1, 1])
+    model.learn_predict_many(X)
+    assert np.isfinite(model.scaler.mean).all() and np.isfinite(model.scaler.var).all()
+    assert np.isfinite(model.centers).all()
+
+    model.learn_predict_one(extractor.transform_one(period(65)))
+    assert np.isfinite(model.scaler.mean).all()
+
+    # Cold and humid, hot and dry: still told apart after the missing values
+    for _ in range(50):
+        model.learn_predict_many(extractor.transform([period(30, 90), period(100, 10), period(65)]))
+    cold, hot = model.predict_many(extractor.transform([period(30, 90), period(100, 10)]))
+    assert cold != hot
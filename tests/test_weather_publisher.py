@@ -0,0 +1,52 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from rate_limiter import RequestLimiter
+from weather_publisher import WeatherPublisher
+
+FORECAST = {"properties": {"periods": []}}
+
+
+def forecast_app(requests):
+    async def flaky(request):
+        requests.append(request.headers.get("If-None-Match", None))
+        if len(requests) <= 2:
+            raise web.HTTPServiceUnavailable()
+        if request.headers.get("If-None-Match", None) == '"v1"':
+            raise web.HTTPNotModified(headers={"ETag": '"v1"'})
+        return web.json_response(FORECAST, headers={"ETag": '"v1"'}, content_type="application/geo+json")
+
+    async def gone(request):
+        raise web.HTTPNotFound()
+
+    app = web.Application()
+    app.router.add_get("/forecast/flaky", flaky)
+    app.router.add_get("/forecast/gone", gone)
+    return app
+
+
+def test_fetch_retries_errors_and_revalidates():
+    requests = []
+
+    async def main():
+        publisher = WeatherPublisher(transport=object(), link_cache=None, state=None)
+        publisher.limiter = RequestLimiter(rate=1000, max_retries=3, backoff=0.001)
+        limit = asyncio.Semaphore(4)
+        async with TestServer(forecast_app(requests)) as server, publisher.open_session() as session:
+            flaky, gone = str(server.make_url("/forecast/flaky")), str(server.make_url("/forecast/gone"))
+            publisher.join_cell(1, gone)
+
+            first = await publisher.fetch_forecast(session, flaky, limit)
+            publisher.state.update_validators(flaky, first[2])
+            second = await publisher.fetch_forecast(session, flaky, limit)
+            missing = await publisher.fetch_forecast(session, gone, limit)
+            return publisher, first, second, missing, gone
+
+    publisher, first, second, missing, gone = asyncio.run(main())
+    # Two 503s are retried, then the forecast is fetched conditionally
+    assert first[1] == FORECAST and requests == [None, None, None, '"v1"']
+    assert second[1] is None
+    # A forecast URL that no longer exists is dropped, to be resolved again
+    assert missing is None and gone not in publisher.cells
@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from weather_subscriber_streamkmeans import AckedOffsets, ForecastBatch, WeatherSubscriber
+
+
+def events(*offsets):
+    return [SimpleNamespace(offset=offset) for offset in offsets]
+
+
+def test_offset_only_passes_events_acked_in_order():
+    acks = AckedOffsets(offset=9)
+    first, second, third = events(10, 11, 12)
+    for event in (first, second, third, second):
+        acks.received(event)
+
+    # The later events are committed first, the earliest one is still in flight
+    acks.acked(third)
+    acks.acked(second)
+    assert acks.offset == 9
+
+    acks.acked(first)
+    assert acks.offset == 12
+    assert not acks.pending and not acks.waiting and not acks.done
+
+    # Events before the checkpoint and without offsets are not tracked
+    acks.received(SimpleNamespace(offset=5))
+    acks.received(SimpleNamespace())
+    assert not acks.pending
+
+
+class FakeEvent:
+    def __init__(self, offset):
+        self.offset = offset
+        self.mimetype = None
+        self.type = SimpleNamespace(name="ForecastPeriod", major_version=1)
+        self.outcome = None
+
+    async def ack(self):
+        self.outcome = "ack"
+
+    async def nack(self, code):
+        self.outcome = "nack"
+
+
+class FailingPipeline:
+    """
+    Accepts the results of the first event and fails on the next.
+    """
+
+    def __init__(self):
+        self.commits = []
+
+    async def publish(self, results, on_commit=None):
+        if self.commits:
+            raise ConnectionError("stream closed")
+        self.commits.append(on_commit)
+
+
+def test_failed_batch_only_nacks_events_not_yet_committed():
+    async def main():
+        subscriber = WeatherSubscriber(transport=object(), checkpoint=None, print_every=0)
+        subscriber.pipeline = FailingPipeline()
+        batch = ForecastBatch([FakeEvent(offset) for offset in range(3)])
+        for event in batch.events:
+            subscriber.acks.received(event)
+            batch.decoded.append((event, [{"city": "Chicago", "state": "Illinois"}]))
+        batch.clusters = np.zeros(3, dtype=int)
+        batch.X = np.zeros((3, 2))
+
+        with pytest.raises(ConnectionError):
+            await subscriber.publish(batch)
+        await subscriber.failed(batch, "publish", None)
+        return subscriber, batch
+
+    subscriber, batch = asyncio.run(main())
+    first, second, third = batch.events
+    # The first two events were handed to Commits, which ack or nack them
+    assert first.outcome is None and second.outcome is None
+    assert third.outcome == "nack"
+    assert len(subscriber.pipeline.commits) == 1
@@ -0,0 +1,51 @@
+import json
+
+import numpy as np
+import pytest
+
+from city_catalog import default_catalog
+from wire_format import MAX_CLUSTER, columns, decode, encode, is_binary, make_event, with_clusters
+
+
+def period(**fields):
+    data = {
+        "city_id": None, "city": None, "state": None,
+        "name": "Tonight", "summary": "Mostly Clear", "temperature": 51, "units": "F",
+        "precipitation": {"unitCode": "wmoUnit:percent", "value": 10},
+        "dewpoint": {"unitCode": "wmoUnit:degC", "value": 5.5},
+        "humidity": {"unitCode": "wmoUnit:percent", "value": None},
+        "windspeed": "5 mph", "daytime": False,
+        "start": "2023-10-17T18:00:00-05:00", "end": "2023-10-18T06:00:00-05:00",
+    }
+    data.update(fields)
+    return data
+
+
+def test_catalog_and_named_cities_round_trip():
+    catalog = default_catalog()
+    periods = [
+        # A catalog city, with and without a cluster
+        period(city_id=1, city=catalog.name(1), state=catalog.state(1), cluster=3),
+        period(city_id=2, city=catalog.name(2), state=catalog.state(2), start=None, dewpoint=None),
+        # NAMED: a city that is not in the catalog, and a publisher ID for another city
+        period(city="Nowhere", state="Nevada", cluster=MAX_CLUSTER),
+        period(city_id=1, city="Elsewhere", state="Ohio", daytime=True),
+    ]
+    decoded = decode(encode(periods))
+    assert decoded == periods
+
+    records = columns(encode(periods))
+    assert records["city"].tolist() == [1, 2, 0, 1]
+
+
+def test_clusters_that_do_not_fit_are_rejected():
+    catalog = default_catalog()
+    data = encode([period(city_id=1, city=catalog.name(1), state=catalog.state(1))])
+    assert decode(with_clusters(data, np.array([MAX_CLUSTER])))[0]["cluster"] == MAX_CLUSTER
+    with pytest.raises(ValueError):
+        with_clusters(data, np.array([MAX_CLUSTER + 1]))
+
+    # Periods with such a cluster are published as JSON instead
+    event = make_event([period(city_id=1, city=catalog.name(1), state=catalog.state(1), cluster=200)])
+    assert not is_binary(event)
+    assert json.loads(event.data)["cluster"] == 200
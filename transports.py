@@ -0,0 +1,62 @@
+"""
+A transport is the client the publisher and subscribers send and receive events with.
+Any object that implements the parts of the pyensign Ensign client used here can be
+passed in place of the name of a transport:
+
+    async ensure_topic_exists(topic_name) -> topic id
+    async topic_id(name) -> topic id
+    async publish(topic, *events, on_ack=None, on_nack=None)
+    subscribe(*topic_ids) -> async iterator of events with `data`, `mimetype`,
+                             `ack()` and `nack(code)`
+
+The built in transports are:
+
+    "ensign"        the Ensign service, with API keys loaded from client.json
+    "local"         an EventLog stored in the "eventlog" directory
+    "local:<path>"  an EventLog stored in the <path> directory
+"""
+
+import json
+
+from pyensign.ensign import Ensign
+
+from event_log import EventLog
+
+
+def load_keys(path="client.json"):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        raise OSError(f"unable to load Ensign API keys from file: ", e)
+
+
+def make_transport(transport="ensign"):
+    """
+    Create a transport from its name, or return `transport` unchanged if it is already
+    a client object.
+    """
+    if not isinstance(transport, str):
+        return transport
+
+    if transport == "ensign":
+        keys = load_keys()
+        return Ensign(
+            client_id=keys["ClientID"],
+            client_secret=keys["ClientSecret"]
+        )
+
+    if transport == "local" or transport.startswith("local:"):
+        return EventLog(transport.partition(":")[2] or "eventlog")
+
+    raise ValueError(f"unknown transport {transport!r}, expected 'ensign', 'local' or 'local:<path>'")
+
+
+def transport_argument(parser):
+    """
+    Add the --transport option to a script's argument parser.
+    """
+    parser.add_argument(
+        "--transport", default="ensign",
+        help="'ensign' (default), or 'local[:path]' to use an embedded event log",
+    )
@@ -1,16 +1,20 @@
-from pyensign.ensign import Ensign
-
-import os
-import json
+import time
 import asyncio
+import argparse
 import warnings
 
-from datetime import datetime
 
-import requests
-from requests import HTTPError, ConnectionError
-from pyensign.events import Event
-from pyensign.ensign import Ensign
+import aiohttp
+
+from wire_format import make_event
+from metrics import MetricsExporter, counter, histogram, metrics_arguments
+from city_catalog import CityCatalog
+from forecast_state import ForecastState
+from publish_pipeline import PublishPipeline
+from rate_limiter import CircuitOpen, RequestLimiter
+from refresh_scheduler import RefreshScheduler
+from transports import make_transport, transport_argument
+from forecast_link_cache import ForecastLinkCache
 
 warnings.filterwarnings("ignore")
 
@@ -21,7 +25,11 @@ class WeatherPublisher:
     WeatherPublisher queries an API for weather updates and publishes events to Ensign.
     """
 
-    def __init__(self, topic="weather-forecasts", interval=60, user=ME):
+    def __init__(self, topic="weather-forecasts", interval=60, user=ME, concurrency=32, timeout=30,
+                 link_cache="forecast_links.json", link_ttl=7 * 24 * 60 * 60,
+                 state="forecast_state.json", window=256, batch=None, rate=10, max_retries=3, jitter=0.1,
+                 url="https://api.weather.gov/points/", transport="ensign", wire="json",
+                 cities="cities.json", metrics_port=None, stats=None):
         """
         Initialize a WeatherPublisher by specifying a topic, locations, and other user-
         defined parameters.
@@ -34,91 +42,137 @@ class WeatherPublisher:
             be found at https://ensign.rotational.dev/getting-started/topics/
 
         interval : int, default: 60
-            The number of seconds to wait between API calls so that you do not anger
-            the weather API gods
-
-        locations : dict
-            A dictionary expressing the locations to retrieve weather details for.
-            Note that these should all be in the USA since NOAA is located in the US :)
+            The minimum number of seconds between two fetches of the same location, so
+            that you do not anger the weather API gods. Locations are otherwise
+            refreshed when NOAA says their forecast expires. A summary of the events
+            published is also printed every `interval` seconds.
 
         user : str
             When querying the NOAA API, as a courtesy, they like you to identify your
             app and contact info (aka User Agent details)
+
+        concurrency : int, default: 32
+            The maximum number of NOAA API requests in flight at once. This is also
+            the size of the keep-alive connection pool shared by every request.
+
+        timeout : int, default: 30
+            The number of seconds to wait on a single NOAA API request before giving
+            up on that location for the current sweep
+
+        link_cache : string, default: "forecast_links.json"
+            The file used to persist the forecast URL and grid cell of each location
+            between runs. Set to None to keep the cache in memory only.
+
+        link_ttl : int, default: 604800
+            The number of seconds a cached forecast URL is used before it is looked
+            up again
+
+        state : string, default: "forecast_state.json"
+            The file used to persist the ETag/Last-Modified of each forecast and the
+            hash of each published period, so that unchanged forecasts are neither
+            downloaded nor republished. Set to None to keep the state in memory only.
+
+        window : int, default: 256
+            The maximum number of published events that may be awaiting an ack from
+            Ensign before the publisher waits
+
+        batch : string, default: None
+            Set to "city" to publish all of the periods for a city as one event, or
+            to "sweep" to publish all of the periods of a sweep as one event. Batched
+            JSON events have a single "periods" field holding the list of periods; a
+            binary event holds any number of periods. Outside
+            of `sweep` there is no sweep, so "sweep" batches per city instead.
+
+        rate : float, default: 10
+            The maximum number of NOAA API requests started per second, across all
+            locations. The rate is halved whenever NOAA answers 429 Too Many Requests
+            and recovers as requests succeed, see `rate_limiter`.
+
+        max_retries : int, default: 3
+            The maximum number of retries of a NOAA API request that failed with a
+            429, a 5xx, a timeout or a connection error, with exponential backoff
+
+        jitter : float, default: 0.1
+            The maximum random fraction added to each location's refresh interval, to
+            spread the refreshes of locations that expire together
+
+        url : string, default: "https://api.weather.gov/points/"
+            The NOAA points endpoint, e.g. the URL of a `noaa_standin` server
+
+        transport : string or client, default: "ensign"
+            The transport to publish with, either the name of a transport ("ensign",
+            "local" or "local:<path>") or a client object, see `transports`
+
+        wire : string, default: "json"
+            The encoding of the published events, "json" or "binary" for the compact
+            format in `wire_format`. Periods that do not fit the binary schema are
+            published as JSON either way.
+
+        cities : string or CityCatalog, default: "cities.json"
+            The locations to retrieve weather details for, as a `CityCatalog` or the
+            path of a JSON list of cities to load one from. Locations are referred to
+            by their catalog ID. Note that these should all be in the USA since NOAA is
+            located in the US :)
+
+        metrics_port : int, default: None
+            Serve Prometheus metrics on this port while running, see `metrics`
+
+        stats : string, default: None
+            Periodically write the metrics to this JSON file while running
         """
 
         self.topic = topic
         self.interval = interval
-        self.locations = self._load_cities()
-        self.url = "https://api.weather.gov/points/"
+        self.catalog = cities if isinstance(cities, CityCatalog) else self._load_cities(cities)
+        self.url = url
         self.user = {"User-Agent": user}
-        self.datatype = "application/json"
-
-        keys = self._load_keys()
-
-        self.ensign = Ensign(
-            client_id=keys["ClientID"],
-            client_secret=keys["ClientSecret"]
-        )
-    
-    def _load_keys(self):
-        try:
-            f = open("client.json")
-            return json.load(f)
-        except Exception as e:
-            raise OSError(f"unable to load Ensign API keys from file: ", e)
+        self.wire = wire
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.links = ForecastLinkCache(path=link_cache, ttl=link_ttl)
+        self.state = ForecastState(path=state)
+        self.batch = batch
+        self.scheduler = RefreshScheduler(min_interval=interval, jitter=jitter)
+        # One limiter for both endpoints, since NOAA limits the requests of a client as a whole
+        self.limiter = RequestLimiter(rate=rate, max_retries=max_retries)
+
+        # Locations that share a NOAA grid cell share a forecast URL, which is only
+        # fetched once; the first location of each cell is the one that refreshes it
+        self.cells = dict()
+        self.cell_of = dict()
+        self.reset_dedup()
+
+        self.transport = make_transport(transport)
+        self.pipeline = PublishPipeline(self.transport, self.topic, window=window)
+
+        self.exporter = MetricsExporter(port=metrics_port, stats=stats, interval=interval)
+        self.request_seconds = {
+            endpoint: histogram("noaa_request_seconds", "Duration of NOAA API requests", endpoint=endpoint)
+            for endpoint in ("points", "forecast")
+        }
+        self.request_errors = {
+            endpoint: counter("noaa_request_errors_total", "NOAA API requests that failed", endpoint=endpoint)
+            for endpoint in ("points", "forecast")
+        }
+        self.unpack_seconds = histogram("stage_seconds", "Time a stage spends on an item", stage="unpack")
     
-    def _load_cities(self):
-        cities = dict()
+    def _load_cities(self, path):
         try:
-            f = open(os.path.join("cities.json"))
-            json_lines = json.load(f)
-            for l in json_lines:
-                cities[l["city"]] = {
-                    "city": str(l["city"]),
-                    "lat": str(l["latitude"]),
-                    "long": str(l["longitude"])
-                }
-            return cities
+            return CityCatalog.load(path)
         except Exception as e:
             raise OSError(f"unable to load cities from file: ", e)
 
-    async def print_ack(self, ack):
-        """
-        Enable the Ensign server to notify the Publisher the event has been acknowledged
-
-        This is optional for you, but can be very helpful for communication in
-        asynchronous contexts!
-        """
-        ts = datetime.fromtimestamp(ack.committed.seconds + ack.committed.nanos / 1e9)
-        print(f"Event committed at {ts}")
-
-    async def print_nack(self, nack):
-        """
-        Enable the Ensign server to notify the Publisher the event has NOT been
-        acknowledged
-
-        This is optional for you, but can be very helpful for communication in
-        asynchronous contexts!
-        """
-        print(f"Event was not committed with error {nack.code}: {nack.error}")
-
     def compose_query(self, location):
         """
         Combine the base URI with the lat/long query params
 
         Parameters
         ----------
-        location : dict
-            A dictionary expressing a locations to retrieve weather details for.
-            Note that it should all be in the USA since NOAA is located in the US :)
-            For example: {"lat": "64.7511", "long": "-147.3494"}
+        location : City
+            The location to retrieve weather details for, from `self.catalog`.
+            Note that it should be in the USA since NOAA is located in the US :)
         """
-        lat = location.get("lat", None)
-        long = location.get("long", None)
-        if lat is None or long is None:
-            raise Exception("unable to parse latitude/longitude from location")
-
-        return self.url + lat + "," + long
+        return f"{self.url}{location.lat},{location.lon}"
 
     def run(self):
         """
@@ -128,64 +182,472 @@ class WeatherPublisher:
 
     async def recv_and_publish(self):
         """
-        At pre-defined interval (`self.interval`), ping the api.weather.com to get 
-        weather reports for the `self.locations`.
+        Ping the api.weather.com to get weather reports for the cities of
+        `self.catalog`, each one whenever its previous forecast expires according to
+        `self.scheduler`.
 
         NOTE: this requires 2 calls to the NOAA API, per location:
             - the first request provides a lat/long and retrieves forecast URL
             - the second request provides the forecast URL and gets forecast details
+        The forecast URL is cached in `self.links`, so once a location has been
+        resolved only the second request is made until the cache entry expires.
+        The second request is conditional, and only the forecast periods that are new
+        or have changed since the last sweep are published. Locations that fall in the
+        same NOAA grid cell share a forecast URL, so it is requested once per cell and
+        the forecast is published for each of the cell's locations.
+
+        Requests for all of the locations are made concurrently (at most
+        `self.concurrency` at a time, and at most `self.limiter.bucket.rate` per second)
+        over a single pool of keep-alive connections, and each forecast is published
+        as soon as it arrives.
 
         Publish report data to the `self.topic`
         """
-        await self.ensign.ensure_topic_exists(self.topic)
+        await self.transport.ensure_topic_exists(self.topic)
+        await self.exporter.start()
+
+        async with self.open_session() as session:
+            limit = asyncio.Semaphore(self.concurrency)
+            reporter = asyncio.create_task(self.report())
+            refreshes = set()
+
+            # Group the locations by grid cell before anything is fetched, so that each
+            # cell is scheduled once. Every location that could not be resolved and
+            # every cell is due immediately, the rate limit spreads out the first pass
+            await self.resolve_cells(session, limit)
+            for city in self.catalog.ids():
+                cell = self.cell_of.get(city, None)
+                if cell is None or self.cells[cell][0] == city:
+                    self.scheduler.add(city, 0)
+
+            try:
+                async for city in self.scheduler.due():
+                    task = asyncio.create_task(
+                        self.refresh(session, self.catalog[city], limit)
+                    )
+                    refreshes.add(task)
+                    task.add_done_callback(refreshes.discard)
+            finally:
+                reporter.cancel()
+                await self.exporter.stop()
 
+    async def refresh(self, session, location, limit):
+        """
+        Fetch the forecast for a location's grid cell and publish it for every
+        location in the cell, then schedule the cell's next refresh. Errors are logged
+        and the location is retried rather than dropped from the schedule.
+        """
+        try:
+            await self._refresh(session, location, limit)
+        except Exception as e:
+            print(f"Could not refresh the forecast of {location.label}: {e!r}")
+            self.scheduler.expedite(location.id, self.scheduler.retry_at())
+
+    async def _refresh(self, session, location, limit):
+        city = location.id
+        forecast_url = await self.resolve_forecast_link(session, location, limit)
+        if forecast_url is None:
+            self.leave_cell(city)
+            self.scheduler.add(city, self.scheduler.retry_at())
+            return
+
+        if not self.join_cell(city, forecast_url):
+            # Another location refreshes this grid cell and will publish for this one
+            return
+
+        result = await self.fetch_forecast(session, forecast_url, limit)
+        if result is None:
+            # If the cell was dropped, its locations have already been rescheduled
+            if forecast_url in self.cells:
+                self.scheduler.add(city, self.scheduler.retry_at())
+            return
+
+        _, forecast, headers = result
+        self.scheduler.add(city, self.scheduler.next_refresh(headers, forecast))
+        if forecast is not None:
+            await self.publish_cell(forecast, forecast_url, headers)
+
+    async def report(self):
+        """
+        Every `self.interval` seconds persist the caches and print a summary of the
+        events published since the last report.
+        """
         while True:
-            for location in self.locations.values():
-                # Call the API for each location
-                query = self.compose_query(location)
+            await asyncio.sleep(self.interval)
+            self.links.save()
+            self.state.save()
+            print(self.pipeline.summary())
+            print(self.dedup_summary())
+            self.pipeline.reset()
+            self.reset_dedup()
+
+    async def resolve_cells(self, session, limit):
+        """
+        Resolve the forecast URL of every location concurrently and group the
+        locations by grid cell. Locations that fail to resolve are left unresolved
+        rather than failing the others.
+        """
+        locations = list(self.catalog)
+        links = await asyncio.gather(*[
+            self.resolve_forecast_link(session, location, limit)
+            for location in locations
+        ], return_exceptions=True)
+
+        for location, forecast_url in zip(locations, links):
+            city = location.id
+            if isinstance(forecast_url, BaseException):
+                print(f"Could not resolve {location.label}: {forecast_url!r}")
+                forecast_url = None
+            if forecast_url is None:
+                self.leave_cell(city)
+            else:
+                self.join_cell(city, forecast_url)
+
+    def join_cell(self, city, forecast_url):
+        """
+        Add a location to the grid cell of a forecast URL. NOAA forecast URLs are
+        unique per grid cell (gridId/gridX/gridY), so the URL identifies the cell.
 
-                # If successful, the initial response returns a link used to retrieve the full hourly forecast
-                try:
-                    response = requests.get(query).json()
-                except ConnectionError as e:
-                    print(e)
-                    continue
-                except HTTPError as e:
-                    print(e)
-                    continue
+        Returns
+        -------
+        leader : bool
+            True if this location is the one that refreshes the cell
+        """
+        current = self.cell_of.get(city, None)
+        if current == forecast_url:
+            return self.cells[forecast_url][0] == city
+        if current is not None:
+            self.leave_cell(city)
+
+        members = self.cells.setdefault(forecast_url, [])
+        members.append(city)
+        self.cell_of[city] = forecast_url
+        if len(members) == 1:
+            return True
+
+        # The new member has never been published, so the cell's next fetch must not
+        # be answered with 304 Not Modified, and it should happen soon
+        self.state.invalidate(forecast_url)
+        self.scheduler.expedite(members[0], time.time())
+        return False
+
+    def leave_cell(self, city):
+        """
+        Remove a location from its grid cell, handing the refreshes of the cell to
+        another of its locations if needed.
+        """
+        forecast_url = self.cell_of.pop(city, None)
+        if forecast_url is None:
+            return
+
+        members = self.cells[forecast_url]
+        leader = members[0] == city
+        members.remove(city)
+        if not members:
+            del self.cells[forecast_url]
+        elif leader:
+            self.scheduler.expedite(members[0], time.time())
+
+    def drop_cell(self, forecast_url):
+        """
+        Forget a grid cell whose forecast URL is no longer valid, so that each of its
+        locations is looked up again.
+        """
+        self.state.invalidate(forecast_url)
+        for city in self.cells.pop(forecast_url, []):
+            del self.cell_of[city]
+            self.links.invalidate(self.catalog.label(city))
+            self.scheduler.add(city, self.scheduler.retry_at())
+
+    def reset_dedup(self):
+        """
+        Start new grid cell deduplication counters.
+        """
+        self.cell_requests = 0
+        self.cell_locations = 0
+
+    def dedup_summary(self):
+        """
+        Summarize how many forecast requests grid cell deduplication has saved since
+        the last reset.
+        """
+        return (
+            f"refreshed {self.cell_locations} locations with {self.cell_requests} "
+            f"forecast requests ({self.cell_locations - self.cell_requests} saved by "
+            f"grid cell deduplication)"
+        )
+
+    def open_session(self):
+        """
+        Create the HTTP session used for every NOAA API request. The connector keeps
+        up to `self.concurrency` connections alive between requests and sweeps so
+        that we only pay for the TCP/TLS handshake once per connection.
+        """
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.concurrency,
+            keepalive_timeout=max(self.interval * 2, 60),
+            ttl_dns_cache=3600,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers=self.user,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            raise_for_status=True,
+        )
+
+    async def sweep(self, session):
+        """
+        Make a single pass over every location regardless of its schedule, e.g. to
+        benchmark the publisher. Forecasts are fetched concurrently and the events for
+        each location are published as soon as its forecast is available. Once every
+        event has been acked or nacked a summary of the sweep is printed.
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            The session returned by `open_session`
+        """
+        self.pipeline.reset()
+        self.reset_dedup()
 
-                forecast_url = self.parse_forecast_link(response)
+        limit = asyncio.Semaphore(self.concurrency)
+        await self.resolve_cells(session, limit)
+        tasks = [
+            asyncio.create_task(self.fetch_forecast(session, forecast_url, limit))
+            for forecast_url in list(self.cells)
+        ]
+
+        batch = []
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            if result is None:
+                continue
+            forecast_url, forecast, headers = result
+            if forecast is None:
+                continue
+
+            await self.publish_cell(forecast, forecast_url, headers, batch=batch)
+
+        if batch:
+            commits = [on_commit for _, on_commit in batch]
+
+            async def on_commit(committed):
+                for commit in commits:
+                    await commit(committed)
+
+            periods = [data for periods, _ in batch for data in periods]
+            await self.pipeline.publish(self.make_event(periods), on_commit=on_commit)
+
+        self.links.save()
+        self.state.save()
+
+        await self.pipeline.drain()
+        print(self.pipeline.summary())
+        print(self.dedup_summary())
+
+    async def publish_cell(self, forecast, forecast_url, headers, batch=None):
+        """
+        Fan a grid cell's forecast out to every location in the cell. The response
+        `headers` become the cell's validators once every event is committed. If
+        publishing fails the error is logged and the cell is fetched unconditionally
+        next time.
+        """
+        commit = ForecastCommit(self.state, forecast_url, headers)
+        try:
+            for city in list(self.cells.get(forecast_url, [])):
+                await self.publish_forecast(forecast, city, commit, batch=batch)
+        except Exception as e:
+            print(f"Could not publish the forecast of {forecast_url}: {e!r}")
+            commit.failed = True
+        finally:
+            # Events already published are still recorded as they are committed
+            commit.seal()
+
+    async def publish_forecast(self, forecast, city, commit, batch=None):
+        """
+        Unpack a forecast and publish its new or changed periods.
+
+        Parameters
+        ----------
+        forecast : dict
+            JSON formatted response from the NOAA API containing forecast details
 
+        city : int
+            The catalog ID of the city the forecast is for
+
+        commit : ForecastCommit
+            Records the periods as published once their events are committed
+
+        batch : list, default: None
+            When batching a whole sweep, the periods and their commit callback are
+            appended to this list to be published together at the end of the sweep
+        """
+        # After we retrieve and unpack the full hourly forecast, publish each period of the forecast as a new event
+        started = time.perf_counter()
+        try:
+            periods = list(self.unpack_periods(forecast, city))
+        except Exception as e:
+            print(e)
+            commit.failed = True
+            return
+        finally:
+            self.unpack_seconds.observe(time.perf_counter() - started)
+
+        key = self.catalog.label(city)
+        if self.batch == "sweep" and batch is not None:
+            if periods:
+                batch.append((periods, commit.track(key, periods)))
+        elif self.batch is not None:
+            if periods:
+                await self.pipeline.publish(self.make_event(periods), on_commit=commit.track(key, periods))
+        else:
+            for data in periods:
+                await self.pipeline.publish(self.make_event([data]), on_commit=commit.track(key, [data]))
+
+    async def fetch_forecast(self, session, forecast_url, limit):
+        """
+        Retrieve the forecast for a grid cell, waiting for a slot in `limit` before
+        the request to the NOAA API.
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            The session returned by `open_session`
+
+        forecast_url : string
+            The forecast URL of the grid cell
+
+        limit : asyncio.Semaphore
+            Bounds the number of requests in flight across the whole sweep
+
+        Returns
+        -------
+        result : tuple or None
+            The forecast URL, the JSON forecast and the response headers, or None if
+            the forecast could not be retrieved. The forecast is None if it has not
+            been modified since it was last retrieved.
+        """
+        self.cell_requests += 1
+        self.cell_locations += len(self.cells.get(forecast_url, []))
+
+        try:
+            response = await self.get_forecast(session, forecast_url, limit)
+        except CircuitOpen:
+            return None
+        except aiohttp.ClientResponseError as e:
+            print(f"Could not fetch {forecast_url}: {e.status} {e.message}")
+            if e.status == 404:
+                # The forecast URL is no longer valid, look it up again next time
+                self.drop_cell(forecast_url)
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Could not fetch {forecast_url}: {e!r}")
+            return None
+        except Exception as e:
+            print(e)
+            return None
+
+        forecast, headers = response
+        return forecast_url, forecast, headers
+
+    async def resolve_forecast_link(self, session, location, limit):
+        """
+        Return the forecast URL for a location, from `self.links` if possible and
+        otherwise by calling the `/points` endpoint and caching the result.
+
+        Returns
+        -------
+        forecast_link : string or None
+            The forecast URL, or None if it could not be determined
+        """
+        city = location.label
+        entry = self.links.get(city)
+        if entry is not None:
+            return entry["forecast"]
+
+        # Call the API for each location
+        query = self.compose_query(location)
+
+        # If successful, the initial response returns a link used to retrieve the full hourly forecast
+        try:
+            response = await self.get_json(session, query, limit)
+        except CircuitOpen:
+            return None
+        except aiohttp.ClientResponseError as e:
+            print(f"Could not resolve {city}: {e.status} {e.message}")
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Could not resolve {city}: {e!r}")
+            return None
+        except Exception as e:
+            # e.g. a malformed JSON body
+            print(f"Could not resolve {city}: {e!r}")
+            return None
+
+        try:
+            forecast_url = self.parse_forecast_link(response)
+        except Exception as e:
+            print(e)
+            self.links.invalidate(city)
+            return None
+
+        if forecast_url is None:
+            self.links.invalidate(city)
+            return None
+
+        self.links.put(city, response["properties"])
+        return forecast_url
+
+    async def get_json(self, session, url, limit):
+        """
+        GET a NOAA API url and decode the JSON body. NOAA responds with
+        `application/geo+json`, so the content type is not checked.
+        """
+        async def request():
+            async with limit:
+                started = time.perf_counter()
                 try:
-                    forecast = requests.get(forecast_url).json()
-                except ConnectionError as e:
-                    print(e)
-                    continue
-                except HTTPError as e:
-                    print(e)
-                    continue
-                except Exception as e:
-                    print(e)
-                    continue
-
-                # Define "city" variable so that we can package city name with forecast data when we unpack the response
-                city = location.get("city", None)
-
-                # After we retrieve and unpack the full hourly forecast, publish each period of the forecast as a new event
+                    async with session.get(url) as response:
+                        return await response.json(content_type=None)
+                except Exception:
+                    self.request_errors["points"].inc()
+                    raise
+                finally:
+                    self.request_seconds["points"].observe(time.perf_counter() - started)
+
+        return await self.limiter.call(request, endpoint="points")
+
+    async def get_forecast(self, session, url, limit):
+        """
+        Conditionally GET a forecast URL using the validators from the last response
+        that was published.
+
+        Returns
+        -------
+        forecast : dict or None
+            The JSON forecast, or None if NOAA answered 304 Not Modified
+
+        headers : mapping
+            The response headers
+        """
+        headers = self.state.conditional_headers(url)
+
+        async def request():
+            async with limit:
+                started = time.perf_counter()
                 try:
-                    events = self.unpack_noaa_response(forecast, city)
-                except Exception as e:
-                    print(e)
-                    continue
-
-                for event in events:
-                    await self.ensign.publish(
-                        self.topic,
-                        event,
-                        on_ack=self.print_ack,
-                        on_nack=self.print_nack,
-                    )
-            await asyncio.sleep(self.interval)
+                    async with session.get(url, headers=headers) as response:
+                        if response.status == 304:
+                            return None, response.headers
+                        return await response.json(content_type=None), response.headers
+                except Exception:
+                    self.request_errors["forecast"].inc()
+                    raise
+                finally:
+                    self.request_seconds["forecast"].observe(time.perf_counter() - started)
+
+        return await self.limiter.call(request, endpoint="forecast")
 
     def parse_forecast_link(self, message):
         """
@@ -217,14 +679,37 @@ class WeatherPublisher:
             '''
         return forecast_link
 
-    def unpack_noaa_response(self, message, city):
+    def unpack_noaa_response(self, message, city, changed_only=True):
         """
         Convert a message from the NOAA API to potentially multiple Ensign events and yield each.
 
+        See `unpack_periods` for the parameters.
+        """
+        for data in self.unpack_periods(message, city, changed_only=changed_only):
+            yield self.make_event([data])
+
+    def make_event(self, periods):
+        """
+        Encode a list of forecast periods as one Ensign event in the publisher's wire
+        format.
+        """
+        return make_event(periods, wire=self.wire)
+
+    def unpack_periods(self, message, city, changed_only=True):
+        """
+        Convert a message from the NOAA API to a dictionary per forecast period and yield each.
+
         Parameters
         ----------
         message : dict
             JSON formatted response from the NOAA API containing forecast details
+
+        city : int
+            The catalog ID of the city the forecast is for
+
+        changed_only : bool, default: True
+            Only yield the periods that are new or have changed since they were last
+            published for this city
         """
         properties = message.get("properties", None)
         if properties is None:
@@ -234,9 +719,15 @@ class WeatherPublisher:
         if periods is None:
             raise Exception("unexpected response from forecast request, no periods") #################
 
+        # The link cache and forecast state are persisted, so they are keyed by the
+        # city's name and state rather than by its position in the catalog
+        key = self.catalog.label(city)
+        starts = []
         for period in periods:
             data = {
-                "city": city,
+                "city_id": city,
+                "city": self.catalog.name(city),
+                "state": self.catalog.state(city),
                 "name": period.get("name", None),
                 "summary": period.get("shortForecast", None),
                 "temperature": period.get("temperature", None),
@@ -250,10 +741,74 @@ class WeatherPublisher:
                 "end": period.get("endTime", None),
             }
 
-            yield Event(json.dumps(data).encode("utf-8"), mimetype=self.datatype)
+            starts.append(data["start"])
+            if changed_only and not self.state.changed(key, data):
+                continue
+
+            yield data
+
+        self.state.retain(key, starts)
+
+
+class ForecastCommit:
+    """
+    ForecastCommit records a grid cell's forecast in the ForecastState as its events
+    are committed: the hashes of the periods of each event once it is acked, and the
+    cell's validators once every event is. If any event is not committed, the next
+    fetch of the cell is unconditional and its unpublished periods still count as
+    changed.
+    """
+
+    def __init__(self, state, url, headers):
+        self.state = state
+        self.url = url
+        self.headers = headers
+        self.remaining = 0
+        self.failed = False
+        self.sealed = False
+
+    def track(self, key, periods):
+        """
+        Return the on_commit callback of an event holding `periods` of city `key`.
+        """
+        self.remaining += 1
+
+        async def on_commit(committed):
+            self.remaining -= 1
+            if committed:
+                for data in periods:
+                    self.state.record(key, data)
+            else:
+                self.failed = True
+            self._done()
+
+        return on_commit
+
+    def seal(self):
+        """
+        Mark every event of the forecast as published; events may be committed before
+        or after this.
+        """
+        self.sealed = True
+        self._done()
+
+    def _done(self):
+        if self.sealed and self.remaining == 0 and not self.failed:
+            self.state.update_validators(self.url, self.headers)
 
 
 if __name__ == "__main__":
-    publisher = WeatherPublisher()
+    parser = argparse.ArgumentParser(description="Publish NOAA forecasts for the cities in cities.json")
+    transport_argument(parser)
+    parser.add_argument("--wire", choices=["json", "binary"], default="json", help="encoding of the published events")
+    parser.add_argument("--rate", type=float, default=10, help="maximum NOAA API requests per second")
+    parser.add_argument("--max-retries", type=int, default=3, help="retries of a failed NOAA API request")
+    metrics_arguments(parser, sampled=False)
+    args = parser.parse_args()
+
+    publisher = WeatherPublisher(
+        transport=args.transport, wire=args.wire, rate=args.rate, max_retries=args.max_retries,
+        metrics_port=args.metrics_port, stats=args.stats_file,
+    )
     publisher.run()
     
@@ -1,24 +1,33 @@
-import json
+import os
+import time
+import struct
 import asyncio
-from datetime import datetime
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
-from pyensign.ensign import Ensign
 from pyensign.api.v1beta1.ensign_pb2 import Nack
 from pyensign.events import Event
 
-from river import compose
-from river import cluster
-from river import stream
-from river import preprocessing
-from river.cluster import STREAMKMeans
-
-
-async def handle_ack(ack):
-    ts = datetime.fromtimestamp(ack.committed.seconds + ack.committed.nanos / 1e9)
-    print(ts)
+from checkpoint import load_checkpoint, save_checkpoint
+from cluster_windows import ClusterWindows, make_summary_event, period_ends
+from city_catalog import city_key
+from features import FEATURES, FeatureExtractor, feature_list
+from event_log import EventLog
+from micro_batcher import MicroBatcher
+from metrics import MetricsExporter, Sampler, counter, histogram, metrics_arguments, published_at
+from publish_pipeline import PublishPipeline
+from stage_pipeline import Stage, StagedPipeline
+from wire_format import (
+    MAX_CLUSTER, MIMETYPE, NO_CITY, SCHEMA, VERSION, columns, decode, decode_event,
+    is_binary, make_event, with_clusters,
+)
+from streaming_kmeans import StreamingKMeans
+from sharded_clusterer import ShardedClusterer
+from transports import make_transport, transport_argument
 
-async def handle_nack(nack):
-    print(f"Could not commit event {nack.id} with error {nack.code}: {nack.error}")
 
 class WeatherSubscriber:
     """
@@ -27,27 +36,148 @@ class WeatherSubscriber:
     to the "city-cluster-results" topic.
     """
 
-    def __init__(self, topic="weather-forecasts", pub_topic="city-clusters"):
+    def __init__(self, topic="weather-forecasts", pub_topic="city-clusters", transport="ensign",
+                 batch_size=None, batch_timeout=1.0, shards=None, merge_every=10000,
+                 checkpoint="model.ckpt", checkpoint_every=60,
+                 features=("temperature", "precipitation"), units="F",
+                 n_clusters=5, halflife=0.5, sigma=1.5, seed=0,
+                 decode_workers=1, feature_workers=1, window=256, queue_size=8,
+                 summary_window=None, summary_slide=None, snapshot_every=24,
+                 print_every=100, metrics_port=None, stats=None):
+        """
+        Parameters
+        ----------
+        topic : string, default: "weather-forecasts"
+            The name of the topic the WeatherPublisher writes forecasts to.
+
+        pub_topic : string, default: "city-clusters"
+            The name of the topic the cluster results are published to.
+
+        transport : string or client, default: "ensign"
+            The transport to subscribe and publish with, either the name of a transport
+            ("ensign", "local" or "local:<path>") or a client object, see `transports`
+
+        batch_size : int, default: None
+            Update the model in micro-batches of up to this many events (each of one
+            or more forecast periods) rather than one event at a time. None disables
+            micro-batching.
+
+        batch_timeout : float, default: 1.0
+            The maximum number of seconds an event waits for its micro-batch to fill
+
+        shards : int, default: None
+            Partition the clustering by city across this many worker processes, whose
+            centers are merged into one global model every `merge_every` forecast
+            periods. Sharding works on micro-batches, so `batch_size` defaults to 512.
+
+        merge_every : int, default: 10000
+            The number of forecast periods between two merges of the shards' centers
+
+        checkpoint : string, default: "model.ckpt"
+            The file the model is snapshotted to and restored from at startup, so a
+            restarted subscriber resumes with a warm model. None disables checkpoints.
+
+        checkpoint_every : int, default: 60
+            The minimum number of seconds between two checkpoints
+
+        features : sequence of string, default: ("temperature", "precipitation")
+            The features of each forecast period the model clusters on, see `features`
+
+        units : string, default: "F"
+            The units temperatures and dewpoints are normalized to, "F" or "C"
+
+        n_clusters : int, default: 5
+            The number of clusters
+
+        halflife : float, default: 0.5
+            How far each center moves towards the observations assigned to it, see
+            StreamingKMeans
+
+        sigma : float, default: 1.5
+            The standard deviation of the random initial centers
+
+        seed : int, default: 0
+            Seed for the initial centers, so runs over the same events are repeatable
+
+        decode_workers : int, default: 1
+            The number of batches decoded at once, in a thread pool if more than 1
+
+        feature_workers : int, default: 1
+            The number of batches whose features are extracted at once, in a thread
+            pool if more than 1
+
+        window : int, default: 256
+            The maximum number of published cluster results awaiting an ack before
+            the subscriber waits
+
+        queue_size : int, default: 8
+            The maximum number of batches (or events, without micro-batching) waiting
+            in front of each stage before the subscription is paused
+
+        summary_window : float, default: None
+            Publish a ClusterSummary event per window of this many seconds (see
+            `cluster_windows`) instead of the cluster of every forecast period. Events
+            are acked once the first summary that includes them is committed. None
+            publishes a result per event.
+
+        summary_slide : float, default: None
+            Publish a summary every this many seconds (a divisor of `summary_window`)
+            for sliding windows; None for tumbling windows
+
+        snapshot_every : int, default: 24
+            Include the cluster of every city, rather than the changes, in every this
+            many summaries
+
+        print_every : int, default: 100
+            Print one batch of cluster results in this many, 0 to print none
+
+        metrics_port : int, default: None
+            Serve Prometheus metrics on this port while subscribed, see `metrics`
+
+        stats : string, default: None
+            Periodically write the metrics to this JSON file while subscribed
+        """
 
         self.topic = topic
         self.pub_topic = pub_topic
-        
-        keys = self._load_keys()
-
-        self.ensign = Ensign(
-            client_id=keys["ClientID"],
-            client_secret=keys["ClientSecret"]
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.shards = shards
+        self.merge_every = merge_every
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        # The offsets of the events received, to checkpoint the last one acked in order
+        self.acks = AckedOffsets()
+        self.checkpointed = time.monotonic()
+        if self.shards and self.batch_size is None:
+            self.batch_size = 512
+        self.features = FeatureExtractor(features, units=units)
+        self.n_clusters = n_clusters
+        # Binary events are answered in binary only if every cluster fits the format
+        self.binary_clusters = n_clusters <= MAX_CLUSTER + 1
+        self.halflife = halflife
+        self.sigma = sigma
+        self.seed = seed
+        self.decode_workers = decode_workers
+        self.feature_workers = feature_workers
+        self.window = window
+        self.queue_size = queue_size
+        self.summary_window = summary_window
+        self.summary_slide = summary_slide
+        self.snapshot_every = snapshot_every
+        self.windows = None
+        self.executor = None
+        self.sample = Sampler(print_every)
+        self.exporter = MetricsExporter(port=metrics_port, stats=stats)
+        self.periods = counter("forecast_periods_total", "Forecast periods assigned to a cluster")
+        self.lag = histogram(
+            "forecast_lag_seconds", "Time from a forecast being published to its cluster results being committed"
         )
+        
+        self.transport = make_transport(transport)
 
         self.initialize_model()
 
-    def _load_keys(self):
-        try:
-            f = open("client.json")
-            return json.load(f)
-        except Exception as e:
-            raise OSError(f"unable to load Ensign API keys from file: ", e)
-        
     def run(self):
         """
         Run the subscriber forever.
@@ -56,64 +186,470 @@ class WeatherSubscriber:
     
     def initialize_model(self):
         """
-        Initialize river clustering model and apply standard scaler with Pipeline.
+        Initialize the streaming clustering model, which standardizes the features with
+        running statistics before clustering them.
         Parameters of the model should be tuned to produce clusters most useful to individual applications/use cases.
         """
         
-        self.model = compose.Pipeline(
-            preprocessing.StandardScaler(),
-            STREAMKMeans(chunk_size=3, n_clusters=5, halflife=0.5, sigma=1.5, seed=0)
+        if self.shards:
+            self.model = ShardedClusterer(
+                shards=self.shards, n_clusters=self.n_clusters, n_features=self.features.n_features,
+                halflife=self.halflife, sigma=self.sigma, seed=self.seed, merge_every=self.merge_every,
             )
-    
-    async def handle_event(self, event):
+            # The thread the model stage waits for the shards in
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            self.model = StreamingKMeans(
+                n_clusters=self.n_clusters, n_features=self.features.n_features,
+                halflife=self.halflife, sigma=self.sigma, seed=self.seed,
+            )
+
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            try:
+                self.acks.offset = load_checkpoint(self.checkpoint, self.model, self.features)
+                print(f"Restored the model from {self.checkpoint} at offset {self.offset}")
+            except (OSError, ValueError) as e:
+                print(f"Could not restore the model from {self.checkpoint}, starting cold: {e}")
+
+    @property
+    def offset(self):
         """
-        Decode and ack the event, input event into the clustering model:
+        The offset of the last event that was acked along with every event before it,
+        if the transport has offsets. A restarted subscriber resumes after it.
         """
-        try:
-            data = json.loads(event.data)
-        except json.JSONDecodeError:
-            print("Received invalid JSON in event payload:", event.data)
-            await event.nack(Nack.Code.UNKNOWN_TYPE)
-            return
-        
-        if data["precipitation"]["value"] is None:
-            data["precipitation"]["value"] = 0
+        return self.acks.offset
 
-        '''
-        Here we use 'x' to control which fields from the forecast are being fed to the model:
-        '''
-        x = {"temperature": data["temperature"], "precipitation": data["precipitation"]["value"]}
+    def save_model(self, force=False):
+        """
+        Snapshot the model and the offset of the last event acked in order, at most
+        once every `checkpoint_every` seconds unless forced.
+
+        The model may have learned from later events that are still in flight, which
+        are then delivered and learned from again after a restart.
+        """
+        if not self.checkpoint:
+            return
+        if not force and time.monotonic() - self.checkpointed < self.checkpoint_every:
+            return
 
-        '''
-        The first time the model is run it will be missing attributes and need to be treated differently:
-        '''
         try:
-            if len(self.model.centers) > 1:
-                cluster = self.model.predict_one(x)
-                data.update(cluster = cluster)
-            self.model = self.model.learn_one(x)
-        except AttributeError:
-            self.model = self.model.learn_one(x)
-            cluster = self.model.predict_one(x)
-            data.update(cluster = cluster)
+            save_checkpoint(self.checkpoint, self.model, self.offset, self.features)
+        except OSError as e:
+            print(f"Could not checkpoint the model to {self.checkpoint}: {e}")
+        self.checkpointed = time.monotonic()
 
-        print("New cluster results available:", data)
+    async def ack(self, event):
+        """
+        Ack an event and record that it is done with.
+        """
+        await event.ack()
+        self.acks.acked(event)
 
+    async def reject(self, event):
+        """
+        Nack an event with an invalid payload, which is not delivered again.
+        """
+        await event.nack(Nack.Code.UNKNOWN_TYPE)
+        self.acks.acked(event)
+    
+    def decode(self, batch):
+        """
+        Decode the events of a batch and key each forecast period by its city. Events
+        with an invalid payload are set aside to be nacked.
+
+        Binary events are not fully decoded: the features are read straight from their
+        fixed-width columns and the clusters are written into a copy of the payload.
+        """
+        for event in batch.events:
+            try:
+                if is_binary(event) and event.type.major_version == 2:
+                    records = columns(event.data)
+                    if not self.features.columnar or not self.binary_clusters or (records["city"] == NO_CITY).any():
+                        # Cities published without an ID are only keyed by their name, and
+                        # clusters that do not fit the format are published as JSON
+                        records = decode(event.data)
+                else:
+                    records = decode_event(event)
+            except (ValueError, struct.error) as e:
+                print("Received an invalid event payload:", e)
+                batch.rejected.append(event)
+                continue
+
+            if isinstance(records, np.ndarray):
+                batch.keys.extend(records["city"].tolist())
+            else:
+                batch.keys.extend(city_key(data) for data in records)
+            batch.decoded.append((event, records))
+        return batch
+
+    def extract(self, batch):
+        """
+        Extract the features of every forecast period of a batch.
+        """
         '''
-        Publish data to new topic once it has been assigned a cluster:
+        The features of all the binary events and of all the decoded events are
+        extracted in one call each, then the rows are put back in arrival order. See
+        the `features` argument for which fields are fed to the model.
         '''
-        event = Event(json.dumps(data).encode("utf-8"), mimetype="application/json")
-        await self.ensign.publish(self.pub_topic, event, on_ack=handle_ack, on_nack=handle_nack)
+        X = np.empty((len(batch.keys), self.features.n_features))
+        binary, dicts = [], []
+        binary_rows, dict_rows = [], []
+        position = 0
+        for _, records in batch.decoded:
+            rows = np.arange(position, position + len(records))
+            position += len(records)
+            if isinstance(records, np.ndarray):
+                binary.append(records)
+                binary_rows.append(rows)
+            else:
+                dicts.extend(records)
+                dict_rows.append(rows)
+        if binary:
+            X[np.concatenate(binary_rows)] = self.features.transform_columns(np.concatenate(binary))
+        if dicts:
+            X[np.concatenate(dict_rows)] = self.features.transform(dicts)
+        batch.X = X
+        return batch
+
+    async def learn(self, batch):
+        """
+        Update the model with the forecast periods of a batch and assign each to a
+        cluster. This stage is never concurrent, so the model sees the batches in
+        order.
+        """
+        if len(batch.X):
+            if self.shards:
+                # Wait for the shards in a thread so the event loop keeps consuming
+                batch.clusters = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.model.learn_predict_many, batch.X, batch.keys
+                )
+            else:
+                batch.clusters = self.model.learn_predict_many(batch.X)
+
+        self.save_model()
+        return batch
+
+    async def publish(self, batch):
+        """
+        Publish the cluster results of a batch, in the wire format each event arrived
+        in, and ack each event once all of its results are committed.
+        """
+        for event in batch.rejected:
+            batch.settled.add(id(event))
+            await self.reject(event)
+        if not batch.decoded:
+            return
+        if self.windows is not None:
+            await self.aggregate(batch)
+            return
+
+        position = 0
+        for event, records in batch.decoded:
+            labels = batch.clusters[position:position + len(records)]
+            position += len(records)
+
+            if isinstance(records, np.ndarray):
+                results = [Event(
+                    with_clusters(event.data, labels), mimetype=MIMETYPE,
+                    schema_name=SCHEMA, schema_version=VERSION,
+                )]
+            else:
+                for data, cluster in zip(records, labels):
+                    data.update(cluster = int(cluster))
+                if is_binary(event) and self.binary_clusters:
+                    results = [make_event(records, wire="binary")]
+                else:
+                    results = [make_event([data], wire="json") for data in records]
+
+            batch.settled.add(id(event))
+            if not results:
+                await self.ack(event)
+                continue
+            commit = Commit(event, len(results), self.lag, acks=self.acks)
+            await self.pipeline.publish(results, on_commit=commit)
+
+        self.periods.inc(len(batch.X))
+        if self.sample():
+            print(f"New cluster results available for {len(batch.X)} forecast periods")
+
+    async def aggregate(self, batch):
+        """
+        Add the cluster results of a batch to the current window, publishing the
+        summary of the last window if it has ended.
+        """
+        sources, ends = [], []
+        for event, records in batch.decoded:
+            if len(records):
+                sources.append(event)
+                ends.append(period_ends(records))
+            else:
+                batch.settled.add(id(event))
+                await self.ack(event)
+        ends = np.concatenate(ends) if ends else np.zeros(0)
+        self.windows.add(batch.keys, batch.X, batch.clusters, sources, ends=ends)
+        # The window acks or nacks its events once its summary is committed
+        batch.settled.update(id(event) for event in sources)
+        self.periods.inc(len(batch.X))
+        if self.windows.due():
+            await self.publish_window()
+
+    async def publish_window(self, final=False):
+        """
+        Publish the summary of the last window that ended (or the one in progress if
+        `final`), acking its events once the summary is committed.
+        """
+        summary, sources = self.windows.close(final=final, centroids=self.centroids())
+        if summary is None:
+            for event in sources:
+                await self.ack(event)
+            return
+
+        commits = [Commit(event, 1, self.lag, acks=self.acks) for event in sources]
+        await self.pipeline.publish(make_summary_event(summary), on_commit=CommitAll(commits))
+        if self.sample():
+            print(
+                f"New cluster summary for {summary['start']} to {summary['end']}: "
+                f"{summary['periods']} forecast periods, {len(summary['changed'])} cities changed"
+            )
+
+    async def close_windows(self):
+        """
+        Publish the summary of every window as it ends, including when no events arrive.
+        """
+        while True:
+            await asyncio.sleep(max(0, self.windows.next_end() - time.time()))
+            await self.publish_window()
+
+    def centroids(self):
+        """
+        Return the model's centers in feature units.
+        """
+        std = np.sqrt(self.model.scaler.var)
+        std[std == 0] = 1
+        return self.model.centers * std + self.model.scaler.mean
+
+    async def failed(self, batch, stage, error):
+        """
+        Nack the events of a batch a stage failed on, so that they are delivered again.
+        Events that were already acked, rejected or handed to a Commit are left to it.
+        """
+        for event in batch.events:
+            if id(event) not in batch.settled:
+                await event.nack(Nack.Code.UNPROCESSED)
+
+    async def handle_event(self, event):
+        """
+        Put a single event through the stages of a running subscription.
+        """
+        await self.handle_batch([event])
+
+    async def handle_batch(self, events):
+        """
+        Put a micro-batch of events through the stages of a running subscription.
+        """
+        for event in events:
+            self.acks.received(event)
+        await self.stages.put(ForecastBatch(events))
 
     async def subscribe(self):
         """
-        Subscribe to the weather report topic and parse the events.
+        Subscribe to the weather report topic and run the events through the decode,
+        features, model and publish stages, one at a time or in micro-batches if
+        `self.batch_size` is set.
+
+        The stages are connected by bounded queues, so when the model or Ensign falls
+        behind the subscription stops reading rather than buffering events. Each event
+        is acked once its cluster results are committed downstream, or nacked to be
+        delivered again if they are not.
+
+        With `summary_window` set, a summary of the clusters is published per window
+        instead of a result per event.
+
+        When the model was restored from a checkpoint and the transport is the local
+        event log, the subscription resumes right after the last event that was acked
+        along with every event before it. Ensign subscriptions start from the live stream.
         """
-        id = await self.ensign.topic_id(self.topic)
-        async for event in self.ensign.subscribe(id):
-            await self.handle_event(event)
-            
+        id = await self.transport.topic_id(self.topic)
+        resume = dict()
+        if self.offset is not None and isinstance(self.transport, EventLog):
+            resume["offset"] = self.offset + 1
+
+        self.pipeline = PublishPipeline(self.transport, self.pub_topic, window=self.window)
+        self.stages = StagedPipeline([
+            Stage("decode", self.decode, concurrency=self.decode_workers),
+            Stage("features", self.extract, concurrency=self.feature_workers),
+            Stage("model", self.learn),
+            Stage("publish", self.publish),
+        ], queue_size=self.queue_size, on_error=self.failed)
+        self.stages.start()
+        await self.exporter.start()
+        closer = None
+        if self.summary_window:
+            self.windows = ClusterWindows(
+                self.summary_window, self.summary_slide, n_clusters=self.n_clusters,
+                features=self.features.features, snapshot_every=self.snapshot_every,
+            )
+            closer = asyncio.create_task(self.close_windows())
+
+        try:
+            if self.batch_size is None:
+                async for event in self.transport.subscribe(id, **resume):
+                    await self.handle_event(event)
+            else:
+                batcher = MicroBatcher(self.handle_batch, size=self.batch_size, timeout=self.batch_timeout)
+                async for event in self.transport.subscribe(id, **resume):
+                    await batcher.add(event)
+                await batcher.flush()
+
+            await self.stages.close()
+            if self.windows is not None:
+                await self.publish_window(final=True)
+            await self.pipeline.drain()
+        finally:
+            if closer is not None:
+                closer.cancel()
+            self.stages.cancel()
+            if self.executor is not None:
+                # A cancelled model stage may still be waiting for the shards
+                await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+            self.save_model(force=True)
+            if self.shards:
+                self.model.close()
+            await self.exporter.stop()
+
+
+class ForecastBatch:
+    """
+    ForecastBatch carries the events of a micro-batch (or a single event) through the
+    stages of the WeatherSubscriber.
+    """
+
+    def __init__(self, events):
+        self.events = events
+        # (event, records) of every valid event, and the events to nack
+        self.decoded = []
+        self.rejected = []
+        # The ids of the events acked, nacked or handed to a Commit by the publish stage
+        self.settled = set()
+        # The city, features and cluster of every forecast period, in order
+        self.keys = []
+        self.X = None
+        self.clusters = None
+
+
+class Commit:
+    """
+    Commit acks an event once every one of its cluster results has been acked, or
+    nacks it to be delivered again as soon as one of them is not. The time from the
+    event being published to its results being committed is observed in `lag`.
+    """
+
+    def __init__(self, event, results, lag=None, acks=None):
+        self.event = event
+        self.remaining = results
+        self.failed = False
+        self.lag = lag
+        self.acks = acks
+
+    async def __call__(self, committed):
+        if self.failed:
+            return
+        if not committed:
+            self.failed = True
+            await self.event.nack(Nack.Code.DELIVER_AGAIN_ANY)
+            return
+
+        self.remaining -= 1
+        if self.remaining == 0:
+            await self.event.ack()
+            if self.acks is not None:
+                self.acks.acked(self.event)
+            published = published_at(self.event)
+            if self.lag is not None and published is not None:
+                self.lag.observe(time.time() - published)
+
+
+class CommitAll:
+    """
+    CommitAll passes the outcome of one published event, e.g. a window summary, on to
+    the Commits of every event it was derived from.
+    """
+
+    def __init__(self, commits):
+        self.commits = commits
+
+    async def __call__(self, committed):
+        for commit in self.commits:
+            await commit(committed)
+
+
+class AckedOffsets:
+    """
+    AckedOffsets tracks the offset of the last event that was acked (or nacked not to
+    be delivered again) along with every event received before it. Events are acked
+    out of order as their results are committed, so an event the model has learned
+    from may still be lost if it is not committed; the subscriber checkpoints and
+    resumes from this offset instead.
+    """
+
+    def __init__(self, offset=None):
+        self.offset = offset
+        # The offsets received and not yet passed by `offset`, in order, and those done
+        self.pending = deque()
+        self.waiting = set()
+        self.done = set()
+
+    def received(self, event):
+        offset = getattr(event, "offset", None)
+        if offset is None or offset in self.waiting:
+            # Events without offsets are not tracked, redelivered events already are
+            return
+        if self.offset is not None and offset <= self.offset:
+            return
+        self.pending.append(offset)
+        self.waiting.add(offset)
+
+    def acked(self, event):
+        offset = getattr(event, "offset", None)
+        if offset not in self.waiting:
+            return
+        self.done.add(offset)
+        while self.pending and self.pending[0] in self.done:
+            self.offset = self.pending.popleft()
+            self.waiting.remove(self.offset)
+            self.done.remove(self.offset)
+
+
 if __name__ == "__main__":
-    subscriber = WeatherSubscriber()
+    parser = argparse.ArgumentParser(description="Cluster the weather forecasts by city")
+    transport_argument(parser)
+    parser.add_argument("--batch-size", type=int, default=None, help="update the model in micro-batches of this many events")
+    parser.add_argument("--batch-timeout", type=float, default=1.0, help="maximum seconds to wait for a micro-batch to fill")
+    parser.add_argument("--shards", type=int, default=None, help="cluster across this many worker processes")
+    parser.add_argument("--checkpoint", default="model.ckpt", help="model checkpoint file, or '' to disable")
+    parser.add_argument("--checkpoint-every", type=int, default=60, help="minimum seconds between checkpoints")
+    parser.add_argument("--features", type=feature_list, default=["temperature", "precipitation"],
+                        help=f"comma separated features to cluster on, from {','.join(FEATURES)}")
+    parser.add_argument("--units", choices=["F", "C"], default="F", help="temperature units of the features")
+    parser.add_argument("--decode-workers", type=int, default=1, help="batches decoded concurrently")
+    parser.add_argument("--feature-workers", type=int, default=1, help="batches whose features are extracted concurrently")
+    parser.add_argument("--window", type=int, default=256, help="maximum results awaiting an ack")
+    parser.add_argument("--queue-size", type=int, default=8, help="maximum batches waiting in front of each stage")
+    parser.add_argument("--summary-window", type=float, default=None, metavar="SECONDS",
+                        help="publish a cluster summary per window of this many seconds instead of every result")
+    parser.add_argument("--summary-slide", type=float, default=None, metavar="SECONDS",
+                        help="publish a summary every this many seconds, for sliding windows")
+    parser.add_argument("--snapshot-every", type=int, default=24, help="summaries between two full membership snapshots")
+    metrics_arguments(parser)
+    args = parser.parse_args()
+
+    subscriber = WeatherSubscriber(
+        transport=args.transport, batch_size=args.batch_size, batch_timeout=args.batch_timeout,
+        shards=args.shards, checkpoint=args.checkpoint or None, checkpoint_every=args.checkpoint_every,
+        features=args.features, units=args.units, decode_workers=args.decode_workers,
+        feature_workers=args.feature_workers, window=args.window, queue_size=args.queue_size,
+        summary_window=args.summary_window, summary_slide=args.summary_slide, snapshot_every=args.snapshot_every,
+        print_every=args.print_every, metrics_port=args.metrics_port, stats=args.stats_file,
+    )
     subscriber.run()
   
\ No newline at end of file
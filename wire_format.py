@@ -0,0 +1,355 @@
+"""
+A compact binary encoding of forecast periods, used on the weather-forecasts and
+city-clusters topics in place of JSON.
+
+Events in this format have the application/octet-stream mimetype and the schema type
+ForecastPeriod 2.x.x. A payload is the number of periods, one fixed-width RECORD per
+period, then the variable-length strings of every period in order:
+
+    count    uint32
+    records  count x RECORD (37 bytes each, little-endian, packed)
+    strings  per period: name, summary, windspeed and, for NAMED cities, the city
+             and state; each a uint16 length (0xFFFF for None) + UTF-8
+
+Cities are referred to by their ID in the city catalog of cities.json. A city that is
+not in that catalog, or whose ID there is a different city, is NAMED: its name and
+state are sent as strings along with the publisher's ID for it (0 if none). Timestamps are epoch seconds plus the
+UTC offset in minutes, and the NOAA unit codes are implied by the schema. Missing values
+are NULL_INT for integers, NaN for floats, or a bit in `flags`. Dewpoints are float32,
+so they round-trip to about 7 significant digits.
+
+Periods that do not fit the schema (e.g. unexpected unit codes, fractional
+percentages or clusters above MAX_CLUSTER) are published as JSON instead, so JSON remains the fallback and every
+subscriber accepts both. Version 2 widened the city ID to 32 bits and added NAMED
+cities with a state; version 1 payloads are no longer decoded.
+"""
+
+import json
+import struct
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from pyensign import mimetypes as mtype
+from pyensign.events import Event
+
+from city_catalog import default_catalog
+
+
+MIMETYPE = "application/octet-stream"
+SCHEMA = "ForecastPeriod"
+VERSION = "2.0.0"
+
+RECORD = np.dtype([
+    ("city", "<u4"),
+    ("temperature", "<i2"),
+    ("precipitation", "<i2"),
+    ("humidity", "<i2"),
+    ("dewpoint", "<f4"),
+    ("start", "<i8"),
+    ("end", "<i8"),
+    ("start_offset", "<i2"),
+    ("end_offset", "<i2"),
+    ("units", "u1"),
+    ("flags", "u1"),
+    ("cluster", "i1"),
+])
+# The same layout as RECORD, for packing and unpacking one period at a time
+PACKED = struct.Struct("<IhhhfqqhhBBb")
+
+COUNT = struct.Struct("<I")
+LENGTH = struct.Struct("<H")
+
+NULL_INT = -32768
+NULL_STRING = 0xFFFF
+NO_CITY = 0
+NO_CLUSTER = -1
+# The largest cluster that fits the signed 8 bit cluster field
+MAX_CLUSTER = 127
+
+# flags
+DAYTIME = 1
+NO_DAYTIME = 2
+NO_PRECIPITATION = 4
+NO_DEWPOINT = 8
+NO_HUMIDITY = 16
+NO_START = 32
+NO_END = 64
+NAMED = 128
+
+UNIT_CODES = {
+    "precipitation": "wmoUnit:percent",
+    "dewpoint": "wmoUnit:degC",
+    "humidity": "wmoUnit:percent",
+}
+
+
+@lru_cache(maxsize=64)
+def _tz(minutes):
+    return timezone(timedelta(minutes=minutes))
+
+
+# Forecast periods share a handful of start and end times, so conversions are cached
+@lru_cache(maxsize=4096)
+def _encode_time(value):
+    if value is None:
+        return 0, 0
+    ts = datetime.fromisoformat(value)
+    if ts.tzinfo is None or ts.microsecond:
+        raise ValueError(f"cannot encode timestamp {value!r}")
+    return int(ts.timestamp()), int(ts.utcoffset().total_seconds()) // 60
+
+
+@lru_cache(maxsize=4096)
+def _decode_time(epoch, offset):
+    return datetime.fromtimestamp(int(epoch), _tz(int(offset))).isoformat()
+
+
+def _encode_int(value):
+    if value is None:
+        return NULL_INT
+    if value != int(value) or not NULL_INT < value < 32768:
+        raise ValueError(f"cannot encode {value!r} as a 16 bit integer")
+    return int(value)
+
+
+def _encode_cluster(value):
+    if value is None:
+        return NO_CLUSTER
+    if value != int(value) or not 0 <= value <= MAX_CLUSTER:
+        raise ValueError(f"cannot encode cluster {value!r}, the largest is {MAX_CLUSTER}")
+    return int(value)
+
+
+def _measurement(data, field):
+    """
+    Return the value of a NOAA {"unitCode", "value"} field, checking its unit code.
+    """
+    measurement = data.get(field, None)
+    if measurement is None:
+        return None, True
+    if measurement.get("unitCode", None) != UNIT_CODES[field]:
+        raise ValueError(f"unexpected unit code for {field}: {measurement.get('unitCode')!r}")
+    return measurement.get("value", None), False
+
+
+def _encode_string(value, parts):
+    if value is None:
+        parts.append(LENGTH.pack(NULL_STRING))
+        return
+    encoded = value.encode("utf-8")
+    if len(encoded) >= NULL_STRING:
+        raise ValueError("string is too long to encode")
+    parts.append(LENGTH.pack(len(encoded)))
+    parts.append(encoded)
+
+
+def encode(periods):
+    """
+    Encode a list of forecast period dicts (as produced by WeatherPublisher, with an
+    optional "cluster") in the binary format.
+
+    Raises
+    ------
+    ValueError
+        If a period does not fit the schema and has to be sent as JSON instead
+    """
+    catalog = default_catalog()
+    records = []
+    strings = []
+
+    for data in periods:
+        precipitation, no_precipitation = _measurement(data, "precipitation")
+        humidity, no_humidity = _measurement(data, "humidity")
+        dewpoint, no_dewpoint = _measurement(data, "dewpoint")
+        start, start_offset = _encode_time(data.get("start", None))
+        end, end_offset = _encode_time(data.get("end", None))
+
+        units = data.get("units", None)
+        if units is not None and len(units) != 1:
+            raise ValueError(f"cannot encode temperature units {units!r}")
+
+        daytime = data.get("daytime", None)
+        flags = (
+            (NO_DAYTIME if daytime is None else DAYTIME if daytime else 0)
+            | (NO_PRECIPITATION if no_precipitation else 0)
+            | (NO_DEWPOINT if no_dewpoint else 0)
+            | (NO_HUMIDITY if no_humidity else 0)
+            | (NO_START if data.get("start", None) is None else 0)
+            | (NO_END if data.get("end", None) is None else 0)
+        )
+
+        name, state = data["city"], data.get("state", None)
+        city = data.get("city_id", None)
+        if city is None:
+            city = catalog.id_of(name, state) or NO_CITY
+            named = city == NO_CITY
+        else:
+            named = city not in catalog or catalog.name(city) != name or catalog.state(city) != state
+        flags |= NAMED if named else 0
+        records.append(PACKED.pack(
+            city,
+            _encode_int(data.get("temperature", None)),
+            _encode_int(precipitation),
+            _encode_int(humidity),
+            float("nan") if dewpoint is None else dewpoint,
+            start, end, start_offset, end_offset,
+            0 if units is None else ord(units),
+            flags,
+            _encode_cluster(data.get("cluster", None)),
+        ))
+
+        _encode_string(data.get("name", None), strings)
+        _encode_string(data.get("summary", None), strings)
+        _encode_string(data.get("windspeed", None), strings)
+        if named:
+            _encode_string(name, strings)
+            _encode_string(state, strings)
+
+    return COUNT.pack(len(periods)) + b"".join(records) + b"".join(strings)
+
+
+def columns(data):
+    """
+    Return the fixed-width fields of a binary payload as a read-only NumPy structured
+    array, without decoding any strings.
+    """
+    count, = COUNT.unpack_from(data)
+    return np.frombuffer(data, dtype=RECORD, count=count, offset=COUNT.size)
+
+
+def with_clusters(data, clusters):
+    """
+    Return a copy of a binary payload with the cluster of each period set, leaving
+    every other field as it is.
+
+    Raises
+    ------
+    ValueError
+        If a cluster is negative or larger than MAX_CLUSTER
+    """
+    clusters = np.asarray(clusters)
+    if len(clusters) and (clusters.min() < 0 or clusters.max() > MAX_CLUSTER):
+        raise ValueError(f"cannot encode clusters outside of 0 to {MAX_CLUSTER}")
+    payload = bytearray(data)
+    count, = COUNT.unpack_from(payload)
+    records = np.frombuffer(payload, dtype=RECORD, count=count, offset=COUNT.size)
+    records["cluster"] = clusters
+    return bytes(payload)
+
+
+def _decode_string(data, position):
+    length, = LENGTH.unpack_from(data, position)
+    position += LENGTH.size
+    if length == NULL_STRING:
+        return None, position
+    return data[position:position + length].decode("utf-8"), position + length
+
+
+def decode(data):
+    """
+    Decode a binary payload into forecast period dicts in the same shape as the JSON
+    events, including "cluster" for periods that have one.
+    """
+    catalog = default_catalog()
+    count, = COUNT.unpack_from(data)
+    position = COUNT.size + count * PACKED.size
+    records = PACKED.iter_unpack(data[COUNT.size:position])
+
+    periods = []
+    for (city, temperature, precipitation, humidity, dewpoint, start, end,
+         start_offset, end_offset, units, flags, cluster) in records:
+        name, position = _decode_string(data, position)
+        summary, position = _decode_string(data, position)
+        windspeed, position = _decode_string(data, position)
+        if flags & NAMED:
+            city_name, position = _decode_string(data, position)
+            state, position = _decode_string(data, position)
+        elif city in catalog:
+            city_name, state = catalog.name(city), catalog.state(city)
+        else:
+            raise ValueError(f"unknown city ID {city}")
+
+        period = {
+            "city_id": city or None,
+            "city": city_name,
+            "state": state,
+            "name": name,
+            "summary": summary,
+            "temperature": None if temperature == NULL_INT else temperature,
+            "units": chr(units) if units else None,
+            "precipitation": None if flags & NO_PRECIPITATION else {
+                "unitCode": UNIT_CODES["precipitation"],
+                "value": None if precipitation == NULL_INT else precipitation,
+            },
+            "dewpoint": None if flags & NO_DEWPOINT else {
+                "unitCode": UNIT_CODES["dewpoint"],
+                "value": None if dewpoint != dewpoint else dewpoint,
+            },
+            "humidity": None if flags & NO_HUMIDITY else {
+                "unitCode": UNIT_CODES["humidity"],
+                "value": None if humidity == NULL_INT else humidity,
+            },
+            "windspeed": windspeed,
+            "daytime": None if flags & NO_DAYTIME else bool(flags & DAYTIME),
+            "start": None if flags & NO_START else _decode_time(start, start_offset),
+            "end": None if flags & NO_END else _decode_time(end, end_offset),
+        }
+        if cluster != NO_CLUSTER:
+            period["cluster"] = cluster
+        periods.append(period)
+    return periods
+
+
+def is_binary(event):
+    """
+    Return True if the event carries forecast periods in the binary format.
+    """
+    return event.mimetype == mtype.ApplicationOctetStream and event.type.name == SCHEMA
+
+
+def make_event(periods, wire="binary"):
+    """
+    Encode a list of forecast periods as one event in the requested wire format,
+    falling back to JSON if the periods do not fit the binary schema. A single JSON
+    period is sent as a bare object, several as {"periods": [...]}.
+
+    Parameters
+    ----------
+    periods : list of dict
+        The forecast periods
+
+    wire : string, default: "binary"
+        "binary" or "json"
+    """
+    if wire == "binary":
+        try:
+            return Event(encode(periods), mimetype=MIMETYPE, schema_name=SCHEMA, schema_version=VERSION)
+        except (ValueError, TypeError, OverflowError) as e:
+            print(f"Publishing {len(periods)} forecast periods as JSON: {e}")
+
+    data = periods[0] if len(periods) == 1 else {"periods": periods}
+    return Event(json.dumps(data).encode("utf-8"), mimetype="application/json")
+
+
+def decode_event(event):
+    """
+    Decode the forecast periods of an event in either wire format.
+
+    Raises
+    ------
+    ValueError
+        If the payload is not a valid JSON object or uses an unsupported schema version
+    """
+    if is_binary(event):
+        if getattr(event.type, "major_version", None) != 2:
+            raise ValueError(f"unsupported {SCHEMA} schema version {event.type.semver()}")
+        try:
+            return decode(event.data)
+        except (struct.error, UnicodeDecodeError, IndexError) as e:
+            raise ValueError(f"malformed {SCHEMA} payload: {e}")
+
+    data = json.loads(event.data)
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, not {type(data).__name__}")
+    return data.get("periods", [data])